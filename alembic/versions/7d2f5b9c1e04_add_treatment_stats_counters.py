@@ -0,0 +1,115 @@
+"""add treatment stats counters
+
+Revision ID: 7d2f5b9c1e04
+Revises: b41d7c2e9a53
+Create Date: 2026-10-18 18:21:09.640117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f5b9c1e04'
+down_revision: Union[str, None] = 'b41d7c2e9a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (dimension, key) counts of the changed rows, applied with the given sign
+DELTA = """
+    INSERT INTO treatment_stats (dimension, key, count)
+    SELECT dimension, key, {sign} count(*) FROM (
+        SELECT 'diagnosis' AS dimension, r.diagnosis AS key FROM {rows} r
+        UNION ALL SELECT 'current_state', r.current_state FROM {rows} r
+        UNION ALL SELECT 'speciality', m.speciality FROM {rows} r JOIN medics m ON m.id = r.medic_id
+        UNION ALL SELECT 'month', to_char(date_trunc('month', r.date_start), 'YYYY-MM') FROM {rows} r
+    ) changed
+    GROUP BY dimension, key
+    ON CONFLICT (dimension, key) DO UPDATE SET count = treatment_stats.count + EXCLUDED.count;
+"""
+
+
+def upgrade() -> None:
+    op.create_table('treatment_stats',
+                    sa.Column('dimension', sa.String(length=20), nullable=False),
+                    sa.Column('key', sa.String(length=150), nullable=False),
+                    sa.Column('count', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('dimension', 'key', name='treatment_stats_pkey')
+                    )
+    op.execute(f"""
+        CREATE FUNCTION treatments_apply_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                {DELTA.format(sign='-', rows='old_rows')}
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {DELTA.format(sign='', rows='new_rows')}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_stats_insert AFTER INSERT ON treatments
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_stats_update AFTER UPDATE ON treatments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_stats_delete AFTER DELETE ON treatments
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()
+    """)
+    # the speciality of a medic's treatments moves with the medic; on delete the medic row is
+    # gone before the cascaded treatments are, so its share is taken off here
+    op.execute("""
+        CREATE FUNCTION medics_apply_stats() RETURNS trigger AS $$
+        DECLARE
+            n bigint;
+        BEGIN
+            IF TG_OP = 'UPDATE' AND NEW.speciality IS NOT DISTINCT FROM OLD.speciality THEN
+                RETURN NEW;
+            END IF;
+            SELECT count(*) INTO n FROM treatments WHERE medic_id = OLD.id;
+            IF n > 0 THEN
+                UPDATE treatment_stats SET count = count - n
+                WHERE dimension = 'speciality' AND key = OLD.speciality;
+                IF TG_OP = 'UPDATE' THEN
+                    INSERT INTO treatment_stats (dimension, key, count) VALUES ('speciality', NEW.speciality, n)
+                    ON CONFLICT (dimension, key) DO UPDATE SET count = treatment_stats.count + EXCLUDED.count;
+                END IF;
+            END IF;
+            RETURN CASE WHEN TG_OP = 'UPDATE' THEN NEW ELSE OLD END;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER medics_stats BEFORE UPDATE OF speciality OR DELETE ON medics
+        FOR EACH ROW EXECUTE FUNCTION medics_apply_stats()
+    """)
+    op.execute("""
+        INSERT INTO treatment_stats (dimension, key, count)
+        SELECT dimension, key, count(*) FROM (
+            SELECT 'diagnosis' AS dimension, t.diagnosis AS key FROM treatments t
+            UNION ALL SELECT 'current_state', t.current_state FROM treatments t
+            UNION ALL SELECT 'speciality', m.speciality FROM treatments t JOIN medics m ON m.id = t.medic_id
+            UNION ALL SELECT 'month', to_char(date_trunc('month', t.date_start), 'YYYY-MM') FROM treatments t
+        ) existing
+        GROUP BY dimension, key
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER medics_stats ON medics")
+    op.execute("DROP FUNCTION medics_apply_stats()")
+    op.execute("DROP TRIGGER treatments_stats_delete ON treatments")
+    op.execute("DROP TRIGGER treatments_stats_update ON treatments")
+    op.execute("DROP TRIGGER treatments_stats_insert ON treatments")
+    op.execute("DROP FUNCTION treatments_apply_stats()")
+    op.drop_table('treatment_stats')
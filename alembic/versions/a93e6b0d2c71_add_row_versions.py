@@ -0,0 +1,71 @@
+"""add row versions
+
+Revision ID: a93e6b0d2c71
+Revises: 7d2f5b9c1e04
+Create Date: 2026-10-18 18:47:55.203664
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a93e6b0d2c71'
+down_revision: Union[str, None] = '7d2f5b9c1e04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# only the columns the API returns bump the version, so e.g. search_data refreshes keep ETags valid
+VERSIONED_TABLES = {
+    'patients': ('full_name', 'date_of_birth', 'policy_number', 'social_status'),
+    'treatments': ('diagnosis', 'current_state', 'date_start', 'date_end', 'patient_id', 'medic_id'),
+    'medics': ('full_name', 'speciality', 'exp_years'),
+}
+
+
+def upgrade() -> None:
+    # version backs the ETags of the read endpoints; bumped by trigger so every writer counts
+    op.execute("""
+        CREATE FUNCTION bump_row_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table, columns in VERSIONED_TABLES.items():
+        old = ', '.join(f'OLD.{column}' for column in columns)
+        new = ', '.join(f'NEW.{column}' for column in columns)
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        op.execute(f"""
+            CREATE TRIGGER {table}_version BEFORE UPDATE ON {table}
+            FOR EACH ROW WHEN (({old}) IS DISTINCT FROM ({new})) EXECUTE FUNCTION bump_row_version()
+        """)
+
+    # updated_at backs Last-Modified of /api/treatments/stats
+    op.add_column('treatment_stats', sa.Column('updated_at', sa.DateTime(timezone=True),
+                                               server_default=sa.text('now()'), nullable=False))
+    op.execute("""
+        CREATE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := now();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER treatment_stats_updated_at BEFORE UPDATE ON treatment_stats
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER treatment_stats_updated_at ON treatment_stats")
+    op.execute("DROP FUNCTION touch_updated_at()")
+    op.drop_column('treatment_stats', 'updated_at')
+    for table in VERSIONED_TABLES:
+        op.execute(f"DROP TRIGGER {table}_version ON {table}")
+        op.drop_column(table, 'version')
+    op.execute("DROP FUNCTION bump_row_version()")
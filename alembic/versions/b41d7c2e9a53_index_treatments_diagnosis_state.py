@@ -0,0 +1,28 @@
+"""index treatments by diagnosis and state
+
+Revision ID: b41d7c2e9a53
+Revises: fcee0cfa8a65
+Create Date: 2026-10-18 18:02:37.915204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41d7c2e9a53'
+down_revision: Union[str, None] = 'fcee0cfa8a65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # patient_id last so search_patients' EXISTS is answered from the index alone
+    op.create_index('ix_treatments_diagnosis_state_patient', 'treatments',
+                    ['diagnosis', 'current_state', 'patient_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_treatments_diagnosis_state_patient', table_name='treatments')
@@ -0,0 +1,79 @@
+"""add jobs
+
+Revision ID: b52e07c9d314
+Revises: f3b90d6e2a58
+Create Date: 2026-10-18 23:12:40.771093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52e07c9d314'
+down_revision: Union[str, None] = 'f3b90d6e2a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('jobs',
+                    sa.Column('id', sa.BigInteger(), nullable=False),
+                    sa.Column('kind', sa.String(length=50), nullable=False),
+                    sa.Column('params', postgresql.JSONB(), server_default=sa.text("'{}'::jsonb"), nullable=False),
+                    sa.Column('status', sa.String(length=20), server_default=sa.text("'queued'"), nullable=False),
+                    sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+                    sa.Column('max_attempts', sa.Integer(), server_default=sa.text('3'), nullable=False),
+                    sa.Column('run_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('locked_by', sa.String(length=100), nullable=True),
+                    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('cancel_requested', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+                    sa.Column('progress_done', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+                    sa.Column('progress_total', sa.BigInteger(), nullable=True),
+                    sa.Column('result', postgresql.JSONB(), nullable=True),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                              nullable=False),
+                    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_jobs_queued', 'jobs', ['run_at', 'id'], unique=False,
+                    postgresql_where=sa.text("status = 'queued'"))
+    op.create_index('ix_jobs_running', 'jobs', ['locked_until'], unique=False,
+                    postgresql_where=sa.text("status = 'running'"))
+    op.create_index('ix_jobs_finished_at', 'jobs', ['finished_at'], unique=False,
+                    postgresql_where=sa.text('finished_at IS NOT NULL'))
+    # touch_updated_at is from a93e6b0d2c71; /api/jobs/{id}/events sends a line when it moves
+    op.execute("""
+        CREATE TRIGGER jobs_updated_at BEFORE UPDATE ON jobs
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+    # wakes the idle workers (LISTEN jobs) instead of waiting for their next poll
+    op.execute("""
+        CREATE FUNCTION jobs_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('jobs', '');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER jobs_notify AFTER INSERT ON jobs
+        FOR EACH STATEMENT EXECUTE FUNCTION jobs_notify()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER jobs_notify ON jobs")
+    op.execute("DROP FUNCTION jobs_notify()")
+    op.execute("DROP TRIGGER jobs_updated_at ON jobs")
+    op.drop_index('ix_jobs_finished_at', table_name='jobs')
+    op.drop_index('ix_jobs_running', table_name='jobs')
+    op.drop_index('ix_jobs_queued', table_name='jobs')
+    op.drop_table('jobs')
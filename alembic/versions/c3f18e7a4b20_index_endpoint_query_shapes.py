@@ -0,0 +1,51 @@
+"""index endpoint query shapes
+
+Revision ID: c3f18e7a4b20
+Revises: a93e6b0d2c71
+Create Date: 2026-10-18 19:26:41.530172
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f18e7a4b20'
+down_revision: Union[str, None] = 'a93e6b0d2c71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# reported by index_advisor.py; (column, id) serves equality/range filters and the keyset order at once
+INDEXES = [
+    ('ix_patients_full_name_id', 'patients', ['full_name', 'id']),
+    ('ix_patients_date_of_birth_id', 'patients', ['date_of_birth', 'id']),
+    ('ix_patients_policy_number_id', 'patients', ['policy_number', 'id']),
+    ('ix_patients_social_status_id', 'patients', ['social_status', 'id']),
+    ('ix_patients_medic_id', 'patients', ['medic_id']),
+    ('ix_treatments_current_state_id', 'treatments', ['current_state', 'id']),
+    ('ix_treatments_date_start_id', 'treatments', ['date_start', 'id']),
+    ('ix_treatments_date_end_id', 'treatments', ['date_end', 'id']),
+    ('ix_treatments_medic_id_id', 'treatments', ['medic_id', 'id']),
+    ('ix_medics_full_name_id', 'medics', ['full_name', 'id']),
+    ('ix_medics_speciality_id', 'medics', ['speciality', 'id']),
+    ('ix_medics_exp_years_id', 'medics', ['exp_years', 'id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY so a big table keeps taking writes; it cannot run inside the migration transaction
+    with op.get_context().autocommit_block():
+        # GIN on an integer primary key, duplicates treatments_pkey (and needs btree_gin)
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_treatments_id')
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+        # btree: the original GIN needs the btree_gin extension
+        op.create_index('ix_treatments_id', 'treatments', ['id'], unique=False, postgresql_concurrently=True)
@@ -0,0 +1,34 @@
+"""check treatment period
+
+Revision ID: c8d4e1f6a927
+Revises: b52e07c9d314
+Create Date: 2026-10-19 09:14:27.530418
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8d4e1f6a927'
+down_revision: Union[str, None] = 'b52e07c9d314'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# date_end >= date_start, which ix_treatments_period (e8c41f0a7b36) relies on: without it a reversed
+# treatment was only refused by the index, as an error. Added to treatments, it holds on every partition.
+
+
+def upgrade() -> None:
+    reversed_ids = op.get_bind().scalars(sa.text(
+        "SELECT id FROM treatments WHERE date_end < date_start ORDER BY id LIMIT 20")).all()
+    if reversed_ids:
+        raise RuntimeError(f"treatments with date_end before date_start, e.g. ids {reversed_ids}: correct them "
+                           "and run the upgrade again")
+    op.create_check_constraint('ck_treatments_period', 'treatments', 'date_end >= date_start')
+
+
+def downgrade() -> None:
+    op.drop_constraint('ck_treatments_period', 'treatments', type_='check')
@@ -0,0 +1,54 @@
+"""index sort by diagnosis and medic
+
+Revision ID: d1a6f3b8c204
+Revises: c8d4e1f6a927
+Create Date: 2026-10-19 09:52:08.114736
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1a6f3b8c204'
+down_revision: Union[str, None] = 'c8d4e1f6a927'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# keyset orders c3f18e7a4b20 left to a sort: /treatment/?sort_by=diagnosis is (diagnosis, id), which
+# ix_treatments_diagnosis_state_patient cannot give, and /patient/?sort_by=medic_id is (medic_id, id).
+# ix_patients_medic_id_id replaces ix_patients_medic_id for the FK lookups.
+
+
+def partitions() -> list:
+    return op.get_bind().scalars(sa.text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                         "WHERE inhparent = 'treatments'::regclass ORDER BY 1")).all()
+
+
+def create_partitioned_index(name: str, columns: list):
+    # CONCURRENTLY does not work on a partitioned table: the index is made on the parent alone, invalid,
+    # built concurrently on every partition and valid once all of them are attached
+    column_list = ', '.join(columns)
+    op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY treatments ({column_list})")
+    for partition in partitions():
+        index = f"{partition}_{'_'.join(columns)}_idx"
+        op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {partition} ({column_list})")
+        op.execute(f"ALTER INDEX {name} ATTACH PARTITION {index}")
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        create_partitioned_index('ix_treatments_diagnosis_id', ['diagnosis', 'id'])
+        op.create_index('ix_patients_medic_id_id', 'patients', ['medic_id', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_patients_medic_id', table_name='patients', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_patients_medic_id', 'patients', ['medic_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_patients_medic_id_id', table_name='patients', postgresql_concurrently=True)
+        # the partitions' indexes go with it
+        op.drop_index('ix_treatments_diagnosis_id', table_name='treatments')
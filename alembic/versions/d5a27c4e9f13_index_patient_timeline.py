@@ -0,0 +1,36 @@
+"""index patient timeline
+
+Revision ID: d5a27c4e9f13
+Revises: c3f18e7a4b20
+Create Date: 2026-10-18 21:12:05.418396
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a27c4e9f13'
+down_revision: Union[str, None] = 'c3f18e7a4b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # GET /patient/{id}/timeline reads a patient's treatments in (date_start, id) order;
+    # the (patient_id) index is a prefix of the new one, which also serves the patient delete cascade,
+    # so it is dropped
+    with op.get_context().autocommit_block():
+        op.create_index('ix_treatments_patient_id_date_start_id', 'treatments', ['patient_id', 'date_start', 'id'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_treatments_patient_id', table_name='treatments', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_treatments_patient_id', 'treatments', ['patient_id'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_treatments_patient_id_date_start_id', table_name='treatments',
+                      postgresql_concurrently=True)
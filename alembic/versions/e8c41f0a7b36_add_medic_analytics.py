@@ -0,0 +1,126 @@
+"""add medic analytics
+
+Revision ID: e8c41f0a7b36
+Revises: d5a27c4e9f13
+Create Date: 2026-10-18 21:47:52.063814
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8c41f0a7b36'
+down_revision: Union[str, None] = 'd5a27c4e9f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the counters of 7d2f5b9c1e04 also sum date_end - date_start, for average durations;
+# the total_* placeholders are empty for the downgrade
+DELTA = """
+    INSERT INTO treatment_stats (dimension, key, count{total})
+    SELECT dimension, key, {sign} count(*){total_value} FROM (
+        SELECT 'diagnosis' AS dimension, r.diagnosis AS key, r.date_end - r.date_start AS days FROM {rows} r
+        UNION ALL SELECT 'current_state', r.current_state, r.date_end - r.date_start FROM {rows} r
+        UNION ALL SELECT 'speciality', m.speciality, r.date_end - r.date_start FROM {rows} r
+            JOIN medics m ON m.id = r.medic_id
+        UNION ALL SELECT 'month', to_char(date_trunc('month', r.date_start), 'YYYY-MM'), r.date_end - r.date_start
+            FROM {rows} r
+    ) changed
+    GROUP BY dimension, key
+    ON CONFLICT (dimension, key) DO UPDATE SET count = treatment_stats.count + EXCLUDED.count{total_update};
+"""
+
+TREATMENTS_FUNCTION = """
+    CREATE OR REPLACE FUNCTION treatments_apply_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {old}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {new}
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+MEDICS_FUNCTION = """
+    CREATE OR REPLACE FUNCTION medics_apply_stats() RETURNS trigger AS $$
+    DECLARE
+        n bigint;
+        days bigint;
+    BEGIN
+        IF TG_OP = 'UPDATE' AND NEW.speciality IS NOT DISTINCT FROM OLD.speciality THEN
+            RETURN NEW;
+        END IF;
+        SELECT count(*), coalesce(sum(date_end - date_start), 0) INTO n, days FROM treatments WHERE medic_id = OLD.id;
+        IF n > 0 THEN
+            UPDATE treatment_stats SET count = count - n{total_minus}
+            WHERE dimension = 'speciality' AND key = OLD.speciality;
+            IF TG_OP = 'UPDATE' THEN
+                INSERT INTO treatment_stats (dimension, key, count{total})
+                VALUES ('speciality', NEW.speciality, n{days})
+                ON CONFLICT (dimension, key) DO UPDATE SET count = treatment_stats.count + EXCLUDED.count{total_update};
+            END IF;
+        END IF;
+        RETURN CASE WHEN TG_OP = 'UPDATE' THEN NEW ELSE OLD END;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+def functions(total: bool):
+    # total=False puts back the functions of 7d2f5b9c1e04
+    column = ', total_days' if total else ''
+    update = ', total_days = treatment_stats.total_days + EXCLUDED.total_days' if total else ''
+    delta = {}
+    for rows, sign in (('old_rows', '-'), ('new_rows', '')):
+        delta[rows] = DELTA.format(rows=rows, sign=sign, total=column, total_update=update,
+                                   total_value=f', {sign} sum(days)' if total else '')
+    op.execute(TREATMENTS_FUNCTION.format(old=delta['old_rows'], new=delta['new_rows']))
+    op.execute(MEDICS_FUNCTION.format(total=column, total_update=update, days=', days' if total else '',
+                                      total_minus=', total_days = total_days - days' if total else ''))
+
+
+def upgrade() -> None:
+    op.add_column('treatment_stats', sa.Column('total_days', sa.BigInteger(), server_default='0', nullable=False))
+    functions(total=True)
+    op.execute("""
+        UPDATE treatment_stats s SET total_days = existing.days
+        FROM (
+            SELECT 'diagnosis' AS dimension, t.diagnosis AS key, sum(t.date_end - t.date_start) AS days
+            FROM treatments t GROUP BY 2
+            UNION ALL SELECT 'current_state', t.current_state, sum(t.date_end - t.date_start)
+            FROM treatments t GROUP BY 2
+            UNION ALL SELECT 'speciality', m.speciality, sum(t.date_end - t.date_start)
+            FROM treatments t JOIN medics m ON m.id = t.medic_id GROUP BY 2
+            UNION ALL SELECT 'month', to_char(date_trunc('month', t.date_start), 'YYYY-MM'),
+                sum(t.date_end - t.date_start) FROM treatments t GROUP BY 2
+        ) existing
+        WHERE s.dimension = existing.dimension AND s.key = existing.key
+    """)
+    # daterange() raises for a row with date_end < date_start: say which rows before building the index
+    reversed_ids = op.get_bind().scalars(sa.text(
+        "SELECT id FROM treatments WHERE date_end < date_start ORDER BY id LIMIT 20")).all()
+    if reversed_ids:
+        raise RuntimeError(f"treatments with date_end before date_start, e.g. ids {reversed_ids}: correct them "
+                           "(e.g. UPDATE treatments SET date_end = date_start WHERE date_end < date_start) "
+                           "and run the upgrade again")
+    # active caseload and overlaps: "period @> day" and "period && window" are GiST range scans
+    with op.get_context().autocommit_block():
+        # left INVALID by a failed CONCURRENTLY build, IF NOT EXISTS below would keep it as it is
+        if op.get_bind().scalar(sa.text("SELECT NOT indisvalid FROM pg_index "
+                                        "WHERE indexrelid = to_regclass('ix_treatments_period')")):
+            op.execute("DROP INDEX CONCURRENTLY ix_treatments_period")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_treatments_period ON treatments "
+                   "USING gist (daterange(date_start, date_end, '[]'))")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_treatments_period")
+    functions(total=False)
+    op.drop_column('treatment_stats', 'total_days')
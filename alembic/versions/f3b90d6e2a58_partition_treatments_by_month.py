@@ -0,0 +1,150 @@
+"""partition treatments by month
+
+Revision ID: f3b90d6e2a58
+Revises: e8c41f0a7b36
+Create Date: 2026-10-18 22:34:16.208551
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b90d6e2a58'
+down_revision: Union[str, None] = 'e8c41f0a7b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# treatments becomes PARTITION BY RANGE (date_start): one treatments_yYYYYmMM partition per month that has
+# rows, the current month and PARTITIONS_AHEAD more (partitions.py creates the next ones and archives old
+# ones), and treatments_default for anything else. The primary key has to hold the partition key, it is
+# (id, date_start) and ids still come from treatments_id_seq; treatment_medic references (id, date_start)
+# through treatment_date_start. The rows are copied before the triggers exist, so the counters and
+# search_data are left as they are. Partitions moved to the archive schema are not part of the downgrade.
+PARTITIONS_AHEAD = 3
+# PostgreSQL 15: before it an UPDATE moving a row to another partition is a DELETE and an INSERT, and the
+# ON DELETE CASCADE of treatment_medic would drop the links of a treatment whose date_start changes month
+MIN_SERVER_VERSION = 150000
+
+# same indexes and triggers as before, on the partitioned table they are created on every partition
+INDEXES = {
+    'ix_treatments_diagnosis_state_patient': ['diagnosis', 'current_state', 'patient_id'],
+    'ix_treatments_current_state_id': ['current_state', 'id'],
+    'ix_treatments_date_start_id': ['date_start', 'id'],
+    'ix_treatments_date_end_id': ['date_end', 'id'],
+    'ix_treatments_medic_id_id': ['medic_id', 'id'],
+    'ix_treatments_patient_id_date_start_id': ['patient_id', 'date_start', 'id'],
+}
+
+TRIGGERS = [
+    """CREATE TRIGGER treatments_stats_insert AFTER INSERT ON treatments
+       REFERENCING NEW TABLE AS new_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()""",
+    """CREATE TRIGGER treatments_stats_update AFTER UPDATE ON treatments
+       REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()""",
+    """CREATE TRIGGER treatments_stats_delete AFTER DELETE ON treatments
+       REFERENCING OLD TABLE AS old_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_apply_stats()""",
+    """CREATE TRIGGER treatments_search_insert AFTER INSERT ON treatments
+       REFERENCING NEW TABLE AS new_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()""",
+    """CREATE TRIGGER treatments_search_update AFTER UPDATE ON treatments
+       REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()""",
+    """CREATE TRIGGER treatments_search_delete AFTER DELETE ON treatments
+       REFERENCING OLD TABLE AS old_rows
+       FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()""",
+    """CREATE TRIGGER treatments_version BEFORE UPDATE ON treatments
+       FOR EACH ROW WHEN ((OLD.diagnosis, OLD.current_state, OLD.date_start, OLD.date_end, OLD.patient_id,
+                           OLD.medic_id)
+                          IS DISTINCT FROM (NEW.diagnosis, NEW.current_state, NEW.date_start, NEW.date_end,
+                                            NEW.patient_id, NEW.medic_id))
+       EXECUTE FUNCTION bump_row_version()""",
+]
+
+COLUMNS = 'id, diagnosis, current_state, date_start, date_end, patient_id, medic_id, version'
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_table(name: str, primary_key: list, **kwargs):
+    op.create_table(name,
+                    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('treatments_id_seq'::regclass)"),
+                              nullable=False),
+                    sa.Column('diagnosis', sa.String(length=150), nullable=False),
+                    sa.Column('current_state', sa.String(length=150), nullable=False),
+                    sa.Column('date_start', sa.Date(), nullable=False),
+                    sa.Column('date_end', sa.Date(), nullable=False),
+                    sa.Column('patient_id', sa.Integer(), nullable=False),
+                    sa.Column('medic_id', sa.Integer(), nullable=False),
+                    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+                    sa.PrimaryKeyConstraint(*primary_key, name=f'{name}_pkey'),
+                    **kwargs)
+
+
+def replace_treatments(new_table: str, link_columns: list, referred_columns: list, link_onupdate=None):
+    # the new table takes the place, the name, the sequence and the dependents of treatments
+    op.execute(f"INSERT INTO {new_table} ({COLUMNS}) SELECT {COLUMNS} FROM treatments")
+    op.drop_constraint('treatment_medic_treatment_id_fkey', 'treatment_medic', type_='foreignkey')
+    op.drop_table('treatments')
+    op.rename_table(new_table, 'treatments')
+    op.execute(f"ALTER TABLE treatments RENAME CONSTRAINT {new_table}_pkey TO treatments_pkey")
+    op.execute("ALTER SEQUENCE treatments_id_seq OWNED BY treatments.id")
+    op.create_foreign_key('treatments_patient_id_fkey', 'treatments', 'patients', ['patient_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_foreign_key('treatments_medic_id_fkey', 'treatments', 'medics', ['medic_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_foreign_key('treatment_medic_treatment_id_fkey', 'treatment_medic', 'treatments', link_columns,
+                          referred_columns, ondelete='CASCADE', onupdate=link_onupdate)
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'treatments', columns, unique=False)
+    op.execute("CREATE INDEX ix_treatments_period ON treatments USING gist (daterange(date_start, date_end, '[]'))")
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+    # autovacuum never analyzes a partitioned table itself
+    op.execute("ANALYZE treatments")
+
+
+def upgrade() -> None:
+    version = int(op.get_bind().scalar(sa.text("SHOW server_version_num")))
+    if version < MIN_SERVER_VERSION:
+        raise RuntimeError(f"partitioning treatments needs PostgreSQL 15 or later, the server is {version}")
+    # kept while the old table is dropped
+    op.execute("ALTER SEQUENCE treatments_id_seq OWNED BY NONE")
+    create_table('treatments_partitioned', ['id', 'date_start'], postgresql_partition_by='RANGE (date_start)')
+    current = date.today().replace(day=1)
+    months = set(op.get_bind().scalars(sa.text(
+        "SELECT DISTINCT date_trunc('month', date_start)::date FROM treatments")))
+    months.update(add_months(current, n) for n in range(PARTITIONS_AHEAD + 1))
+    for month in sorted(months):
+        op.execute(f"CREATE TABLE treatments_y{month:%Y}m{month:%m} PARTITION OF treatments_partitioned "
+                   f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')")
+    op.execute("CREATE TABLE treatments_default PARTITION OF treatments_partitioned DEFAULT")
+
+    op.add_column('treatment_medic', sa.Column('treatment_date_start', sa.Date(), nullable=True))
+    op.execute("""
+        UPDATE treatment_medic tm SET treatment_date_start = t.date_start
+        FROM treatments t WHERE t.id = tm.treatment_id
+    """)
+    op.alter_column('treatment_medic', 'treatment_date_start', nullable=False)
+    # the treatment_medic rows of a month, moved out with its partition
+    op.create_index('ix_treatment_medic_treatment_date_start', 'treatment_medic', ['treatment_date_start'],
+                    unique=False)
+    # ON UPDATE CASCADE: a new date_start moves the treatment to another partition and its links follow
+    replace_treatments('treatments_partitioned', ['treatment_id', 'treatment_date_start'], ['id', 'date_start'],
+                       'CASCADE')
+
+
+def downgrade() -> None:
+    op.execute("ALTER SEQUENCE treatments_id_seq OWNED BY NONE")
+    create_table('treatments_unpartitioned', ['id'])
+    replace_treatments('treatments_unpartitioned', ['treatment_id'], ['id'])
+    op.drop_index('ix_treatment_medic_treatment_date_start', table_name='treatment_medic')
+    op.drop_column('treatment_medic', 'treatment_date_start')
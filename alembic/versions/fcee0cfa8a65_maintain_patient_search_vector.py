@@ -0,0 +1,96 @@
+"""maintain patient search vector
+
+Revision ID: fcee0cfa8a65
+Revises: 6678c9281911
+Create Date: 2026-10-18 17:45:12.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fcee0cfa8a65'
+down_revision: Union[str, None] = '6678c9281911'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# search_data holds {full_name, social_status, diagnoses[]}, kept up to date by triggers;
+# search_vector is generated from it and GIN indexed
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(search_data->>'full_name', '')), 'A') || "
+    "setweight(jsonb_to_tsvector('simple', coalesce(search_data->'diagnoses', '[]'::jsonb), '[\"string\"]'), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(search_data->>'social_status', '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    op.create_index('ix_treatments_patient_id', 'treatments', ['patient_id'], unique=False)
+    op.add_column('patients', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                        sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True))
+    op.execute("""
+        CREATE FUNCTION patients_search_data() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_data := jsonb_build_object(
+                'full_name', NEW.full_name,
+                'social_status', NEW.social_status,
+                'diagnoses', COALESCE((SELECT jsonb_agg(DISTINCT diagnosis) FROM treatments
+                                       WHERE patient_id = NEW.id), '[]'::jsonb));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER patients_search_data BEFORE INSERT OR UPDATE OF full_name, social_status, search_data
+        ON patients FOR EACH ROW EXECUTE FUNCTION patients_search_data()
+    """)
+    # statement level, so bulk inserts and COPY touch every affected patient once
+    op.execute("""
+        CREATE FUNCTION treatments_refresh_patient_search() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE patients SET search_data = NULL
+                WHERE id IN (SELECT patient_id FROM new_rows);
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE patients SET search_data = NULL
+                WHERE id IN (SELECT patient_id FROM old_rows);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_search_insert AFTER INSERT ON treatments
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_search_update AFTER UPDATE ON treatments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()
+    """)
+    op.execute("""
+        CREATE TRIGGER treatments_search_delete AFTER DELETE ON treatments
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION treatments_refresh_patient_search()
+    """)
+    # backfill through the trigger
+    op.execute("UPDATE patients SET search_data = NULL")
+    op.create_index('ix_patients_search_vector', 'patients', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_patients_search_vector', table_name='patients')
+    op.execute("DROP TRIGGER treatments_search_delete ON treatments")
+    op.execute("DROP TRIGGER treatments_search_update ON treatments")
+    op.execute("DROP TRIGGER treatments_search_insert ON treatments")
+    op.execute("DROP FUNCTION treatments_refresh_patient_search()")
+    op.execute("DROP TRIGGER patients_search_data ON patients")
+    op.execute("DROP FUNCTION patients_search_data()")
+    op.drop_column('patients', 'search_vector')
+    op.drop_index('ix_treatments_patient_id', table_name='treatments')
@@ -0,0 +1,117 @@
+import os
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Date, Float, Integer, cast, exc, func, literal, literal_column, select, union_all
+from sqlalchemy.dialects.postgresql import DATERANGE
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Treatment, Medic, TreatmentStat, treatment_period
+
+# Medic workload analytics, computed in PostgreSQL and never by loading rows:
+#   caseload  - treatments whose [date_start, date_end] contains a day, per attending medic,
+#               ranked overall and within the speciality by window functions
+#   duration  - average date_end - date_start per speciality (or any stats dimension), read from the
+#               treatment_stats counters, so it costs one row per key whatever the table size
+#   overlap   - per medic, the most treatments running at once inside a date window: +1/-1 events
+#               at the ends of every period clipped to the window, summed by a running window sum
+# caseload and overlap only read the treatments selected through the GiST index on treatment_period, and
+# their date_start bound skips the partitions of later months;
+# the window of overlap is capped at ANALYTICS_MAX_DAYS and the handlers set a statement timeout.
+
+ANALYTICS_MAX_DAYS = 366
+ANALYTICS_TIMEOUT_MS = int(os.getenv("ANALYTICS_TIMEOUT_MS", "10000"))
+QUERY_CANCELED = "57014"
+
+
+def statement_timeout():
+    # set_config(..., true) is SET LOCAL: the timeout ends with the transaction
+    return select(func.set_config("statement_timeout", str(ANALYTICS_TIMEOUT_MS), True))
+
+
+def check_timeout(e: exc.DBAPIError):
+    if getattr(e.orig, "pgcode", None) == QUERY_CANCELED:
+        raise HTTPException(status_code=503, detail=f'Not computed within {ANALYTICS_TIMEOUT_MS} ms, '
+                                                    'narrow the query')
+
+
+def run_bounded(db: Session, statement) -> list:
+    db.execute(statement_timeout())
+    try:
+        return db.execute(statement).all()
+    except exc.DBAPIError as e:
+        check_timeout(e)
+        raise
+
+
+async def run_bounded_async(db: AsyncSession, statement) -> list:
+    await db.execute(statement_timeout())
+    try:
+        return (await db.execute(statement)).all()
+    except exc.DBAPIError as e:
+        check_timeout(e)
+        raise
+
+
+def day_range(date_from: date, date_to: date):
+    return func.daterange(literal(date_from, Date), literal(date_to, Date), literal_column("'[]'"), type_=DATERANGE)
+
+
+def caseload_query(as_of: date, speciality: Optional[str], limit: int):
+    active = (select(Treatment.medic_id, func.count().label("active"))
+              .where(treatment_period().op("@>")(literal(as_of, Date)), Treatment.date_start <= as_of)
+              .group_by(Treatment.medic_id)
+              .subquery("active"))
+    statement = (select(Medic.id, Medic.full_name, Medic.speciality, active.c.active,
+                        func.rank().over(order_by=active.c.active.desc()).label("rank"),
+                        func.rank().over(partition_by=Medic.speciality, order_by=active.c.active.desc())
+                        .label("speciality_rank"),
+                        (cast(active.c.active, Float) / func.sum(active.c.active).over()).label("share"))
+                 .join(active, active.c.medic_id == Medic.id))
+    if speciality is not None:
+        # ranks and shares are then within the speciality
+        statement = statement.where(Medic.speciality == speciality)
+    return statement.order_by(active.c.active.desc(), Medic.id).limit(limit)
+
+
+def duration_query(dimension: str):
+    return (select(TreatmentStat.key, TreatmentStat.count,
+                   (cast(TreatmentStat.total_days, Float) / TreatmentStat.count).label("average_days"))
+            .where(TreatmentStat.dimension == dimension, TreatmentStat.count > 0)
+            .order_by(TreatmentStat.key))
+
+
+def overlap_query(date_from: date, date_to: date, medic_id: Optional[int], limit: int):
+    window = day_range(date_from, date_to)
+    conditions = [treatment_period().op("&&")(window), Treatment.date_start <= date_to]
+    if medic_id is not None:
+        conditions.append(Treatment.medic_id == medic_id)
+    # canonical dateranges are [lower, upper): a treatment ending on day d stops counting on d + 1
+    clipped = (select(Treatment.medic_id, treatment_period().op("*", return_type=DATERANGE)(window).label("period"))
+               .where(*conditions)
+               .cte("clipped"))
+    events = union_all(
+        select(clipped.c.medic_id, func.lower(clipped.c.period, type_=Date).label("day"), literal(1).label("delta")),
+        select(clipped.c.medic_id, func.upper(clipped.c.period, type_=Date), literal(-1)),
+    ).subquery("events")
+    running = (select(events.c.medic_id, events.c.day,
+                      cast(func.sum(func.sum(events.c.delta)).over(partition_by=events.c.medic_id,
+                                                                   order_by=events.c.day), Integer)
+                      .label("concurrent"))
+               .group_by(events.c.medic_id, events.c.day)
+               .subquery("running"))
+    peaks = (select(running.c.medic_id, running.c.day, running.c.concurrent,
+                    func.row_number().over(partition_by=running.c.medic_id,
+                                           order_by=(running.c.concurrent.desc(), running.c.day)).label("position"))
+             .subquery("peaks"))
+    totals = (select(clipped.c.medic_id, func.count().label("treatments"))
+              .group_by(clipped.c.medic_id)
+              .subquery("totals"))
+    return (select(Medic.id, Medic.full_name, Medic.speciality, totals.c.treatments,
+                   peaks.c.concurrent.label("peak"), peaks.c.day.label("peak_day"))
+            .join(peaks, (peaks.c.medic_id == Medic.id) & (peaks.c.position == 1))
+            .join(totals, totals.c.medic_id == Medic.id)
+            .order_by(peaks.c.concurrent.desc(), Medic.id)
+            .limit(limit))
@@ -0,0 +1,225 @@
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from replicas import get_async_read_db
+from models import Patient, Treatment, Medic, has_treatment
+from filters import projection
+from pagination import PER_PAGE_MAX, keyset_query, page_rows
+from serialization import rows_response, wants_columnar
+from writes import (insert_returning, create_treatment_statement, update_returning, delete_returning_treatments,
+                    detach_patients)
+from stats import STATS_DIMENSIONS, treatment_stats_query, treatment_stats_window_query
+from analytics import run_bounded_async
+from partitions import started_between
+from cache import (cache, entity_key, invalidate, invalidate_medic_list, versioned_value, CACHE_HITS,
+                   CACHE_MISSES)
+from http_cache import conditional, entity_etag, stats_etag
+from schemas import (PatientCreate, PatientResponse, PatientDelete, TreatmentCreate, TreatmentResponse,
+                     TreatmentDelete, MedicCreate, MedicResponse, MedicDelete, PatientCount)
+
+# async def versions of the CRUD, search and stats endpoints on AsyncSession/asyncpg.
+# main.py serves these instead of the sync handlers when DB_ASYNC is set,
+# so an in-flight query waits on the event loop instead of holding a threadpool thread.
+
+router = APIRouter()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_or_404(db: AsyncSession, model, id_: int, detail: str):
+    # by id, not db.get(): the primary key of treatments is (id, date_start)
+    obj = await db.scalar(select(model).where(model.id == id_))
+    if obj is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return obj
+
+
+async def cached_or_404(db: AsyncSession, kind: str, model, schema, id_: int, detail: str):
+    # same read-through cache as the sync handlers, the loader just has to be awaited;
+    # returns {"version", "data"}
+    key = entity_key(kind, id_)
+    value = cache.get(key)
+    if value is not None:
+        CACHE_HITS.inc(kind)
+        return value
+    CACHE_MISSES.inc(kind)
+    value = versioned_value(schema, await get_or_404(db, model, id_, detail))
+    cache.set(key, value)
+    return value
+
+
+# Create
+
+
+@router.post("/patient/", response_model=PatientResponse)
+async def create_patient(patient_: PatientCreate, db: AsyncSession = Depends(get_async_db)):
+    db_patient = (await db.execute(insert_returning(Patient, PatientResponse, patient_.model_dump()))).one()
+    await db.commit()
+    return db_patient
+
+
+@router.post("/treatment/", response_model=TreatmentResponse)
+async def create_treatment(treatment: TreatmentCreate, db: AsyncSession = Depends(get_async_db)):
+    # sets the patient's medic_id too, for patient_with_medic
+    db_treatment = (await db.execute(create_treatment_statement(treatment.model_dump(), TreatmentResponse))).one()
+    await db.commit()
+    return db_treatment
+
+
+@router.post("/medic/", response_model=MedicResponse)
+async def create_medic(medic: MedicCreate, db: AsyncSession = Depends(get_async_db)):
+    db_medic = (await db.execute(insert_returning(Medic, MedicResponse, medic.model_dump()))).one()
+    await db.commit()
+    invalidate_medic_list()
+    return db_medic
+
+
+# Read
+@router.get("/patient/{patient_id}", response_model=PatientResponse)
+async def get_patient(patient_id: int, request: Request, response: Response,
+                      db: AsyncSession = Depends(get_async_db)):
+    patient = await cached_or_404(db, 'patient', Patient, PatientResponse, patient_id, 'Patient not found')
+    return conditional(request, response, entity_etag("patient", patient_id, patient["version"])) or patient["data"]
+
+
+@router.get("/medic/{medic_id}", response_model=MedicResponse)
+async def get_medic(medic_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    medic = await cached_or_404(db, 'medic', Medic, MedicResponse, medic_id, 'Medic not found')
+    return conditional(request, response, entity_etag("medic", medic_id, medic["version"])) or medic["data"]
+
+
+@router.get("/treatment/{treatment_id}", response_model=TreatmentResponse)
+async def get_treatment(treatment_id: int, request: Request, response: Response,
+                        db: AsyncSession = Depends(get_async_db)):
+    treatment = await cached_or_404(db, 'treatment', Treatment, TreatmentResponse, treatment_id,
+                                    'Treatment not found')
+    etag = entity_etag("treatment", treatment_id, treatment["version"])
+    return conditional(request, response, etag) or treatment["data"]
+
+
+# Update
+
+
+async def update_or_404(db: AsyncSession, model, schema, id_: int, values: dict, detail: str):
+    row = (await db.execute(update_returning(model, schema, id_, values))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=detail)
+    await db.commit()
+    return row
+
+
+@router.put("/patient/{patient_id}", response_model=PatientResponse)
+async def update_patient(patient_id: int, updated: PatientCreate, db: AsyncSession = Depends(get_async_db)):
+    patient = await update_or_404(db, Patient, PatientResponse, patient_id, updated.model_dump(), 'Patient not found')
+    invalidate("patient", patient_id)
+    return patient
+
+
+@router.put("/treatment/{treatment_id}", response_model=TreatmentResponse)
+async def update_treatment(treatment_id: int, updated: TreatmentCreate, db: AsyncSession = Depends(get_async_db)):
+    treatment = await update_or_404(db, Treatment, TreatmentResponse, treatment_id, updated.model_dump(),
+                                    'Treatment not found')
+    invalidate("treatment", treatment_id)
+    return treatment
+
+
+@router.put("/medic/{medic_id}", response_model=MedicResponse)
+async def update_medic(medic_id: int, updated: MedicCreate, db: AsyncSession = Depends(get_async_db)):
+    medic = await update_or_404(db, Medic, MedicResponse, medic_id, updated.model_dump(), 'Medic not found')
+    invalidate("medic", medic_id)
+    invalidate_medic_list()
+    return medic
+
+
+# Delete
+# Core DELETEs: the FK cascades run in the database, the ORM would lazy-load children here.
+# The statement also returns the ids of the cascaded treatments for the cache.
+
+
+async def delete_or_404(db: AsyncSession, model, id_: int, treatment_fk, detail: str):
+    deleted = (await db.execute(delete_returning_treatments(model, id_, treatment_fk))).all()
+    if not deleted:
+        raise HTTPException(status_code=404, detail=detail)
+    await db.commit()
+    return [row.treatment_id for row in deleted if row.treatment_id is not None]
+
+
+@router.delete("/patient/{patient_id}", response_model=PatientDelete)
+async def delete_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    treatment_ids = await delete_or_404(db, Patient, patient_id, Treatment.patient_id, 'Patient not found')
+    invalidate("patient", patient_id)
+    invalidate("treatment", *treatment_ids)
+    return {"message": "Patient deleted"}
+
+
+@router.delete("/treatment/{treatment_id}", response_model=TreatmentDelete)
+async def delete_treatment(treatment_id: int, db: AsyncSession = Depends(get_async_db)):
+    deleted = (await db.execute(delete(Treatment).where(Treatment.id == treatment_id).returning(Treatment.id))).first()
+    if deleted is None:
+        raise HTTPException(status_code=404, detail='Treatment not found')
+    await db.commit()
+    invalidate("treatment", treatment_id)
+    return {"message": "Treatment deleted"}
+
+
+@router.delete("/medic/{medic_id}", response_model=MedicDelete)
+async def delete_medic(medic_id: int, db: AsyncSession = Depends(get_async_db)):
+    await db.execute(detach_patients(medic_id))
+    treatment_ids = await delete_or_404(db, Medic, medic_id, Treatment.medic_id, 'Medic not found')
+    invalidate("medic", medic_id)
+    invalidate("treatment", *treatment_ids)
+    invalidate_medic_list()
+    return {"message": "Medic deleted"}
+
+
+# SELECT... WHERE
+
+
+@router.get("/api/patients/search", response_model=List[PatientResponse])
+async def search_patients(request: Request, response: Response, diagnosis: str, current_state: str,
+                          per_page: Optional[int] = Query(None, ge=1, le=PER_PAGE_MAX), cursor: Optional[str] = None,
+                          db: AsyncSession = Depends(get_async_read_db)):
+    fields = list(PatientResponse.model_fields)
+    statement = select(*projection(Patient, fields)).where(has_treatment(diagnosis, current_state))
+    if per_page is not None or cursor is not None:
+        statement = keyset_query(statement, Patient, "id", "asc", per_page or 10, cursor)
+        patients, next_cursor = page_rows((await db.execute(statement)).all(), "id", "asc", per_page or 10)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+    else:
+        patients = (await db.execute(statement)).all()
+    if not patients and cursor is None:
+        raise HTTPException(status_code=404, detail="No matches found")
+    return rows_response(patients, fields, response, wants_columnar(request))
+
+
+@router.get("/api/patients/search/count", response_model=PatientCount)
+async def count_search_patients(diagnosis: str, current_state: str,
+                                db: AsyncSession = Depends(get_async_read_db)):
+    return {"count": await db.scalar(select(func.count(Patient.id)).where(has_treatment(diagnosis, current_state)))}
+
+# GROUP BY
+
+
+@router.get("/api/treatments/stats", response_model=dict)
+async def get_treatments_stats(request: Request, response: Response, by: str = "diagnosis",
+                               date_from: Optional[date] = None, date_to: Optional[date] = None,
+                               db: AsyncSession = Depends(get_async_read_db)):
+    if by not in STATS_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f'Invalid by parameter. Use one of {", ".join(STATS_DIMENSIONS)}.')
+    if date_from is not None or date_to is not None:
+        rows = await run_bounded_async(db, treatment_stats_window_query(by, *started_between(date_from, date_to)))
+        return {row.key: row.count for row in rows}
+    rows = (await db.execute(treatment_stats_query(by))).all()
+    not_modified = conditional(request, response, stats_etag(by, rows))
+    if not_modified is not None:
+        return not_modified
+    return {row[0]: row[1] for row in rows}
@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+import httpx
+from sqlalchemy import func, select, tablesample, text
+
+from database import SessionLocal, init_engines
+from models import Patient, Treatment, Medic
+from pagination import sortable_columns
+from stats import STATS_DIMENSIONS
+
+# Open-loop load test for the API: every scenario is sent at a fixed rate for a fixed time and
+# latency is measured from the scheduled send time, so a slow server cannot hide its queueing
+# by slowing the client down. Results go to a JSON file that --compare diffs against a previous run.
+#
+#   python benchmark.py --seed-scale 1000000 --serve --rate 200 --duration 20 --output after.json \
+#       --compare before.json
+#
+# DB queries per request come from db_queries_total on /metrics; with several workers /metrics
+# answers from one of them, so run against a single worker for those.
+
+BASE_URL = 'http://localhost:8000/'
+SAMPLE_SIZE = 1000
+
+SOCIAL_STATUSES = ['student', 'employer', 'temporarily unemployed', 'invalid', 'pensioner', 'child']
+CURRENT_STATES = ['moderate', 'heavy condition', 'sent to stationary', 'died', 'recovered', 'discharged']
+
+
+def sample(db, model, *columns):
+    # TABLESAMPLE reads ~1% of the pages, not the whole table
+    sampled = tablesample(model, func.system(1))
+    rows = db.execute(select(*[sampled.c[column] for column in columns]).limit(SAMPLE_SIZE)).all()
+    if len(rows) < SAMPLE_SIZE // 10:
+        rows = db.execute(select(*[getattr(model, column) for column in columns]).limit(SAMPLE_SIZE)).all()
+    return rows
+
+
+class Workload:
+    # ids and values of existing rows, so reads hit real data
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        db = SessionLocal()
+        try:
+            self.patients = sample(db, Patient, 'id', 'full_name')
+            self.treatments = sample(db, Treatment, 'id', 'diagnosis', 'current_state', 'patient_id', 'medic_id',
+                                     'date_start')
+            self.medics = sample(db, Medic, 'id', 'speciality')
+        finally:
+            db.close()
+        if not (self.patients and self.treatments and self.medics):
+            raise SystemExit('Empty database, seed it first with --seed-scale')
+        # patients created by the run, deleted by delete_patient
+        self.created = []
+
+    def pick(self, rows):
+        return self.rng.choice(rows)
+
+    def patient_body(self):
+        return {"full_name": self.pick(self.patients).full_name, "date_of_birth": "1980-01-01",
+                "policy_number": self.rng.randrange(100000, 999999999),
+                "social_status": self.rng.choice(SOCIAL_STATUSES)}
+
+    def treatment_body(self):
+        return {"diagnosis": self.pick(self.treatments).diagnosis, "current_state": self.rng.choice(CURRENT_STATES),
+                "date_start": date.today().isoformat(), "date_end": (date.today() + timedelta(days=30)).isoformat(),
+                "patient_id": self.pick(self.patients).id,
+                "medic_id": self.pick(self.medics).id}
+
+
+def read_scenarios(w: Workload):
+    # name -> callable returning (method, path, json body)
+    return {
+        "get_patient": lambda: ("GET", f"patient/{w.pick(w.patients).id}", None),
+        "get_treatment": lambda: ("GET", f"treatment/{w.pick(w.treatments).id}", None),
+        "get_medic": lambda: ("GET", f"medic/{w.pick(w.medics).id}", None),
+        "list_patients": lambda: ("GET", f"patient/?per_page=10&sort_by={w.rng.choice(sortable_columns(Patient))}",
+                                  None),
+        "list_patients_filtered": lambda: (
+            "GET", f"patient/?social_status={w.rng.choice(SOCIAL_STATUSES)}&fields=id,full_name&per_page=10", None),
+        "list_treatments": lambda: (
+            "GET", f"treatment/?per_page=10&sort_by={w.rng.choice(sortable_columns(Treatment))}", None),
+        "list_medics": lambda: ("GET", f"medic/?per_page=10&speciality={w.pick(w.medics).speciality}", None),
+        "sorted_patients_page": lambda: ("GET", "api/patients?sort_by=full_name&order=asc&per_page=50", None),
+        "search": lambda: ("GET", "api/patients/search?diagnosis={0.diagnosis}&current_state={0.current_state}"
+                                  "&per_page=10".format(w.pick(w.treatments)), None),
+        "search_count": lambda: ("GET", "api/patients/search/count?diagnosis={0.diagnosis}"
+                                        "&current_state={0.current_state}".format(w.pick(w.treatments)), None),
+        # the start of a surname: text_search wants a word of 3 characters
+        "text_search": lambda: (
+            "GET", f"api/patients/text_search?q={w.pick(w.patients).full_name.split()[-1][:3]}", None),
+        "stats": lambda: ("GET", f"api/treatments/stats?by={w.rng.choice(list(STATS_DIMENSIONS))}", None),
+        "patient_timeline": lambda: ("GET", f"patient/{w.pick(w.treatments).patient_id}/timeline", None),
+        "patient_timelines_batch": lambda: (
+            "GET", "api/patients/timeline?ids=" + ",".join(str(w.pick(w.treatments).patient_id) for _ in range(20)),
+            None),
+        # populate.py seeds treatments running around the day it ran
+        "medic_caseload": lambda: ("GET", f"api/analytics/medics/caseload?as_of={date.today()}", None),
+        "treatment_duration": lambda: ("GET", "api/analytics/duration?by=speciality", None),
+        "medic_overlap": lambda: ("GET", f"api/analytics/medics/overlap?date_from={date.today() - timedelta(days=90)}"
+                                         f"&date_to={date.today()}&medic_id={w.pick(w.medics).id}", None),
+    }
+
+
+def write_scenarios(w: Workload):
+    def delete_patient():
+        patient_id = w.created.pop() if w.created else None
+        return ("DELETE", f"patient/{patient_id}", None) if patient_id else None
+
+    def update_by_conditions():
+        # the seeded date_start of all matches lie within 30 days, so this date_end passes ck_treatments_period;
+        # a 422 would only measure the rollback
+        row = w.pick(w.treatments)
+        return ("PATCH", f"api/treatments/update_by_conditions/{row.diagnosis}/{row.current_state}?limit=10",
+                {"date_end": (row.date_start + timedelta(days=60)).isoformat()})
+
+    return {
+        "create_patient": lambda: ("POST", "patient/", w.patient_body()),
+        "create_treatment": lambda: ("POST", "treatment/", w.treatment_body()),
+        "update_patient": lambda: ("PUT", f"patient/{w.pick(w.patients).id}", w.patient_body()),
+        "update_by_conditions": update_by_conditions,
+        "create_medic": lambda: ("POST", "medic/", {"full_name": w.pick(w.patients).full_name,
+                                                     "speciality": w.pick(w.medics).speciality, "exp_years": 5}),
+        # after create_patient, deletes what it created
+        "delete_patient": delete_patient,
+    }
+
+
+def full_table_scenarios(w: Workload):
+    return {
+        "all_patients_ndjson": lambda: ("GET", "api/patients?sort_by=id&order=asc&stream=1", None),
+        "patients_with_medic_ndjson": lambda: ("GET", "api/patients_with_medic/?stream=1", None),
+    }
+
+
+async def query_count(client: httpx.AsyncClient) -> float:
+    response = await client.get("metrics")
+    return sum(float(line.rsplit(' ', 1)[1]) for line in response.text.splitlines()
+               if line.startswith('db_queries_total'))
+
+
+def percentile(values, p):
+    # nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+async def run_scenario(client, make_request, rate, duration, warmup, concurrency, on_response=None):
+    limit = asyncio.Semaphore(concurrency)
+    latencies, statuses, errors = [], {}, 0
+
+    async def send(scheduled, request, record):
+        nonlocal errors
+        method, path, body = request
+        async with limit:
+            try:
+                response = await client.request(method, path, json=body)
+            except httpx.HTTPError:
+                errors += 1
+                return
+        if record:
+            latencies.append(time.perf_counter() - scheduled)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if on_response is not None:
+            on_response(response)
+
+    async def drive(seconds, record):
+        start = time.perf_counter()
+        tasks = []
+        for i in range(int(seconds * rate)):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            request = make_request()
+            if request is not None:
+                tasks.append(asyncio.ensure_future(send(scheduled, request, record)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    await drive(warmup, record=False)
+    queries_before = await query_count(client)
+    elapsed = await drive(duration, record=True)
+    queries = await query_count(client) - queries_before
+
+    completed = len(latencies)
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": completed,
+        # a 422 is a request the benchmark got wrong, its latency is not that of the scenario
+        "errors": errors + sum(count for status, count in statuses.items() if status >= 500 or status == 422),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput": round(completed / elapsed, 2),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / completed if completed else None,
+        "db_queries_per_request": round(queries / completed, 2) if completed else None,
+    }
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    workload = Workload(rng)
+    scenarios = dict(read_scenarios(workload))
+    if not args.read_only:
+        scenarios.update(write_scenarios(workload))
+    if args.full_table:
+        scenarios.update(full_table_scenarios(workload))
+    if args.only:
+        scenarios = {name: scenario for name, scenario in scenarios.items() if name in args.only.split(',')}
+
+    def remember_created(response):
+        if response.status_code == 200:
+            workload.created.append(response.json()["id"])
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        for name, scenario in scenarios.items():
+            results[name] = await run_scenario(client, scenario, args.rate, args.duration, args.warmup,
+                                               args.concurrency,
+                                               remember_created if name == "create_patient" else None)
+            print(format_row(name, results[name]))
+    return results
+
+
+def format_row(name, result):
+    def ms(value):
+        return '-' if value is None else f'{value:.1f}'
+    return (f"{name:28} {result['requests']:7} req {result['throughput']:8.1f} rps  p50 {ms(result['p50_ms']):>7}"
+            f"  p95 {ms(result['p95_ms']):>7}  p99 {ms(result['p99_ms']):>7} ms  errors {result['errors']:4}"
+            f"  queries/req {result['db_queries_per_request']}")
+
+
+def compare(previous, current):
+    print(f"\n{'endpoint':28} {'p95 before':>11} {'p95 after':>10} {'change':>8} {'rps before':>11} {'rps after':>10}")
+    for name, result in current["endpoints"].items():
+        before = previous["endpoints"].get(name)
+        if before is None or before["p95_ms"] is None or result["p95_ms"] is None:
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        print(f"{name:28} {before['p95_ms']:11.1f} {result['p95_ms']:10.1f} {change:+7.1f}% "
+              f"{before['throughput']:11.1f} {result['throughput']:10.1f}")
+
+
+def seed_database(scale, seed):
+    # reset and reload with the COPY loader, the ids are then 1..scale
+    from populate import copy_load
+
+    db = SessionLocal()
+    try:
+        db.execute(text('TRUNCATE patients, treatments, medics, treatment_stats RESTART IDENTITY CASCADE'))
+        db.commit()
+    finally:
+        db.close()
+    copy_load(scale, seed)
+
+
+def table_sizes():
+    db = SessionLocal()
+    try:
+        return {row.relname: int(row.reltuples) for row in db.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relname IN ('patients', 'treatments', 'medics')"))}
+    finally:
+        db.close()
+
+
+def start_server(base_url, workers):
+    port = httpx.URL(base_url).port or 8000
+    server = subprocess.Popen([sys.executable, 'serve.py', '--port', str(port), '--workers', str(workers),
+                               '--log-level', 'warning'])
+    for _ in range(300):
+        try:
+            if httpx.get(base_url + 'metrics').status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    server.terminate()
+    raise SystemExit('Server did not start')
+
+
+def serialization_benchmark(rows, repeat=5):
+    # client CPU (process time) to load a page of patients and encode it, per 10k rows:
+    # the ORM objects + response_model validation FastAPI did before, and the fast path of serialization.py
+    from pydantic import TypeAdapter
+    from filters import projection
+    from schemas import PatientResponse
+    from serialization import encode_rows
+
+    fields = list(PatientResponse.model_fields)
+    adapter = TypeAdapter(List[PatientResponse])
+
+    def orm_pydantic(db):
+        patients = db.query(Patient).order_by(Patient.id).limit(rows).all()
+        content = adapter.dump_python(adapter.validate_python(patients, from_attributes=True), mode='json')
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def fast(db, columnar=False):
+        statement = select(*projection(Patient, fields)).order_by(Patient.id).limit(rows)
+        return encode_rows(db.execute(statement), fields, columnar)
+
+    paths = {'orm + response_model': orm_pydantic, 'rows + encoder': fast,
+             'rows + encoder, columnar': lambda db: fast(db, columnar=True)}
+    results = {}
+    db = SessionLocal()
+    try:
+        for name, path in paths.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.process_time()
+                body = path(db)
+                timings.append(time.process_time() - start)
+                db.expunge_all()
+            results[name] = {"cpu_ms_per_10k_rows": min(timings) * 1000 * 10000 / rows, "bytes": len(body)}
+            print(f"{name:28} {results[name]['cpu_ms_per_10k_rows']:8.1f} ms CPU per 10k rows"
+                  f"  {len(body) / rows:6.1f} bytes/row")
+    finally:
+        db.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints at fixed request rates')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--seed-scale', type=int, default=None, help='truncate and load this many patients first')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the data and the request mix')
+    parser.add_argument('--serve', action='store_true', help='start serve.py for the run')
+    parser.add_argument('--workers', type=int, default=1, help='serve.py workers with --serve')
+    parser.add_argument('--rate', type=float, default=100, help='requests per second per endpoint')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds per endpoint')
+    parser.add_argument('--concurrency', type=int, default=64, help='max requests in flight')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--only', default=None, help='comma separated scenario names')
+    parser.add_argument('--read-only', action='store_true', help='skip the write scenarios')
+    parser.add_argument('--full-table', action='store_true', help='also stream the whole patients table')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help='results file of a previous run')
+    parser.add_argument('--serialization', type=int, default=None, metavar='ROWS',
+                        help='only compare the CPU cost of encoding ROWS patients, in process')
+    args = parser.parse_args()
+
+    init_engines()
+    if args.seed_scale is not None:
+        seed_database(args.seed_scale, args.seed)
+    if args.serialization:
+        serialization_benchmark(args.serialization)
+        sys.exit()
+    started_at = datetime.now(timezone.utc).isoformat()
+    server = start_server(args.base_url, args.workers) if args.serve else None
+    try:
+        endpoints = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "tables": table_sizes(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        "endpoints": endpoints,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,70 @@
+from typing import List
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from models import Patient, Treatment, Medic
+from schemas import PatientCreate, TreatmentCreate, MedicCreate, BulkRowError
+
+# Bulk create: the rows are validated one by one and the valid ones go in as one multi-row INSERT;
+# used by the /{entity}/bulk endpoints (one transaction per request) and by import jobs (one per chunk).
+
+BULK_MAX_ROWS = 10000
+BULK_SCHEMAS = {Patient: PatientCreate, Treatment: TreatmentCreate, Medic: MedicCreate}
+
+
+def validate_bulk_rows(rows: List[dict], schema):
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f'Too many rows, max is {BULK_MAX_ROWS}')
+    valid = {}
+    errors = []
+    for index, row in enumerate(rows):
+        try:
+            valid[index] = schema.model_validate(row).model_dump()
+        except ValidationError as e:
+            errors.append(BulkRowError(index=index, errors=[
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            ]))
+    return valid, errors
+
+
+def reject_missing_refs(db: Session, valid: dict, errors: list, key: str, model):
+    # one set-based lookup instead of a FK violation aborting the whole batch
+    wanted = {row[key] for row in valid.values()}
+    if not wanted:
+        return
+    found = set(db.scalars(select(model.id).where(model.id.in_(wanted))))
+    for index, row in list(valid.items()):
+        if row[key] not in found:
+            errors.append(BulkRowError(index=index, errors=[f'{key}: {model.__name__} {row[key]} not found']))
+            del valid[index]
+
+
+def bulk_insert(db: Session, model, valid: dict, errors: list, total: int):
+    ids = [None] * total
+    if valid:
+        indexes = list(valid)
+        result = db.execute(insert(model).returning(model.id, sort_by_parameter_order=True),
+                            [valid[i] for i in indexes])
+        for index, new_id in zip(indexes, result.scalars()):
+            ids[index] = new_id
+    errors.sort(key=lambda e: e.index)
+    return ids
+
+
+def bulk_create(db: Session, model, rows: List[dict]):
+    # (ids, errors), ids[i] is None for a rejected row; the caller commits
+    valid, errors = validate_bulk_rows(rows, BULK_SCHEMAS[model])
+    if model is Treatment:
+        reject_missing_refs(db, valid, errors, 'patient_id', Patient)
+        reject_missing_refs(db, valid, errors, 'medic_id', Medic)
+    ids = bulk_insert(db, model, valid, errors, len(rows))
+    if model is Treatment:
+        # for patient_with_medic, last treatment in the batch wins as in create_treatment
+        medic_by_patient = {row['patient_id']: row['medic_id'] for row in valid.values()}
+        if medic_by_patient:
+            db.execute(update(Patient), [{"id": patient_id, "medic_id": medic_id}
+                                         for patient_id, medic_id in medic_by_patient.items()])
+    return ids, errors
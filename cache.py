@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from metrics import Counter
+
+# Read-through cache for the by-id reads and the medic list.
+# CACHE_BACKEND=local (default, serve.py uses redis with several workers) keeps a bounded LRU with TTL per process,
+# CACHE_BACKEND=redis shares one cache between replicas (needs the redis package).
+# Values are JSON-ready dicts so both backends store exactly the same thing.
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_URL = os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+
+CACHE_HITS = Counter("cache_hits_total", "Cache lookups answered from the cache", ("kind",))
+CACHE_MISSES = Counter("cache_misses_total", "Cache lookups that went to the database", ("kind",))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries dropped to stay under CACHE_MAXSIZE")
+CACHE_INVALIDATIONS = Counter("cache_invalidations_total", "Entries removed after a write", ("kind",))
+
+
+class LocalCache:
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # generation counters live outside the LRU so they are never evicted
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                CACHE_EVICTIONS.inc()
+
+    def delete(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+
+class RedisCache:
+    def __init__(self, url: str = CACHE_URL, ttl: float = CACHE_TTL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any):
+        self.client.set(key, json.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def counter(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+BACKENDS = {"local": LocalCache, "redis": RedisCache}
+
+cache = BACKENDS[CACHE_BACKEND]()
+
+
+def entity_key(kind: str, id_: int) -> str:
+    return f"{kind}:{id_}"
+
+
+def get_or_load(kind: str, key: str, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+    # None results (not found) are not cached
+    value = cache.get(key)
+    if value is not None:
+        CACHE_HITS.inc(kind)
+        return value
+    CACHE_MISSES.inc(kind)
+    value = loader()
+    if value is not None:
+        cache.set(key, value)
+    return value
+
+
+def invalidate(kind: str, *ids: int):
+    cache.delete(*[entity_key(kind, id_) for id_ in ids])
+    CACHE_INVALIDATIONS.inc(kind, amount=len(ids))
+
+
+# The medic list is cached per query string under a generation number;
+# any medic write bumps the generation, which retires every cached page at once.
+
+def medic_list_key(*params) -> str:
+    generation = cache.counter("medic:list:generation")
+    return "medic:list:%s:%s" % (generation, ":".join(str(param) for param in params))
+
+
+def invalidate_medic_list():
+    cache.incr("medic:list:generation")
+    CACHE_INVALIDATIONS.inc("medic_list")
+
+
+def cache_value(schema, obj) -> Optional[dict]:
+    if obj is None:
+        return None
+    return schema.model_validate(obj, from_attributes=True).model_dump(mode="json")
+
+
+def versioned_value(schema, obj) -> Optional[dict]:
+    # entities are cached with their row version so the ETag needs no query
+    if obj is None:
+        return None
+    return {"version": obj.version, "data": cache_value(schema, obj)}
@@ -0,0 +1,86 @@
+import operator
+from datetime import date
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+
+from models import Patient, Treatment, Medic
+
+# Declarative filters and sparse fieldsets for the list endpoints, e.g.
+#   ?date_of_birth__gte=1990-01-01&social_status__in=student,pensioner&fields=id,full_name
+# Only whitelisted (column, operator) pairs are accepted; each becomes a plain sargable predicate
+# in the one SELECT the endpoint runs, and fields= narrows its column list.
+
+OPERATORS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+RANGE = ("eq", "gt", "gte", "lt", "lte")
+EQUALITY = ("eq", "in")
+
+FILTERS = {
+    Patient: {"date_of_birth": RANGE, "social_status": EQUALITY, "policy_number": EQUALITY, "medic_id": EQUALITY},
+    Treatment: {"date_start": RANGE, "date_end": RANGE, "diagnosis": EQUALITY, "current_state": EQUALITY,
+                "patient_id": EQUALITY, "medic_id": EQUALITY},
+    Medic: {"speciality": EQUALITY, "exp_years": RANGE},
+}
+
+# parameters the list endpoints take themselves
+RESERVED = {"page", "per_page", "sort_by", "order", "cursor", "stream", "fields", "format"}
+
+IN_MAX_VALUES = 1000
+
+
+def parse_value(column, raw: str):
+    python_type = column.type.python_type
+    try:
+        return date.fromisoformat(raw) if python_type is date else python_type(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'Invalid value for {column.key}: {raw}')
+
+
+def parse_filters(request: Request, model) -> list:
+    # name=value is equality, name__op=value any other operator, name__in=a,b,c a list
+    allowed = FILTERS[model]
+    conditions = []
+    for param, raw in request.query_params.multi_items():
+        if param in RESERVED:
+            continue
+        name, _, op = param.partition("__")
+        op = op or "eq"
+        if op not in allowed.get(name, ()):
+            raise HTTPException(status_code=400, detail=f'Unsupported filter: {param}')
+        column = getattr(model, name)
+        if op == "in":
+            values = [parse_value(column, value) for value in raw.split(",") if value]
+            if not values or len(values) > IN_MAX_VALUES:
+                raise HTTPException(status_code=400, detail=f'{param} takes 1 to {IN_MAX_VALUES} values')
+            conditions.append(column.in_(values))
+        else:
+            conditions.append(OPERATORS[op](column, parse_value(column, raw)))
+    return conditions
+
+
+def filters_key(request: Request) -> str:
+    # normalized filters, fields and format, for cache keys
+    return "&".join(sorted(f"{param}={value}" for param, value in request.query_params.multi_items()
+                           if param not in RESERVED - {"fields", "format"}))
+
+
+def parse_fields(fields: Optional[str], schema) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in schema.model_fields]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f'Invalid fields. Use any of {", ".join(schema.model_fields)}.')
+    return names
+
+
+def projection(model, fields: List[str], *extra: str) -> list:
+    # extra: columns the endpoint needs itself (cursor key, version for the ETag), not sent to the client
+    return [getattr(model, name) for name in dict.fromkeys([*fields, *extra])]
+
@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Validators for conditional GETs. Entity ETags come from the row version column,
+# list ETags from the (id, version) pairs of the page, stats from the counters they send. No Last-Modified
+# for stats: updated_at is now() of the writing transaction, which can commit after a later timestamp is seen.
+
+
+def entity_etag(kind: str, id_: int, version: int) -> str:
+    return f'"{kind}-{id_}-{version}"'
+
+
+def page_etag(kind: str, rows, variant: str = "") -> str:
+    # variant tells apart representations of the same rows, e.g. different fields=
+    digest = hashlib.sha1(repr((variant, [(row.id, row.version) for row in rows])).encode()).hexdigest()
+    return f'"{kind}-{digest[:20]}"'
+
+
+def stats_etag(dimension: str, rows) -> str:
+    # rows are the response itself, one per key, so the validator changes exactly when the body does
+    digest = hashlib.sha1(repr([tuple(row) for row in rows]).encode()).hexdigest()
+    return f'"stats-{dimension}-{digest[:20]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    # weak comparison, as RFC 9110 asks for If-None-Match
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    header = request.headers.get('if-modified-since')
+    if header is None or request.headers.get('if-none-match') is not None:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have whole seconds
+    return last_modified.replace(microsecond=0) <= since
+
+
+def conditional(request: Request, response: Response, etag: str,
+                last_modified: Optional[datetime] = None) -> Optional[Response]:
+    # sets the validators on response; returns a 304 to send instead when the client copy is fresh
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    response.headers.update(headers)
+    if etag_matches(request, etag) or (last_modified is not None and not_modified_since(request, last_modified)):
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,180 @@
+import argparse
+import json
+
+from sqlalchemy import func, inspect, select, text
+
+from database import SessionLocal, init_engines
+from filters import FILTERS
+from models import Patient, Treatment, Medic, has_treatment
+from pagination import encode_cursor, keyset_query, sortable_columns
+from timeline import timeline_query, batch_timeline_query
+from writes import treatments_matching
+
+# Replays the query shapes of the endpoints in main.py through EXPLAIN against a seeded database
+# (python populate.py --copy --scale 10000000) and reports the ones that scan or sort a whole table.
+# Every shape names the index it expects; a miss is reported with that index if it does not exist yet.
+# Shapes that return the whole table (/api/patients without per_page, /api/patients_with_medic/,
+# the stats rebuild) are left out, a sequential scan is the right plan for them.
+
+MIN_ROWS = 10000
+
+
+class Shape:
+    def __init__(self, endpoint, statement, table, columns):
+        self.endpoint = endpoint
+        self.statement = statement
+        # the index this shape should be served by
+        self.table = table
+        self.columns = columns
+
+
+def sample_row(db, model):
+    # a row from the middle of the table, for realistic cursor and filter values
+    middle = db.scalar(select((func.min(model.id) + func.max(model.id)) / 2))
+    return db.scalars(select(model).where(model.id >= (middle or 0)).order_by(model.id).limit(1)).first()
+
+
+def list_shapes(db, model, path):
+    row = sample_row(db, model)
+    if row is None:
+        return
+    table = model.__tablename__
+    for sort_by in sortable_columns(model):
+        columns = ['id'] if sort_by == 'id' else [sort_by, 'id']
+        for order in ('asc', 'desc'):
+            yield Shape(f'GET {path}?sort_by={sort_by}&order={order}',
+                        keyset_query(select(model), model, sort_by, order, 10), table, columns)
+        cursor = encode_cursor(sort_by, 'asc', row)
+        yield Shape(f'GET {path}?sort_by={sort_by}&cursor=...',
+                    keyset_query(select(model), model, sort_by, 'asc', 10, cursor), table, columns)
+    for name, operators in FILTERS[model].items():
+        column = getattr(model, name)
+        value = getattr(row, name)
+        if 'gte' in operators:
+            yield Shape(f'GET {path}?{name}__gte=...', keyset_query(select(model).where(column >= value), model,
+                                                                    name, 'asc', 10), table, [name, 'id'])
+        yield Shape(f'GET {path}?{name}=...', keyset_query(select(model).where(column == value), model, 'id', 'asc',
+                                                           10), table, [name, 'id'])
+
+
+def endpoint_shapes(db):
+    for model, path in ((Patient, '/patient/'), (Treatment, '/treatment/'), (Medic, '/medic/')):
+        yield from list_shapes(db, model, path)
+        row = sample_row(db, model)
+        if row is not None:
+            yield Shape(f'GET {path}{{id}}', select(model).where(model.id == row.id), model.__tablename__, ['id'])
+
+    treatment = sample_row(db, Treatment)
+    if treatment is not None:
+        search = has_treatment(treatment.diagnosis, treatment.current_state)
+        yield Shape('GET /api/patients/search?per_page=10', keyset_query(select(Patient).where(search), Patient,
+                                                                         'id', 'asc', 10),
+                    'treatments', ['diagnosis', 'current_state', 'patient_id'])
+        yield Shape('GET /api/patients/search/count', select(func.count(Patient.id)).where(search),
+                    'treatments', ['diagnosis', 'current_state', 'patient_id'])
+        yield Shape('PATCH /api/treatments/update_by_conditions (chunk)',
+                    treatments_matching(treatment.diagnosis, treatment.current_state, limit=1000),
+                    'treatments', ['diagnosis', 'current_state'])
+        yield Shape('GET /patient/{id}/timeline', timeline_query(treatment.patient_id, [], 100),
+                    'treatments', ['patient_id', 'date_start', 'id'])
+        yield Shape('GET /api/patients/timeline', batch_timeline_query([treatment.patient_id], [], 20),
+                    'treatments', ['patient_id', 'date_start', 'id'])
+        # FK lookups behind the DELETE cascades and detach_patients
+        yield Shape('DELETE /patient/{id} (cascade)', select(Treatment.id).where(
+            Treatment.patient_id == treatment.patient_id), 'treatments', ['patient_id'])
+        yield Shape('DELETE /medic/{id} (cascade)', select(Treatment.id).where(
+            Treatment.medic_id == treatment.medic_id), 'treatments', ['medic_id'])
+        yield Shape('DELETE /medic/{id} (detach patients)', select(Patient.id).where(
+            Patient.medic_id == treatment.medic_id), 'patients', ['medic_id'])
+
+    patient = sample_row(db, Patient)
+    if patient is not None:
+        query = func.to_tsquery('simple', patient.full_name.split()[0] + ':*')
+        yield Shape('GET /api/patients/text_search', select(Patient.id).where(Patient.search_vector.op('@@')(query))
+                    .order_by(func.ts_rank(Patient.search_vector, query).desc(), Patient.id).limit(20),
+                    'patients', ['search_vector'])
+
+
+def explain(db, statement, analyze: bool):
+    compiled = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={'render_postcompile': True})
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    plan = db.connection().exec_driver_sql(f'EXPLAIN ({options}) {compiled.string}', compiled.params).scalar()
+    return plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def problems(plan, table_rows):
+    # sequential scans of big tables, and sorts fed by more rows than the page needs
+    found = []
+    for node in plan_nodes(plan['Plan']):
+        relation = node.get('Relation Name')
+        if node['Node Type'] == 'Seq Scan' and table_rows.get(relation, 0) >= MIN_ROWS:
+            found.append(f"Seq Scan on {relation}" + (f" (Filter: {node['Filter']})" if 'Filter' in node else ''))
+        if node['Node Type'] == 'Sort':
+            rows = node['Plans'][0].get('Actual Rows', node['Plans'][0]['Plan Rows'])
+            if rows >= MIN_ROWS:
+                found.append(f"Sort of {rows} rows on {', '.join(node['Sort Key'])}")
+    return found
+
+
+def existing_indexes():
+    inspector = inspect(init_engines())
+    return {table: [index['column_names'] for index in inspector.get_indexes(table)]
+            + [inspector.get_pk_constraint(table)['constrained_columns']]
+            for table in ('patients', 'treatments', 'medics')}
+
+
+def has_index(indexes, table, columns) -> bool:
+    return any(index[:len(columns)] == columns for index in indexes.get(table, []))
+
+
+def advise(analyze=True, match=None):
+    indexes = existing_indexes()
+    missing = {}
+    db = SessionLocal()
+    try:
+        # plans scan the partitions of treatments, each one is judged by its own size
+        table_rows = {row.relname: row.reltuples for row in db.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relname IN ('patients', 'treatments', 'medics') "
+            "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass('treatments'))"))}
+        for shape in endpoint_shapes(db):
+            if match and match not in shape.endpoint:
+                continue
+            plan = explain(db, shape.statement, analyze)
+            found = problems(plan, table_rows)
+            timing = f"{plan['Execution Time']:.2f} ms" if analyze else f"cost {plan['Plan']['Total Cost']:.0f}"
+            print(f"{'MISS' if found else 'ok':4}  {shape.endpoint:60} {timing}")
+            for problem in found:
+                print(f'      {problem}')
+            if found and not has_index(indexes, shape.table, shape.columns):
+                missing[(shape.table, tuple(shape.columns))] = shape.endpoint
+        # EXPLAIN ANALYZE runs the statements, nothing is written but keep it that way
+        db.rollback()
+    finally:
+        db.close()
+
+    # (medic_id) is covered by (medic_id, id)
+    missing = {(table, columns): endpoint for (table, columns), endpoint in missing.items()
+               if not any(other != columns and other[:len(columns)] == columns for t, other in missing if t == table)}
+    if missing:
+        print('\nMissing indexes:')
+        for (table, columns), endpoint in missing.items():
+            print(f"  CREATE INDEX ix_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)});  -- {endpoint}")
+    return missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='EXPLAIN the endpoint queries and report missing indexes')
+    parser.add_argument('--no-analyze', action='store_true', help='plain EXPLAIN, the queries are not run')
+    parser.add_argument('--min-rows', type=int, default=MIN_ROWS, help='smaller tables may be scanned')
+    parser.add_argument('--match', default=None, help='only shapes whose endpoint contains this')
+    args = parser.parse_args()
+
+    MIN_ROWS = args.min_rows
+    init_engines()
+    advise(analyze=not args.no_analyze, match=args.match)
@@ -0,0 +1,76 @@
+import argparse
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Column, Date, ForeignKey, Index, Integer, MetaData, String, Table, inspect
+from sqlalchemy.dialects.postgresql import JSONB
+
+from database import SQLALCHEMY_DATABASE_URL, init_engines
+from partitions import ensure_partitions
+
+# Schema setup, the only place besides Alembic (and partitions.py, for the months of treatments) that runs DDL.
+# The app no longer creates tables on import.
+# The revisions up to 6678c9281911 were autogenerated against tables made by create_all and cannot
+# build them, so on an empty database the tables are created as of that revision, stamped,
+# and everything after it (search vector, stats, versions, indexes...) comes from alembic upgrade head.
+
+BASELINE_REVISION = '6678c9281911'
+# next to this file, so the app and the scripts work from any directory
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini')
+
+baseline = MetaData()
+
+Table('medics', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('full_name', String(150), nullable=False),
+      Column('speciality', String(100), nullable=False),
+      Column('exp_years', Integer, nullable=False),
+      Index('ix_medics_id', 'id'))
+
+Table('patients', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('full_name', String(150), nullable=False),
+      Column('date_of_birth', Date, nullable=False),
+      Column('policy_number', Integer, nullable=False),
+      Column('social_status', String(100), nullable=False),
+      Column('medic_id', Integer, ForeignKey('medics.id')),
+      Column('search_data', JSONB, nullable=True),
+      Index('ix_patients_id', 'id'))
+
+Table('treatments', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('diagnosis', String(150), nullable=False),
+      Column('current_state', String(150), nullable=False),
+      Column('date_start', Date, nullable=False),
+      Column('date_end', Date, nullable=False),
+      Column('patient_id', Integer, ForeignKey('patients.id', ondelete='CASCADE'), nullable=False),
+      Column('medic_id', Integer, ForeignKey('medics.id', ondelete='CASCADE'), nullable=False))
+
+Table('treatment_medic', baseline,
+      Column('treatment_id', Integer, ForeignKey('treatments.id', ondelete='CASCADE'), primary_key=True),
+      Column('medic_id', Integer, ForeignKey('medics.id', ondelete='CASCADE'), primary_key=True))
+
+
+def alembic_config(path=ALEMBIC_INI) -> Config:
+    # same database as the app, not the URL in alembic.ini
+    config = Config(path)
+    config.set_main_option('sqlalchemy.url', SQLALCHEMY_DATABASE_URL.replace('%', '%%'))
+    return config
+
+
+def init_db(path=ALEMBIC_INI):
+    config = alembic_config(path)
+    engine = init_engines()
+    if 'patients' not in inspect(engine).get_table_names():
+        baseline.create_all(engine)
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, 'head')
+    ensure_partitions()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create or migrate the hospital database schema')
+    parser.add_argument('--config', default=ALEMBIC_INI)
+    args = parser.parse_args()
+    init_db(args.config)
@@ -0,0 +1,244 @@
+import contextlib
+import os
+import time
+from datetime import timedelta
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Patient, Treatment, Medic, Job
+from schemas import (PatientResponse, TreatmentResponse, JobResponse, RebuildStatsParams, ImportParams,
+                     ExportParams, ArchiveParams)
+from bulk import BULK_MAX_ROWS, bulk_create
+from cache import invalidate_medic_list
+from filters import projection
+from partitions import archive_partitions, parse_month, started_between
+from stats import rebuild_treatment_stats
+from streaming import ndjson_lines
+
+# Background jobs, a queue in the jobs table (alembic revision b52e07c9d314) worked by worker.py:
+#   queued -> running -> succeeded | failed | cancelled
+# A worker claims the oldest ready job with FOR UPDATE SKIP LOCKED, so workers never wait on each other
+# or run a job twice, and holds it for JOB_LEASE_SECONDS, extended while the job runs. A job whose lease
+# ran out (its worker died) is queued again; a failed one is retried after JOB_RETRY_SECONDS, doubled per
+# attempt, until max_attempts. Handlers report progress_done/progress_total as they go, which is also
+# where a cancelled job stops. Finished jobs, and their export files, are purged after JOB_RETENTION_DAYS.
+
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "10"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+# written by the workers and read by the API (/api/jobs/{id}/result): shared storage with several hosts
+JOB_EXPORT_DIR = os.getenv("JOB_EXPORT_DIR", "exports")
+# rejected rows kept in the result of an import, the rest are only counted
+JOB_MAX_ERRORS = int(os.getenv("JOB_MAX_ERRORS", "1000"))
+# a handler's progress is written at most this often
+PROGRESS_INTERVAL = 1.0
+TERMINAL = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLost(Exception):
+    # the lease ran out and the job was queued again, or taken by another worker
+    pass
+
+
+def job_columns() -> list:
+    # the rows of an import are left out of params, they can be a million
+    return [*projection(Job, [name for name in JobResponse.model_fields if name != 'params']),
+            Job.params.op('-')(literal('rows')).label('params')]
+
+
+def enqueue(db: Session, kind: str, params: dict, max_attempts: int = 3) -> int:
+    # the caller commits; the insert trigger wakes the workers (NOTIFY jobs)
+    return db.scalar(insert(Job).values(kind=kind, params=params, max_attempts=max_attempts).returning(Job.id))
+
+
+def claim(db: Session, worker: str, kinds: List[str]) -> Optional[Job]:
+    ready = (select(Job.id)
+             .where(Job.status == 'queued', Job.run_at <= func.now(), Job.kind.in_(kinds))
+             .order_by(Job.run_at, Job.id).limit(1)
+             .with_for_update(skip_locked=True).scalar_subquery())
+    return db.scalar(update(Job).where(Job.id == ready)
+                     .values(status='running', attempts=Job.attempts + 1, locked_by=worker,
+                             locked_until=func.now() + timedelta(seconds=JOB_LEASE_SECONDS),
+                             started_at=func.coalesce(Job.started_at, func.now()))
+                     .returning(Job).execution_options(synchronize_session=False, populate_existing=True))
+
+
+def owned(job_id: int, worker: str):
+    return update(Job).where(Job.id == job_id, Job.locked_by == worker, Job.status == 'running')
+
+
+def extend_lease(job_id: int, worker: str, **values):
+    # None when the job is no longer this worker's
+    return (owned(job_id, worker)
+            .values(locked_until=func.now() + timedelta(seconds=JOB_LEASE_SECONDS), **values)
+            .returning(Job.cancel_requested))
+
+
+def finish(db: Session, job_id: int, worker: str, status: str, **values) -> bool:
+    return db.execute(owned(job_id, worker).values(status=status, locked_by=None, locked_until=None,
+                                                   finished_at=func.now(), **values)).rowcount == 1
+
+
+def fail(db: Session, job: Job, worker: str, error: str, retry: bool = True) -> bool:
+    if not retry or job.attempts >= job.max_attempts:
+        return finish(db, job.id, worker, 'failed', error=error)
+    delay = timedelta(seconds=JOB_RETRY_SECONDS * 2 ** (job.attempts - 1))
+    return db.execute(owned(job.id, worker).values(status='queued', locked_by=None, locked_until=None,
+                                                   run_at=func.now() + delay, error=error)).rowcount == 1
+
+
+def cancel(db: Session, job_id: int):
+    # a queued job is cancelled at once, a running one when its handler next reports progress
+    return db.execute(update(Job).where(Job.id == job_id, Job.status.in_(('queued', 'running')))
+                      .values(cancel_requested=True,
+                              status=case((Job.status == 'queued', 'cancelled'), else_=Job.status),
+                              finished_at=case((Job.status == 'queued', func.now()), else_=Job.finished_at))
+                      .returning(*job_columns())).first()
+
+
+def requeue_expired(db: Session) -> int:
+    # the jobs of workers that died, found through ix_jobs_running
+    gone = or_(Job.cancel_requested, Job.attempts >= Job.max_attempts)
+    return db.execute(update(Job).where(Job.status == 'running', Job.locked_until < func.now())
+                      .values(status=case((Job.cancel_requested, 'cancelled'),
+                                          (Job.attempts >= Job.max_attempts, 'failed'), else_='queued'),
+                              finished_at=case((gone, func.now()), else_=None),
+                              error='Lease expired, the worker was lost', locked_by=None, locked_until=None)
+                      .execution_options(synchronize_session=False)).rowcount
+
+
+def export_path(job_id: int) -> str:
+    return os.path.join(JOB_EXPORT_DIR, f"job-{job_id}.ndjson")
+
+
+def purge_finished(db: Session) -> int:
+    ids = db.scalars(delete(Job).where(Job.finished_at < func.now() - timedelta(days=JOB_RETENTION_DAYS))
+                     .returning(Job.id)).all()
+    for job_id in ids:
+        try:
+            os.remove(export_path(job_id))
+        except FileNotFoundError:
+            pass
+    return len(ids)
+
+
+class Progress:
+    # Passed to the handlers. progress(done, total) writes at most every PROGRESS_INTERVAL in its own
+    # transaction; save() writes in the handler's, with the work it accounts for. Both raise JobCancelled
+    # once the job is cancelled and JobLost once it is no longer this worker's.
+    def __init__(self, job_id: int, worker: str):
+        self.job_id = job_id
+        self.worker = worker
+        self.written_at = 0.0
+
+    def __call__(self, done: int, total: Optional[int] = None):
+        if time.monotonic() - self.written_at < PROGRESS_INTERVAL:
+            return
+        with SessionLocal() as db:
+            self.save(db, done, total)
+            db.commit()
+
+    def save(self, db: Session, done: int, total: Optional[int] = None, result: Optional[dict] = None):
+        values = {'progress_done': done}
+        if total is not None:
+            values['progress_total'] = total
+        if result is not None:
+            values['result'] = result
+        cancel_requested = db.scalar(extend_lease(self.job_id, self.worker, **values))
+        self.written_at = time.monotonic()
+        if cancel_requested is None:
+            raise JobLost(self.job_id)
+        if cancel_requested:
+            raise JobCancelled(self.job_id)
+
+
+# Handlers: handler(job, params, progress) -> result, run in a worker process with their own sessions.
+# A retried job runs its handler again from the start, except where it resumes from progress_done.
+
+def run_rebuild_stats(job: Job, params: RebuildStatsParams, progress: Progress):
+    with SessionLocal() as db:
+        rebuild_treatment_stats(db)
+    return {}
+
+
+IMPORT_MODELS = {'patient': Patient, 'treatment': Treatment, 'medic': Medic}
+
+
+def run_import(job: Job, params: ImportParams, progress: Progress):
+    # chunks of BULK_MAX_ROWS, each committed with its progress, so a retry goes on with the next chunk;
+    # the new ids are not kept, error indexes are positions in params.rows
+    model = IMPORT_MODELS[params.entity]
+    result = job.result or {'inserted': 0, 'rejected': 0, 'errors': []}
+    total = len(params.rows)
+    for start in range(job.progress_done, total, BULK_MAX_ROWS):
+        chunk = params.rows[start:start + BULK_MAX_ROWS]
+        with SessionLocal() as db:
+            ids, errors = bulk_create(db, model, chunk)
+            result['inserted'] += len(chunk) - len(errors)
+            result['rejected'] += len(errors)
+            result['errors'] += [{'index': start + error.index, 'errors': error.errors}
+                                 for error in errors[:JOB_MAX_ERRORS - len(result['errors'])]]
+            progress.save(db, start + len(chunk), total, result)
+            db.commit()
+        if model is Medic:
+            # reaches the API workers with CACHE_BACKEND=redis, their local caches expire with CACHE_TTL
+            invalidate_medic_list()
+    return result
+
+
+EXPORTS = {'patients': (Patient, PatientResponse), 'treatments': (Treatment, TreatmentResponse)}
+
+
+def run_export(job: Job, params: ExportParams, progress: Progress):
+    # NDJSON written under a temporary name and renamed when complete; a retry starts over
+    model, schema = EXPORTS[params.entity]
+    where = started_between(params.date_from, params.date_to) if model is Treatment else []
+    order = (Treatment.date_start, Treatment.id) if model is Treatment else (Patient.id,)
+    with SessionLocal() as db:
+        total = db.scalar(select(func.count()).select_from(model).where(*where))
+    progress(0, total)
+    statement = select(*projection(model, list(schema.model_fields))).where(*where).order_by(*order)
+    os.makedirs(JOB_EXPORT_DIR, exist_ok=True)
+    path = export_path(job.id)
+    rows = 0
+    try:
+        with open(path + '.partial', 'wb') as file:
+            for chunk in ndjson_lines(statement, lambda row: dict(row._mapping)):
+                file.write(chunk)
+                rows += chunk.count(b'\n')
+                progress(rows, total)
+    except BaseException:
+        # cancelled, lost or failed: nothing is left behind for purge_finished to miss; the error raised is
+        # the handler's, also when the file was never created
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + '.partial')
+        raise
+    os.replace(path + '.partial', path)
+    return {'rows': rows, 'file': os.path.basename(path)}
+
+
+def run_archive_partitions(job: Job, params: ArchiveParams, progress: Progress):
+    # ArchiveParams checked the month against ARCHIVE_KEEP_MONTHS, again when the job runs
+    return {'partitions': archive_partitions(parse_month(params.before))}
+
+
+class JobKind(NamedTuple):
+    handler: Callable
+    params: type
+    # False: a failure is final, e.g. DDL that should not be tried again unattended
+    retry: bool = True
+
+
+JOB_KINDS = {
+    'rebuild_stats': JobKind(run_rebuild_stats, RebuildStatsParams),
+    'import': JobKind(run_import, ImportParams),
+    'export': JobKind(run_export, ExportParams),
+    'archive_partitions': JobKind(run_archive_partitions, ArchiveParams, retry=False),
+}
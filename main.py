@@ -1,16 +1,89 @@
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy import func, asc, desc
-from sqlalchemy.orm import Session, selectinload
-from models import Patient, Treatment, Medic
-from database import Base, engine, SessionLocal
-from pydantic import BaseModel
+from startup_clock import started_at  # first, it starts the clock of app_startup_seconds{phase="import"}
+import asyncio
+import logging
+import os
+import re
+import time
 from datetime import date
-from typing import List
-
-from populate import session
-
-app = FastAPI()
-Base.metadata.create_all(bind=engine)
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, select, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import Patient, Treatment, Medic, Job, has_treatment
+from database import SessionLocal, ASYNC_DB, init_engines, dispose_engines, schema_revision
+from pydantic import ValidationError
+from typing import List, Optional
+from schemas import (PatientCreate, PatientResponse, PatientDelete, TreatmentCreate, TreatmentResponse,
+                     TreatmentDelete, MedicCreate, MedicResponse, MedicDelete, BulkResponse,
+                     PatientSearchHit, PatientCount, TreatmentPatch, TreatmentBulkUpdate, PatientTimeline,
+                     MedicCaseload, DurationStat, MedicOverlap, JobCreate, JobResponse)
+
+from pagination import PER_PAGE_MAX, keyset_page, keyset_query, page_rows, sort_column, sort_order
+from filters import parse_filters, parse_fields, parse_value, filters_key, projection
+from serialization import rows_response, wants_columnar, dumps, JSON
+from writes import (response_columns, insert_returning, create_treatment_statement, update_returning,
+                    delete_returning_treatments, detach_patients, treatments_matching, update_treatments_by_ids)
+from streaming import NDJSON, wants_ndjson, ndjson_response
+from metrics import render_metrics, Gauge
+from cache import (get_or_load, entity_key, invalidate, medic_list_key, invalidate_medic_list, cache_value,
+                   versioned_value)
+from http_cache import conditional, entity_etag, page_etag, stats_etag
+from stats import STATS_DIMENSIONS, treatment_stats_query, treatment_stats_window_query
+from request_stats import track_queries
+from analytics import ANALYTICS_MAX_DAYS, run_bounded, caseload_query, duration_query, overlap_query
+from timeline import TIMELINE_MAX_IDS, treatment_window, timeline_query, batch_timeline_query
+from replicas import REPLICAS, init_replicas, monitor_replicas, dispose_replicas, get_read_db, read_your_writes
+from partitions import started_between
+from bulk import bulk_create
+from jobs import JOB_KINDS, TERMINAL, enqueue, cancel, job_columns, export_path
+
+# Nothing here touches the database at import: the schema is Alembic's (see init_db.py)
+# and the lifespan below only checks it, so a worker starts in constant time whatever the table sizes.
+STARTUP_SECONDS = Gauge("app_startup_seconds", "Time to import main and to run the lifespan startup", ("phase",))
+startup_log = logging.getLogger("startup")
+
+
+def check_schema():
+    # one small query; a database behind the migrations is logged, not fixed
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    from init_db import ALEMBIC_INI
+
+    head = ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_current_head()
+    revision = schema_revision()
+    if revision != head:
+        startup_log.warning("database schema is at %s, expected %s: run alembic upgrade head", revision, head)
+
+
+@asynccontextmanager
+async def lifespan(app_: FastAPI):
+    imported = time.perf_counter() - started_at
+    start = time.perf_counter()
+    # here and not at import, so every worker process builds its own pools (see serve.py)
+    init_engines()
+    await run_in_threadpool(check_schema)
+    await run_in_threadpool(init_replicas)
+    monitor = asyncio.create_task(monitor_replicas()) if REPLICAS else None
+    ready = time.perf_counter() - start
+    STARTUP_SECONDS.set_function(lambda: imported, "import")
+    STARTUP_SECONDS.set_function(lambda: ready, "lifespan")
+    startup_log.info("imported in %.3fs, started in %.3fs", imported, ready)
+    yield
+    if monitor is not None:
+        monitor.cancel()
+    await dispose_replicas()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+# statement count and DB time per request, see request_stats.py
+app.middleware("http")(track_queries)
+# reads go to the primary for a while after a client's write, see replicas.py
+app.middleware("http")(read_your_writes)
 
 
 def get_db():
@@ -21,66 +94,6 @@ def get_db():
         db.close()
 
 
-class PatientCreate(BaseModel):
-    full_name: str
-    date_of_birth: date
-    policy_number: int
-    social_status: str
-
-
-class PatientResponse(BaseModel):
-    id: int
-    full_name: str
-    date_of_birth: date
-    policy_number: int
-    social_status: str
-
-
-class PatientDelete(BaseModel):
-    message: str
-
-
-# Pydantic model for Result
-class TreatmentCreate(BaseModel):
-    diagnosis: str
-    current_state: str
-    date_start: date
-    date_end: date
-    patient_id: int
-    medic_id: int
-
-
-class TreatmentResponse(BaseModel):
-    id: int
-    diagnosis: str
-    current_state: str
-    date_start: date
-    date_end: date
-    patient_id: int
-    medic_id: int
-
-
-class TreatmentDelete(BaseModel):
-    message: str
-
-
-# Pydantic model for Athlete
-class MedicCreate(BaseModel):
-    full_name: str
-    speciality: str
-    exp_years: int
-
-
-class MedicResponse(BaseModel):
-    id: int
-    full_name: str
-    speciality: str
-    exp_years: int
-
-
-class MedicDelete(BaseModel):
-    message: str
-
 # Basic CRUD using FastAPI
 
 # Create
@@ -88,187 +101,348 @@ class MedicDelete(BaseModel):
 
 @app.post("/patient/", response_model=PatientResponse)
 def create_patient(patient_: PatientCreate, db: Session = Depends(get_db)):
-    db_patient = Patient(**patient_.model_dump())
-    db.add(db_patient)
+    db_patient = db.execute(insert_returning(Patient, PatientResponse, patient_.model_dump())).one()
     db.commit()
-    db.refresh(db_patient)
     return db_patient
 
 
 @app.post("/treatment/", response_model=TreatmentResponse)
 def create_treatment(treatment: TreatmentCreate, db: Session = Depends(get_db)):
-    db_treatment = Treatment(**treatment.model_dump())
-    db.add(db_treatment)
+    # sets the patient's medic_id too, for patient_with_medic
+    db_treatment = db.execute(create_treatment_statement(treatment.model_dump(), TreatmentResponse)).one()
     db.commit()
-    db.refresh(db_treatment)
-    # for patient_with_medic
-    patient = db.query(Patient).filter(Patient.id == treatment.patient_id).first() # noqa
-    if patient is not None:
-        patient.medic_id = treatment.medic_id
-        db.commit()
-
     return db_treatment
 
 
 @app.post("/medic/", response_model=MedicResponse)
 def create_medic(medic: MedicCreate, db: Session = Depends(get_db)):
-    db_medic = Medic(**medic.model_dump())
-    db.add(db_medic)
+    db_medic = db.execute(insert_returning(Medic, MedicResponse, medic.model_dump())).one()
     db.commit()
-    db.refresh(db_medic)
+    invalidate_medic_list()
     return db_medic
 
 
-# Read
+# Bulk create, one transaction per request, up to BULK_MAX_ROWS rows (see bulk.py); import jobs take more
+
+
+@app.post("/patient/bulk", response_model=BulkResponse)
+def create_patients_bulk(rows: List[dict], db: Session = Depends(get_db)):
+    ids, errors = bulk_create(db, Patient, rows)
+    db.commit()
+    return {"ids": ids, "errors": errors}
+
+
+@app.post("/treatment/bulk", response_model=BulkResponse)
+def create_treatments_bulk(rows: List[dict], db: Session = Depends(get_db)):
+    ids, errors = bulk_create(db, Treatment, rows)
+    db.commit()
+    return {"ids": ids, "errors": errors}
+
+
+@app.post("/medic/bulk", response_model=BulkResponse)
+def create_medics_bulk(rows: List[dict], db: Session = Depends(get_db)):
+    ids, errors = bulk_create(db, Medic, rows)
+    db.commit()
+    invalidate_medic_list()
+    return {"ids": ids, "errors": errors}
+
+
+# Read, through the cache
+# These stay on the primary (get_db): a row read from a lagging replica would sit in the cache
+# for CACHE_TTL, past any read-your-writes stickiness. The cache is what scales them.
 @app.get("/patient/{patient_id}", response_model=PatientResponse)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(Patient).filter(Patient.id == patient_id).first() # noqa
+def get_patient(patient_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    patient = get_or_load("patient", entity_key("patient", patient_id), lambda: versioned_value(
+        PatientResponse, db.query(Patient).filter(Patient.id == patient_id).first())) # noqa
     if patient is None:
         raise HTTPException(status_code=404, detail='Patient not found')
-    return patient
+    return conditional(request, response, entity_etag("patient", patient_id, patient["version"])) or patient["data"]
 
 
 @app.get("/medic/{medic_id}", response_model=MedicResponse)
-def get_medic(medic_id: int, db: Session = Depends(get_db)):
-    medic = db.query(Medic).filter(Medic.id == medic_id).first() # noqa
+def get_medic(medic_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    medic = get_or_load("medic", entity_key("medic", medic_id), lambda: versioned_value(
+        MedicResponse, db.query(Medic).filter(Medic.id == medic_id).first())) # noqa
     if medic is None:
         raise HTTPException(status_code=404, detail='Medic not found')
-    return medic
+    return conditional(request, response, entity_etag("medic", medic_id, medic["version"])) or medic["data"]
 
 
 @app.get("/treatment/{treatment_id}", response_model=TreatmentResponse)
-def get_treatment(treatment_id: int, db: Session = Depends(get_db)):
-    treatment = db.query(Treatment).filter(Treatment.id == treatment_id).first() # noqa
+def get_treatment(treatment_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    treatment = get_or_load("treatment", entity_key("treatment", treatment_id), lambda: versioned_value(
+        TreatmentResponse, db.query(Treatment).filter(Treatment.id == treatment_id).first())) # noqa
     if treatment is None:
         raise HTTPException(status_code=404, detail='Treatment not found')
-    return treatment
+    etag = entity_etag("treatment", treatment_id, treatment["version"])
+    return conditional(request, response, etag) or treatment["data"]
 
 
 # Update
 @app.put("/patient/{patient_id}", response_model=PatientResponse)
 def update_patient(patient_id: int, updated: PatientCreate, db: Session = Depends(get_db)):
-    patient = db.query(Patient).filter(Patient.id == patient_id).first() # noqa
+    patient = db.execute(update_returning(Patient, PatientResponse, patient_id, updated.model_dump())).first()
     if patient is None:
         raise HTTPException(status_code=404, detail='Patient not found')
 
-    for key, value in updated.model_dump().items():
-        setattr(patient, key, value)
-
     db.commit()
-    db.refresh(patient)
+    invalidate("patient", patient_id)
     return patient
 
 
 @app.put("/treatment/{treatment_id}", response_model=TreatmentResponse)
 def update_treatment(treatment_id: int, updated: TreatmentCreate, db: Session = Depends(get_db)):
-    treatment = db.query(Treatment).filter(Treatment.id == treatment_id).first() # noqa
+    treatment = db.execute(update_returning(Treatment, TreatmentResponse, treatment_id,
+                                            updated.model_dump())).first()
     if treatment is None:
         raise HTTPException(status_code=404, detail='Treatment not found')
 
-    for key, value in updated.model_dump().items():
-        setattr(treatment, key, value)
-
     db.commit()
-    db.refresh(treatment)
+    invalidate("treatment", treatment_id)
     return treatment
 
 
 @app.put("/medic/{medic_id}", response_model=MedicResponse)
 def update_medic(medic_id: int, updated: MedicCreate, db: Session = Depends(get_db)):
-    medic = db.query(Medic).filter(Medic.id == medic_id).first() # noqa
+    medic = db.execute(update_returning(Medic, MedicResponse, medic_id, updated.model_dump())).first()
     if medic is None:
         raise HTTPException(status_code=404, detail="Medic not found")
 
-    for key, value in updated.model_dump().items():
-        setattr(medic, key, value)
-
     db.commit()
-    db.refresh(medic)
+    invalidate("medic", medic_id)
+    invalidate_medic_list()
     return medic
 
 
 # Delete
+# The FK cascades remove the treatments in the database; the statement also returns their ids for the cache
 @app.delete("/patient/{patient_id}", response_model=PatientDelete)
 def delete_patient(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(Patient).filter(Patient.id == patient_id).first() # noqa
-    if patient is None:
+    deleted = db.execute(delete_returning_treatments(Patient, patient_id, Treatment.patient_id)).all()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    db.delete(patient)
     db.commit()
+    invalidate("patient", patient_id)
+    invalidate("treatment", *[row.treatment_id for row in deleted if row.treatment_id is not None])
     return {"message": "Patient deleted"}
 
 
 @app.delete("/treatment/{treatment_id}", response_model=TreatmentDelete)
 def delete_treatment(treatment_id: int, db: Session = Depends(get_db)):
-    treatment = db.query(Treatment).filter(Treatment.id == treatment_id).first() # noqa
-    if treatment is None:
+    deleted = db.execute(delete(Treatment).where(Treatment.id == treatment_id).returning(Treatment.id)).first()
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Treatment not found")
 
-    db.delete(treatment)
     db.commit()
+    invalidate("treatment", treatment_id)
     return {"message": "Treatment deleted"}
 
 
 @app.delete("/medic/{medic_id}", response_model=MedicDelete)
 def delete_medic(medic_id: int, db: Session = Depends(get_db)):
-    medic = db.query(Medic).filter(Medic.id == medic_id).first() # noqa
-    if medic is None:
+    db.execute(detach_patients(medic_id))
+    deleted = db.execute(delete_returning_treatments(Medic, medic_id, Treatment.medic_id)).all()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Medic not found")
 
-    db.delete(medic)
     db.commit()
+    invalidate("medic", medic_id)
+    invalidate("treatment", *[row.treatment_id for row in deleted if row.treatment_id is not None])
+    invalidate_medic_list()
     return {"message": "Medic deleted"}
 
 
 # Read with pagination
+# Pass the X-Next-Cursor header of a response as ?cursor= to get the next page.
+# page is the legacy row offset, it is ignored once a cursor is given.
+
+
+def conditional_page(request: Request, response: Response, db: Session, model, schema, kind: str, sort_by: str,
+                     order: str, per_page: int, cursor: Optional[str], page: int, fields: Optional[str]):
+    # With If-None-Match only the (id, version) pairs of the page are read first;
+    # the ETag covers the look-ahead row too, so it also changes with X-Next-Cursor.
+    where = parse_filters(request, model)
+    fields_ = parse_fields(fields, schema)
+    columnar = wants_columnar(request)
+    variant = ",".join(fields_ or []) + (";columnar" if columnar else "")
+    if request.headers.get("if-none-match") is not None:
+        probe = keyset_query(db.query(model.id, model.version).filter(*where), model, sort_by, order, per_page,
+                             cursor, offset=page).all()
+        not_modified = conditional(request, response, page_etag(kind, probe, variant))
+        if not_modified is not None:
+            return not_modified
+    names = fields_ or list(schema.model_fields)
+    columns = projection(model, names, "id", "version", sort_column(model, sort_by).key)
+    rows = keyset_query(db.query(*columns).filter(*where), model, sort_by, order, per_page, cursor, offset=page).all()
+    conditional(request, response, page_etag(kind, rows, variant))
+    rows, next_cursor = page_rows(rows, sort_by, order, per_page)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows_response(rows, names, response, columnar)
+
+
+# Filters are query parameters too, see filters.FILTERS: ?date_of_birth__gte=1990-01-01&social_status=student
+# The cursor does not carry them, send the same filters with every page.
+# On /treatment/ date_start bounds, and the pages of sort_by=date_start, only read the partitions of their months.
+
+
 @app.get("/patient/", response_model=List[PatientResponse])
-def get_patient(page: int = 0, per_page: int = 10, db: Session = Depends(get_db)):
-    patient_ = db.query(Patient).offset(page).limit(per_page).all()
-    return patient_
+def get_patient(request: Request, response: Response, page: int = Query(0, ge=0),
+                per_page: int = Query(10, ge=1, le=PER_PAGE_MAX), sort_by: str = "id", order: str = "asc",
+                cursor: Optional[str] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    return conditional_page(request, response, db, Patient, PatientResponse, "patients", sort_by, order, per_page,
+                            cursor, page, fields)
 
 
 @app.get("/treatment/", response_model=List[TreatmentResponse])
-def get_treatment(page: int = 0, per_page: int = 10, db: Session = Depends(get_db)):
-    treatment = db.query(Treatment).offset(page).limit(per_page).all()
-    return treatment
+def get_treatment(request: Request, response: Response, page: int = Query(0, ge=0),
+                  per_page: int = Query(10, ge=1, le=PER_PAGE_MAX), sort_by: str = "id", order: str = "asc",
+                  cursor: Optional[str] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    return conditional_page(request, response, db, Treatment, TreatmentResponse, "treatments", sort_by, order,
+                            per_page, cursor, page, fields)
 
 
 @app.get("/medic/", response_model=List[MedicResponse])
-def get_medic_sorted(page: int = 0, per_page: int = 10, sort_by: str = "id", db: Session = Depends(get_db)):
-    medic = db.query(Medic).order_by(getattr(Medic, sort_by)).offset(page).limit(per_page).all()
-    return medic
+def get_medic_sorted(request: Request, response: Response, page: int = Query(0, ge=0),
+                     per_page: int = Query(10, ge=1, le=PER_PAGE_MAX), sort_by: str = "id", order: str = "asc",
+                     cursor: Optional[str] = None, fields: Optional[str] = None, db: Session = Depends(get_db)):
+    where = parse_filters(request, Medic)
+    fields_ = parse_fields(fields, MedicResponse)
+    columnar = wants_columnar(request)
+
+    def load():
+        # whole rows are cached, fields= is applied to the cached page
+        rows = keyset_query(db.query(Medic).filter(*where), Medic, sort_by, order, per_page, cursor, offset=page).all()
+        etag = page_etag("medics", rows, ",".join(fields_ or []) + (";columnar" if columnar else ""))
+        rows, next_cursor_ = page_rows(rows, sort_by, order, per_page)
+        return {"rows": [cache_value(MedicResponse, row) for row in rows], "next_cursor": next_cursor_, "etag": etag}
+
+    page_ = get_or_load("medic_list", medic_list_key(page, per_page, sort_by, order, cursor, filters_key(request)),
+                        load)
+    not_modified = conditional(request, response, page_["etag"])
+    if not_modified is not None:
+        return not_modified
+    if page_["next_cursor"] is not None:
+        response.headers["X-Next-Cursor"] = page_["next_cursor"]
+    return rows_response(page_["rows"], fields_ or list(MedicResponse.model_fields), response, columnar)
 
 # SELECT... WHERE
 
 
 @app.get("/api/patients/search", response_model=List[PatientResponse])
-def search_patients(diagnosis: str, current_state: str, db: Session = Depends(get_db)):
-    patients = db.query(Patient).filter(Treatment.diagnosis == diagnosis, # noqa
-                                        Treatment.current_state == current_state).all() # noqa
-    if not patients:
+def search_patients(request: Request, response: Response, diagnosis: str, current_state: str,
+                    per_page: Optional[int] = Query(None, ge=1, le=PER_PAGE_MAX), cursor: Optional[str] = None,
+                    db: Session = Depends(get_read_db)):
+    fields = list(PatientResponse.model_fields)
+    query = db.query(*projection(Patient, fields)).filter(has_treatment(diagnosis, current_state))
+    if per_page is not None or cursor is not None:
+        patients, next_cursor = keyset_page(query, Patient, "id", "asc", per_page or 10, cursor)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+    else:
+        patients = query.all()
+    if not patients and cursor is None:
         raise HTTPException(status_code=404, detail="No matches found")
-    return patients
+    return rows_response(patients, fields, response, wants_columnar(request))
+
+
+@app.get("/api/patients/search/count", response_model=PatientCount)
+def count_search_patients(diagnosis: str, current_state: str, db: Session = Depends(get_read_db)):
+    return {"count": db.scalar(select(func.count(Patient.id)).where(has_treatment(diagnosis, current_state)))}
+
+# FULL-TEXT SEARCH
+# Typeahead over name, diagnoses and social status: every word of q is matched as a prefix (whole when
+# it is shorter than TEXT_SEARCH_MIN_PREFIX) against the GIN indexed patients.search_vector, best ranked first.
+
+# shorter prefixes match most of the table, which ts_rank would then rank and sort in full:
+# shorter words are matched whole, and q needs one word long enough for a prefix
+TEXT_SEARCH_MIN_PREFIX = 3
+
+
+def prefix_tsquery(q: str) -> str:
+    words = re.findall(r'\w+', q)
+    if not words:
+        raise HTTPException(status_code=400, detail='Empty search query')
+    if all(len(word) < TEXT_SEARCH_MIN_PREFIX for word in words):
+        raise HTTPException(status_code=400,
+                            detail=f'Search query needs a word of at least {TEXT_SEARCH_MIN_PREFIX} characters')
+    return ' & '.join(word + ':*' if len(word) >= TEXT_SEARCH_MIN_PREFIX else word for word in words)
+
+
+@app.get("/api/patients/text_search", response_model=List[PatientSearchHit])
+def text_search_patients(request: Request, q: str, page: int = Query(0, ge=0),
+                         per_page: int = Query(20, ge=1, le=100), db: Session = Depends(get_read_db)):
+    # page is a row offset, as on the other list endpoints
+    query = func.to_tsquery('simple', prefix_tsquery(q))
+    rank = func.ts_rank(Patient.search_vector, query).label('rank')
+    rows = db.execute(select(*projection(Patient, list(PatientResponse.model_fields)), rank)
+                      .where(Patient.search_vector.op('@@')(query))
+                      .order_by(rank.desc(), Patient.id)
+                      .offset(page).limit(per_page))
+    return rows_response(rows, list(PatientSearchHit.model_fields), columnar=wants_columnar(request))
 
 # JOIN
 
 
 @app.get("/api/patients_with_medic/", response_model=List[dict])
-def get_patients_with_medic(db: Session = Depends(get_db)):
-    patients_with_medic = db.query(Patient).options(selectinload(Patient.medic)).all()
-    patients_data = []
-    for patient_ in patients_with_medic:
-        if patient_.medic is not None:
-            patients_data.append({
-                "id": patient_.id,
-                "name": patient_.full_name,
-                "medic": {
-                    "id": patient_.medic.id,
-                    "name": patient_.medic.full_name,
-                    "specialty": patient_.medic.speciality,
-                }
-            })
-    return patients_data
+def get_patients_with_medic(request: Request, stream: bool = False, db: Session = Depends(get_read_db)):
+    statement = select(Patient.id, Patient.full_name, Medic.id.label('medic_id'),
+                       Medic.full_name.label('medic_name'), Medic.speciality).join(Patient.medic)
+    if wants_ndjson(request, stream):
+        return ndjson_response(statement, lambda row: {
+            "id": row.id,
+            "name": row.full_name,
+            "medic": {"id": row.medic_id, "name": row.medic_name, "specialty": row.speciality},
+        }, bind=db.get_bind())
+
+    # the same rows as the stream, nested in one comprehension; patients without a medic are left out
+    rows = db.execute(statement)
+    return Response(dumps([{"id": id_, "name": name, "medic": {"id": medic_id, "name": medic_name,
+                                                               "specialty": speciality}}
+                           for id_, name, medic_id, medic_name, speciality in rows]), media_type=JSON)
+
+# TIMELINE
+# A patient chart in one request, in a fixed number of statements (see timeline.py).
+# date_from/date_to keep the treatments overlapping the window; the single timeline pages
+# with per_page and X-Next-Cursor, the batch returns the first per_patient of each.
+
+
+def timeline(patient: Patient, treatments: list, has_more: bool) -> dict:
+    return {**{name: getattr(patient, name) for name in PatientResponse.model_fields},
+            "treatments": treatments, "has_more": has_more}
+
+
+@app.get("/patient/{patient_id}/timeline", response_model=PatientTimeline)
+def get_patient_timeline(patient_id: int, response: Response, date_from: Optional[date] = None,
+                         date_to: Optional[date] = None, per_page: int = Query(100, ge=1, le=1000),
+                         cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    patient = db.get(Patient, patient_id)
+    if patient is None:
+        raise HTTPException(status_code=404, detail='Patient not found')
+    window = treatment_window(date_from, date_to)
+    treatments = db.scalars(timeline_query(patient_id, window, per_page, cursor)).all()
+    treatments, next_cursor = page_rows(treatments, "date_start", "asc", per_page)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return timeline(patient, treatments, next_cursor is not None)
+
+
+@app.get("/api/patients/timeline", response_model=List[PatientTimeline])
+def get_patient_timelines(ids: str, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                          per_patient: int = Query(20, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    # ?ids=1,2,3; in the order given, unknown ids are left out
+    patient_ids = list(dict.fromkeys(parse_value(Patient.id, value) for value in ids.split(",") if value))
+    if not patient_ids or len(patient_ids) > TIMELINE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f'ids takes 1 to {TIMELINE_MAX_IDS} patient ids')
+    patients = {patient.id: patient for patient in db.scalars(select(Patient).where(Patient.id.in_(patient_ids)))}
+    treatments = {patient_id: [] for patient_id in patients}
+    window = treatment_window(date_from, date_to)
+    for treatment in db.scalars(batch_timeline_query(list(patients), window, per_patient)):
+        treatments[treatment.patient_id].append(treatment)
+    return [timeline(patients[patient_id], treatments[patient_id][:per_patient],
+                     len(treatments[patient_id]) > per_patient)
+            for patient_id in patient_ids if patient_id in patients]
 
 # UPDATE
 
@@ -276,63 +450,259 @@ def get_patients_with_medic(db: Session = Depends(get_db)):
 @app.put("/api/treatments/update_by_conditions/{diagnosis}/{current_state}", response_model=TreatmentResponse)
 def update_treatment_by_conditions(diagnosis: str, current_state: str, updated: TreatmentCreate,
                                    db: Session = Depends(get_db)):
-    treatment = db.query(Treatment).filter(Treatment.diagnosis == diagnosis, # noqa
-                                           Treatment.current_state == current_state).first() # noqa
+    # first match only; PATCH below updates every match
+    first = treatments_matching(diagnosis, current_state, limit=1)
+    columns = response_columns(Treatment, TreatmentResponse)
+    if updated.patient_id != 0:
+        statement = update_treatments_by_ids(first, updated.model_dump(), *columns)
+    else:
+        # patient_id 0 leaves the treatment as it is
+        statement = select(*columns).where(Treatment.id.in_(first.scalar_subquery()))
+    treatment = db.execute(statement).first()
     if treatment is None:
         raise HTTPException(status_code=404, detail='Treatment not found')
-
-    for key, value in updated.model_dump().items():
-        if updated.patient_id != 0:
-            setattr(treatment, key, value)
-
     db.commit()
-    db.refresh(treatment)
+    invalidate("treatment", treatment.id)
     return treatment
 
+
+@app.patch("/api/treatments/update_by_conditions/{diagnosis}/{current_state}", response_model=TreatmentBulkUpdate)
+def update_treatments_by_conditions(diagnosis: str, current_state: str, updated: TreatmentPatch,
+                                    dry_run: bool = False, limit: Optional[int] = Query(None, ge=1),
+                                    chunk_size: Optional[int] = Query(None, ge=1), db: Session = Depends(get_db)):
+    # set-based: UPDATE ... WHERE id IN (matching ids) RETURNING id, only the fields that are sent.
+    # Without chunk_size all matches (up to limit) change atomically in one statement;
+    # with it every chunk is its own transaction, so row locks are held for one chunk at a time.
+    values = updated.model_dump(exclude_unset=True)
+    if dry_run:
+        matched = db.scalar(select(func.count()).select_from(
+            treatments_matching(diagnosis, current_state, limit=limit).subquery()))
+        return {"matched": matched, "updated": 0, "chunks": 0}
+    if not values:
+        raise HTTPException(status_code=400, detail='Nothing to update')
+    if 'patient_id' in values and db.get(Patient, values['patient_id']) is None:
+        raise HTTPException(status_code=404, detail='Patient not found')
+    if 'medic_id' in values and db.get(Medic, values['medic_id']) is None:
+        raise HTTPException(status_code=404, detail='Medic not found')
+
+    updated_count = chunks = last_id = 0
+    while limit is None or updated_count < limit:
+        size = chunk_size if limit is None else min(chunk_size or limit, limit - updated_count)
+        try:
+            ids = db.scalars(update_treatments_by_ids(
+                treatments_matching(diagnosis, current_state, last_id, size), values)).all()
+        except IntegrityError as e:
+            # one date sent, a matching treatment's other one is on the wrong side of it
+            if getattr(e.orig.diag, "constraint_name", None) != "ck_treatments_period":
+                raise
+            db.rollback()
+            raise HTTPException(status_code=422, detail=f'date_end would be before date_start, '
+                                                        f'{updated_count} treatments updated before that')
+        db.commit()
+        if not ids:
+            break
+        invalidate("treatment", *ids)
+        updated_count += len(ids)
+        chunks += 1
+        last_id = max(ids)
+        if size is None or len(ids) < size:
+            break
+    return {"matched": updated_count, "updated": updated_count, "chunks": chunks}
+
 # GROUP BY
 
 
 @app.get("/api/treatments/stats", response_model=dict)
-def get_treatments_stats(db: Session = Depends(get_db)):
-    result = db.query(Treatment.diagnosis,
-                      func.count(Treatment.id).label('treatment_count')).group_by(Treatment.diagnosis).all()
-    return {row[0]: row[1] for row in result}
+def get_treatments_stats(request: Request, response: Response, by: str = "diagnosis",
+                         date_from: Optional[date] = None, date_to: Optional[date] = None,
+                         db: Session = Depends(get_read_db)):
+    # served from the treatment_stats counters instead of a GROUP BY over treatments
+    if by not in STATS_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f'Invalid by parameter. Use one of {", ".join(STATS_DIMENSIONS)}.')
+    if date_from is not None or date_to is not None:
+        # treatments started in the window, counted on the partitions of its months only
+        rows = run_bounded(db, treatment_stats_window_query(by, *started_between(date_from, date_to)))
+        return {row.key: row.count for row in rows}
+    rows = db.execute(treatment_stats_query(by)).all()
+    not_modified = conditional(request, response, stats_etag(by, rows))
+    if not_modified is not None:
+        return not_modified
+    return {row[0]: row[1] for row in rows}
+
+
+@app.post("/api/treatments/stats/rebuild", response_model=dict, status_code=202)
+def rebuild_treatments_stats(response: Response, db: Session = Depends(get_db)):
+    # a job (see jobs.py): the rebuild locks treatments against writes for as long as it takes
+    job_id = enqueue(db, 'rebuild_stats', {})
+    db.commit()
+    response.headers["Location"] = f"/api/jobs/{job_id}"
+    return {"message": "Treatment stats rebuild queued", "job_id": job_id}
+
+# ANALYTICS
+# Medic workload, computed in the database, see analytics.py
+
+
+@app.get("/api/analytics/medics/caseload", response_model=List[MedicCaseload])
+def get_medic_caseload(as_of: Optional[date] = None, speciality: Optional[str] = None,
+                       limit: int = Query(50, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    # active: date_start <= as_of <= date_end, today by default
+    return run_bounded(db, caseload_query(as_of or date.today(), speciality, limit))
+
+
+@app.get("/api/analytics/duration", response_model=List[DurationStat])
+def get_treatment_duration(request: Request, response: Response, by: str = "speciality",
+                           db: Session = Depends(get_read_db)):
+    if by not in STATS_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f'Invalid by parameter. Use one of {", ".join(STATS_DIMENSIONS)}.')
+    rows = db.execute(duration_query(by)).all()
+    not_modified = conditional(request, response, stats_etag(f"duration-{by}", rows))
+    if not_modified is not None:
+        return not_modified
+    return rows
+
+
+@app.get("/api/analytics/medics/overlap", response_model=List[MedicOverlap])
+def get_medic_overlap(date_from: date, date_to: date, medic_id: Optional[int] = None,
+                      limit: int = Query(50, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    if not 0 <= (date_to - date_from).days < ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f'date_from..date_to must span 1 to {ANALYTICS_MAX_DAYS} days')
+    return run_bounded(db, overlap_query(date_from, date_to, medic_id, limit))
 
 # SORT
 
 
 @app.get("/api/patients", response_model=List[PatientResponse])
-def get_sorted_patients(sort_by: str, order: str, db: Session = Depends(get_db)):
-    if order.lower() not in ['asc', 'desc']:
-        raise HTTPException(status_code=400, detail='Invalid order parameter. Use "asc" or "desc".')
+def get_sorted_patients(request: Request, response: Response, sort_by: str, order: str,
+                        per_page: Optional[int] = Query(None, ge=1, le=PER_PAGE_MAX), cursor: Optional[str] = None,
+                        stream: bool = False, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    # takes the same filters and fields= as /patient/
+    where = parse_filters(request, Patient)
+    fields_ = parse_fields(fields, PatientResponse) or list(PatientResponse.model_fields)
+    columnar = wants_columnar(request)
+
+    # without per_page the whole (filtered) table is returned, as before
+    if per_page is not None or cursor is not None:
+        columns = projection(Patient, fields_, "id", sort_column(Patient, sort_by).key)
+        patients_, next_cursor = keyset_page(db.query(*columns).filter(*where), Patient, sort_by, order,
+                                             per_page or 10, cursor)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return rows_response(patients_, fields_, response, columnar)
+
+    # the columns and order of the pages above
+    statement = select(*projection(Patient, fields_)).where(*where).order_by(*sort_order(Patient, sort_by, order))
+    if wants_ndjson(request, stream):
+        # Accept: application/x-ndjson or ?stream=1, rows are sent as they are fetched
+        return ndjson_response(statement, bind=db.get_bind())
+
+    rows = db.execute(statement)
+    return rows_response(rows, fields_, columnar=columnar)
+
+# JOBS
+# Heavy work runs in worker.py, not in a request: POST returns 202 with the job id at once,
+# GET polls it, /events streams it as NDJSON until it is over. Reads stay on the primary (get_db),
+# the status of a running job changes every second.
+JOB_EVENTS_INTERVAL = 1.0
+
+
+def get_job_row(db: Session, job_id: int):
+    job = db.execute(select(*job_columns()).where(Job.id == job_id)).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return job
+
+
+@app.post("/api/jobs", response_model=JobResponse, status_code=202)
+def create_job(job: JobCreate, response: Response, db: Session = Depends(get_db)):
+    kind = JOB_KINDS.get(job.kind)
+    if kind is None:
+        raise HTTPException(status_code=400, detail=f'Invalid kind. Use one of {", ".join(JOB_KINDS)}.')
+    try:
+        params = kind.params.model_validate(job.params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    job_id = enqueue(db, job.kind, params.model_dump(mode="json"), job.max_attempts)
+    db.commit()
+    response.headers["Location"] = f"/api/jobs/{job_id}"
+    return get_job_row(db, job_id)
+
+
+@app.get("/api/jobs", response_model=List[JobResponse])
+def get_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = Query(50, ge=1, le=1000),
+             db: Session = Depends(get_db)):
+    # newest first
+    where = [column == value for column, value in ((Job.status, status), (Job.kind, kind)) if value is not None]
+    return db.execute(select(*job_columns()).where(*where).order_by(Job.id.desc()).limit(limit)).all()
+
 
-    sort_column = getattr(Patient, sort_by, None)
-    if sort_column is None:
-        raise HTTPException(status_code=400, detail='Invalid sort_by parameter.')
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    return get_job_row(db, job_id)
 
-    patients_ = db.query(Patient).order_by(asc(sort_column) if order.lower() == 'asc' else desc(sort_column)).all()
-    return patients_
 
-# ORM
+def read_job(job_id: int) -> Optional[dict]:
+    with SessionLocal() as db:
+        job = db.execute(select(*job_columns()).where(Job.id == job_id)).first()
+    return None if job is None else JobResponse.model_validate(job, from_attributes=True).model_dump(mode="json")
+
+
+async def job_events(job_id: int, first: dict):
+    # one line per change, the last one has a final status; asyncio.sleep holds no thread between reads
+    job, last = first, None
+    while job is not None:
+        if job != last:
+            yield dumps(job) + b"\n"
+            last = job
+        if job["status"] in TERMINAL:
+            return
+        await asyncio.sleep(JOB_EVENTS_INTERVAL)
+        job = await run_in_threadpool(read_job, job_id)
+
+
+@app.get("/api/jobs/{job_id}/events", response_model=JobResponse)
+def get_job_events(job_id: int):
+    job = read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return StreamingResponse(job_events(job_id, job), media_type=NDJSON)
+
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: int, db: Session = Depends(get_db)):
+    # the file of an export job
+    job = get_job_row(db, job_id)
+    if job.status != 'succeeded':
+        raise HTTPException(status_code=409, detail=f'Job is {job.status}')
+    if not (job.result or {}).get('file') or not os.path.exists(export_path(job_id)):
+        raise HTTPException(status_code=404, detail='Job has no result file')
+    return FileResponse(export_path(job_id), media_type=NDJSON, filename=job.result['file'])
+
+
+@app.delete("/api/jobs/{job_id}", response_model=JobResponse)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    job = cancel(db, job_id)
+    db.commit()
+    if job is None:
+        job = get_job_row(db, job_id)
+        raise HTTPException(status_code=409, detail=f'Job is already {job.status}')
+    return job
+
+# METRICS
 
-# CREATE
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return render_metrics()
 
-new_patient = Patient(full_name='John Doe', date_of_birth='1990-01-01', policy_number=123456, social_status='Active')
-session.add(new_patient)
-session.commit()
+# ASYNC
+# With DB_ASYNC the async handlers replace the sync routes with the same path and method
 
-# READ
-patients = session.query(Patient).all()
-for patient in patients:
-    print(patient.full_name, patient.date_of_birth)
 
-# UPD
-patient_to_update = session.query(Patient).filter_by(full_name='John Doe').first()
-patient_to_update.social_status = 'Inactive'
-session.commit()
+if ASYNC_DB:
+    from async_api import router as async_router
 
-# DELETE
-patient_to_delete = session.query(Patient).filter_by(full_name='John Doe').first()
-session.delete(patient_to_delete)
-session.commit()
+    async_routes = {(route.path, method) for route in async_router.routes for method in route.methods}
+    app.router.routes[:] = [route for route in app.router.routes
+                            if not (isinstance(route, APIRoute)
+                                    and any((route.path, method) in async_routes for method in route.methods))]
+    app.include_router(async_router)
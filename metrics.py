@@ -0,0 +1,100 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+# Minimal Prometheus-style registry, rendered in the text exposition format by GET /metrics.
+# Metrics are kept per process; with several workers each one reports its own.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: List['Metric'] = []
+
+
+def label_text(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self.values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name}{label_text(self.labels, key)} {value}'
+                                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    # value is read from a callback at scrape time, e.g. the pool's current checkout count
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.callbacks: Dict[tuple, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *label_values):
+        self.callbacks[label_values] = function
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name}{label_text(self.labels, key)} {function()}'
+                                for key, function in sorted(self.callbacks.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., +Inf count, sum]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{label_text(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{label_text(self.labels, key)} {series[-1]}')
+            lines.append(f'{self.name}_count{label_text(self.labels, key)} {cumulative}')
+        return lines
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
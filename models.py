@@ -1,17 +1,38 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Index
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (Column, Integer, BigInteger, String, Text, Boolean, Date, DateTime, ForeignKey,
+                        ForeignKeyConstraint, CheckConstraint, Index, Computed, func, literal_column, text)
+from sqlalchemy.dialects.postgresql import DATERANGE, JSONB, TSVECTOR
 from sqlalchemy.orm import relationship
-from database import Base, engine
+from database import Base
+
+
+# kept in sync with alembic revision fcee0cfa8a65, which also adds the triggers filling search_data
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(search_data->>'full_name', '')), 'A') || "
+    "setweight(jsonb_to_tsvector('simple', coalesce(search_data->'diagnoses', '[]'::jsonb), '[\"string\"]'), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(search_data->>'social_status', '')), 'C')"
+)
 
 
 class Patient(Base):
     __tablename__ = 'patients'
+    __table_args__ = (
+        Index('ix_patients_search_vector', 'search_vector', postgresql_using='gin'),
+        # (column, id) serves both the filters and the keyset order of /patient/, see index_advisor.py
+        Index('ix_patients_full_name_id', 'full_name', 'id'),
+        Index('ix_patients_date_of_birth_id', 'date_of_birth', 'id'),
+        Index('ix_patients_policy_number_id', 'policy_number', 'id'),
+        Index('ix_patients_social_status_id', 'social_status', 'id'),
+        # also the FK lookup of detach_patients
+        Index('ix_patients_medic_id_id', 'medic_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String(150), nullable=False)
     date_of_birth = Column(Date, nullable=False)
     policy_number = Column(Integer, nullable=False)
     social_status = Column(String(100), nullable=False)
+    # bumped by trigger on every change of the columns above, used for ETags
+    version = Column(Integer, nullable=False, server_default=text('1'))
     # 1 --> N
     treatments = relationship('Treatment', back_populates='patient')
 
@@ -21,31 +42,72 @@ class Patient(Base):
 
     # JSON поле
     search_data = Column(JSONB, nullable=True)
+    search_vector = Column(TSVECTOR, Computed(SEARCH_VECTOR, persisted=True))
 
 
 class Treatment(Base):
     __tablename__ = 'treatments'
-
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        Index('ix_treatments_diagnosis_state_patient', 'diagnosis', 'current_state', 'patient_id'),
+        Index('ix_treatments_diagnosis_id', 'diagnosis', 'id'),
+        Index('ix_treatments_current_state_id', 'current_state', 'id'),
+        Index('ix_treatments_date_start_id', 'date_start', 'id'),
+        Index('ix_treatments_date_end_id', 'date_end', 'id'),
+        # also the FK lookup of the medic delete cascade
+        Index('ix_treatments_medic_id_id', 'medic_id', 'id'),
+        # patient timelines in date order, and the FK lookup of the patient delete cascade
+        Index('ix_treatments_patient_id_date_start_id', 'patient_id', 'date_start', 'id'),
+        # [date_start, date_end] is the daterange of ix_treatments_period, which cannot be built reversed
+        CheckConstraint('date_end >= date_start', name='ck_treatments_period'),
+        # one partition per month, created and archived by partitions.py (alembic revision f3b90d6e2a58)
+        {'postgresql_partition_by': 'RANGE (date_start)'},
+    )
+
+    # the primary key of a partitioned table holds the partition key; ids alone are unique by the sequence
+    id = Column(Integer, primary_key=True, autoincrement=True)
     diagnosis = Column(String(150), nullable=False)
     current_state = Column(String(150), nullable=False)
-    date_start = Column(Date, nullable=False)
+    date_start = Column(Date, primary_key=True, nullable=False)
     date_end = Column(Date, nullable=False)
+    version = Column(Integer, nullable=False, server_default=text('1'))
     # N --> 1
     patient_id = Column(Integer, ForeignKey('patients.id', ondelete='CASCADE'), nullable=False)
     patient = relationship('Patient', back_populates='treatments')
-    # N --> 1
+    # N --> 1, the attending medic
     medic_id = Column(Integer, ForeignKey('medics.id', ondelete='CASCADE'), nullable=False)
+    medic = relationship('Medic')
+    # N --> N, everyone else involved
     medics = relationship('Medic', secondary='treatment_medic', back_populates='treatments')
 
 
+def treatment_period(treatment=Treatment):
+    # [date_start, date_end] as a daterange, the expression of ix_treatments_period; the bounds are inlined
+    # so the planner matches it against the index
+    return func.daterange(treatment.date_start, treatment.date_end, literal_column("'[]'"), type_=DATERANGE)
+
+
+# GiST: "period @> day" (active on a day) and "period && window" (overlapping it), see analytics.py
+Index('ix_treatments_period', treatment_period(), postgresql_using='gist')
+
+
+def has_treatment(diagnosis: str, current_state: str):
+    # EXISTS on treatments by patient_id, an index-only probe of ix_treatments_diagnosis_state_patient
+    return Patient.treatments.any((Treatment.diagnosis == diagnosis) & (Treatment.current_state == current_state))
+
+
 class Medic(Base):
     __tablename__ = 'medics'
+    __table_args__ = (
+        Index('ix_medics_full_name_id', 'full_name', 'id'),
+        Index('ix_medics_speciality_id', 'speciality', 'id'),
+        Index('ix_medics_exp_years_id', 'exp_years', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String(150), nullable=False)
     speciality = Column(String(100), nullable=False)
     exp_years = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, server_default=text('1'))
 
     # 1 --> N
     treatments = relationship('Treatment', secondary='treatment_medic', back_populates='medics')
@@ -56,12 +118,59 @@ class Medic(Base):
 
 class TreatmentMedic(Base):
     __tablename__ = 'treatment_medic'
-
-    treatment_id = Column(Integer, ForeignKey('treatments.id', ondelete='CASCADE'), primary_key=True)
+    __table_args__ = (
+        # the primary key of treatments; date_start follows the treatment to another partition
+        ForeignKeyConstraint(['treatment_id', 'treatment_date_start'], ['treatments.id', 'treatments.date_start'],
+                             ondelete='CASCADE', onupdate='CASCADE'),
+        # the rows going with an archived partition
+        Index('ix_treatment_medic_treatment_date_start', 'treatment_date_start'),
+    )
+
+    treatment_id = Column(Integer, primary_key=True)
+    treatment_date_start = Column(Date, nullable=False)
     medic_id = Column(Integer, ForeignKey('medics.id', ondelete='CASCADE'), primary_key=True)
 
 
-Index('ix_treatments_id', Treatment.id, unique=False,
-      postgresql_using='gin').create(bind=engine, checkfirst=True)
-
-Base.metadata.create_all(bind=engine)
+class TreatmentStat(Base):
+    # counters behind /api/treatments/stats, maintained by triggers on treatments and medics
+    __tablename__ = 'treatment_stats'
+
+    dimension = Column(String(20), primary_key=True)
+    key = Column(String(150), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    # sum of date_end - date_start, for average durations
+    total_days = Column(BigInteger, nullable=False, default=0, server_default=text('0'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=text('now()'))
+
+
+class Job(Base):
+    # background jobs, a queue taken from with FOR UPDATE SKIP LOCKED by worker.py (see jobs.py)
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # what is ready to run, in order
+        Index('ix_jobs_queued', 'run_at', 'id', postgresql_where=text("status = 'queued'")),
+        # leases of lost workers
+        Index('ix_jobs_running', 'locked_until', postgresql_where=text("status = 'running'")),
+        Index('ix_jobs_finished_at', 'finished_at', postgresql_where=text('finished_at IS NOT NULL')),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    params = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    # queued -> running -> succeeded | failed | cancelled, back to queued for a retry
+    status = Column(String(20), nullable=False, server_default=text("'queued'"))
+    attempts = Column(Integer, nullable=False, server_default=text('0'))
+    max_attempts = Column(Integer, nullable=False, server_default=text('3'))
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=text('now()'))
+    # the worker running it, until locked_until; it extends the lease as it reports progress
+    locked_by = Column(String(100))
+    locked_until = Column(DateTime(timezone=True))
+    cancel_requested = Column(Boolean, nullable=False, server_default=text('false'))
+    progress_done = Column(BigInteger, nullable=False, server_default=text('0'))
+    progress_total = Column(BigInteger)
+    result = Column(JSONB)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=text('now()'))
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=text('now()'))
@@ -0,0 +1,113 @@
+import base64
+import json
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, asc, desc, or_, tuple_, Date
+
+
+# Keyset pagination: the cursor is an opaque token holding the sort column, the order
+# and the (sort key, id) of the last row sent, so the next page is an index range scan
+# instead of an OFFSET over every previous row.
+
+PER_PAGE_MAX = 1000
+
+
+def sortable_columns(model):
+    return [column.key for column in model.__table__.columns
+            if column.key not in ('search_data', 'search_vector', 'version')]
+
+
+def sort_column(model, sort_by: str):
+    if sort_by not in sortable_columns(model):
+        raise HTTPException(status_code=400, detail='Invalid sort_by parameter.')
+    return getattr(model, sort_by)
+
+
+def check_order(order: str) -> str:
+    if order.lower() not in ['asc', 'desc']:
+        raise HTTPException(status_code=400, detail='Invalid order parameter. Use "asc" or "desc".')
+    return order.lower()
+
+
+def encode_cursor(sort_by: str, order: str, row) -> str:
+    value = getattr(row, sort_by)
+    if isinstance(value, date):
+        value = value.isoformat()
+    payload = json.dumps([sort_by, order, value, row.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, model, sort_by: str, order: str):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort_by, cursor_order, value, last_id = json.loads(payload)
+        if value is not None and isinstance(getattr(model, sort_by).type, Date):
+            value = date.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor.')
+    if (cursor_sort_by, cursor_order) != (sort_by, order):
+        raise HTTPException(status_code=400, detail='Cursor does not match sort_by/order.')
+    return value, last_id
+
+
+def keyset_query(query, model, sort_by: str, order: str, per_page: int, cursor: Optional[str] = None,
+                 offset: int = 0):
+    # works on both a Query and a select(); fetches one extra row to know if there is a next page.
+    # offset is only honoured for the first page, for clients still sending page=
+    column = sort_column(model, sort_by)
+    order = check_order(order)
+    by_id = sort_by == 'id'
+    nullable = column.nullable
+
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor, model, sort_by, order)
+        if nullable:
+            query = query.where(after_nullable(column, model.id, order, value, last_id))
+        else:
+            key, last = (model.id, last_id) if by_id else (tuple_(column, model.id), tuple_(value, last_id))
+            query = query.where(key > last if order == 'asc' else key < last)
+        if not by_id and not nullable:
+            # implied by the row comparison, but only a plain bound prunes partitions (treatments.date_start)
+            query = query.where(column >= value if order == 'asc' else column <= value)
+        offset = 0
+    return query.order_by(*sort_order(model, sort_by, order)).offset(offset).limit(per_page + 1)
+
+
+def sort_order(model, sort_by: str, order: str) -> list:
+    # the ORDER BY of keyset_query, also for the unpaged lists so both return rows in the same order
+    column = sort_column(model, sort_by)
+    direction = asc if check_order(order) == 'asc' else desc
+    if sort_by == 'id':
+        return [direction(model.id)]
+    if column.nullable:
+        # NULL sorts as the largest key, PostgreSQL's default, so an index on the column serves both orders
+        return [asc(column).nulls_last() if direction is asc else desc(column).nulls_first(), direction(model.id)]
+    return [direction(column), direction(model.id)]
+
+
+def after_nullable(column, id_column, order: str, value, last_id: int):
+    # rows after (value, last_id) when NULL sorts last in asc and first in desc;
+    # a row comparison is never true with a NULL in it
+    if order == 'asc':
+        if value is None:
+            return and_(column.is_(None), id_column > last_id)
+        return or_(column > value, column.is_(None), and_(column == value, id_column > last_id))
+    if value is None:
+        return or_(column.is_not(None), id_column < last_id)
+    return or_(column < value, and_(column == value, id_column < last_id))
+
+
+def page_rows(rows, sort_by: str, order: str, per_page: int):
+    # returns (rows, next_cursor); next_cursor is None on the last page
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, encode_cursor(sort_by, order.lower(), rows[-1])
+
+
+def keyset_page(query, model, sort_by: str, order: str, per_page: int, cursor: Optional[str] = None,
+                offset: int = 0):
+    rows = keyset_query(query, model, sort_by, order, per_page, cursor, offset).all()
+    return page_rows(rows, sort_by, order, per_page)
@@ -0,0 +1,195 @@
+import argparse
+import logging
+import os
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import func, select, text
+
+from database import init_engines
+from models import Treatment
+from stats import subtract_treatment_stats
+
+# treatments is partitioned by RANGE (date_start), one partition per month (alembic revision f3b90d6e2a58,
+# PostgreSQL 15 or later):
+#   treatments_y2026m10  FOR VALUES FROM ('2026-10-01') TO ('2026-11-01')
+#   treatments_default   rows of the months without a partition
+# A query bounded on date_start only reads the partitions of its months: the date_start filters and keyset
+# pages of /treatment/, /api/treatments/stats?date_from=&date_to=. Autovacuum works per partition, so only the
+# months still written to get vacuumed; --freeze-before freezes the closed ones once, after which even the
+# anti-wraparound vacuums skip their pages.
+#
+# ensure_partitions keeps PARTITIONS_AHEAD months ready past the current one. init_db.py runs it, and so do
+# the job workers (worker.py) every PARTITION_CHECK_INTERVAL, one at a time under an advisory lock; the API
+# never runs DDL. --archive-before takes old months out of treatments without a DELETE: the partition is
+# detached and moved to ARCHIVE_SCHEMA with its treatment_medic rows (--drop drops both), its counts are taken
+# off treatment_stats and its patients' search_data is refreshed. The current and the previous month are
+# never archived, nor more than ARCHIVE_KEEP_MONTHS by an archive job.
+# Cached by-id reads of archived treatments expire with CACHE_TTL.
+#
+#   python partitions.py --ahead 6
+#   python partitions.py --archive-before 2024-01 [--drop]
+#   python partitions.py --freeze-before 2026-09
+
+PARTITIONS_AHEAD = int(os.getenv("TREATMENT_PARTITIONS_AHEAD", "3"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("TREATMENT_PARTITION_CHECK_INTERVAL", "3600"))
+ARCHIVE_SCHEMA = os.getenv("TREATMENT_ARCHIVE_SCHEMA", "archive")
+# DDL gives up instead of queueing every query on treatments behind it; the next run tries again
+LOCK_TIMEOUT_MS = int(os.getenv("TREATMENT_PARTITION_LOCK_TIMEOUT_MS", "5000"))
+DEFAULT_PARTITION = "treatments_default"
+PARTITION_NAME = re.compile(r"^treatments_y(\d{4})m(\d{2})$")
+# the months before the current one that --archive-before keeps in treatments; archive jobs of the API keep
+# ARCHIVE_KEEP_MONTHS and can only move partitions to ARCHIVE_SCHEMA, dropping them is left to this script
+ARCHIVE_KEEP_MONTHS_CLI = 1
+ARCHIVE_KEEP_MONTHS = int(os.getenv("TREATMENT_ARCHIVE_KEEP_MONTHS", "12"))
+# pg_try_advisory_xact_lock key of ensure_partitions
+ADVISORY_LOCK = 0x7472_7061
+
+partition_log = logging.getLogger("partitions")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"treatments_y{month:%Y}m{month:%m}"
+
+
+def started_between(date_from: Optional[date], date_to: Optional[date]) -> list:
+    # treatments started in [date_from, date_to], plain date_start bounds the planner prunes partitions with
+    conditions = []
+    if date_from is not None:
+        conditions.append(Treatment.date_start >= date_from)
+    if date_to is not None:
+        conditions.append(Treatment.date_start <= date_to)
+    return conditions
+
+
+def partitioned(connection) -> bool:
+    # False before the migration
+    return bool(connection.scalar(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('treatments')")))
+
+
+def monthly_partitions(connection) -> List[date]:
+    names = connection.scalars(text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                    "WHERE inhparent = 'treatments'::regclass"))
+    return sorted(date(int(match[1]), int(match[2]), 1) for match in map(PARTITION_NAME.match, names) if match)
+
+
+def set_lock_timeout(connection):
+    connection.execute(select(func.set_config("lock_timeout", str(LOCK_TIMEOUT_MS), True)))
+
+
+def create_partition(connection, month: date) -> bool:
+    name, bounds = partition_name(month), {"date_from": month, "date_to": add_months(month, 1)}
+    # attaching scans the default partition for rows of the month and fails if there are any; they stay there
+    if connection.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+                              "WHERE date_start >= :date_from AND date_start < :date_to)"), bounds):
+        partition_log.warning("%s not created, %s has rows of that month", name, DEFAULT_PARTITION)
+        return False
+    # CREATE TABLE ... PARTITION OF locks out every query on treatments, ATTACH PARTITION only other DDL;
+    # the indexes, foreign keys and row triggers of treatments are added to the new partition; its CHECK
+    # constraints have to be there before
+    connection.execute(text(f"CREATE TABLE {name} (LIKE treatments INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"ALTER TABLE treatments ATTACH PARTITION {name} "
+                            f"FOR VALUES FROM ('{bounds['date_from']}') TO ('{bounds['date_to']}')"))
+    partition_log.info("created %s", name)
+    return True
+
+
+def ensure_partitions(today: Optional[date] = None, ahead: int = PARTITIONS_AHEAD) -> List[str]:
+    current = (today or date.today()).replace(day=1)
+    created = []
+    with init_engines().begin() as connection:
+        if not partitioned(connection) or not connection.scalar(select(func.pg_try_advisory_xact_lock(ADVISORY_LOCK))):
+            return created
+        set_lock_timeout(connection)
+        existing = set(monthly_partitions(connection))
+        for month in (add_months(current, n) for n in range(ahead + 1)):
+            if month not in existing and create_partition(connection, month):
+                created.append(partition_name(month))
+    return created
+
+
+def check_archive_before(before: date, keep: int = ARCHIVE_KEEP_MONTHS_CLI) -> date:
+    # the current month and the `keep` before it stay: once detached, ensure_partitions would not recreate
+    # a month whose new rows went to the default partition
+    latest = add_months(date.today().replace(day=1), -keep)
+    if before > latest:
+        raise ValueError(f'before can be {latest:%Y-%m} at the latest, got {before:%Y-%m}')
+    return before
+
+
+def archive_partition(connection, month: date, schema: str = ARCHIVE_SCHEMA, drop: bool = False):
+    name, bounds = partition_name(month), {"date_from": month, "date_to": add_months(month, 1)}
+    links = "treatment_medic WHERE treatment_date_start >= :date_from AND treatment_date_start < :date_to"
+    set_lock_timeout(connection)
+    # writes to the month wait, so the counts taken off are those of the rows detached
+    connection.execute(text(f"LOCK TABLE {name} IN EXCLUSIVE MODE"))
+    connection.execute(subtract_treatment_stats(Treatment.date_start >= bounds["date_from"],
+                                                Treatment.date_start < bounds["date_to"]))
+    # a partition still referenced cannot be detached
+    if not drop:
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        connection.execute(text(f"CREATE TABLE {schema}.treatment_medic_y{month:%Y}m{month:%m} AS "
+                                f"SELECT * FROM {links}"), bounds)
+    connection.execute(text(f"DELETE FROM {links}"), bounds)
+    connection.execute(text(f"ALTER TABLE treatments DETACH PARTITION {name}"))
+    # search_data lists the diagnoses of the treatments left
+    connection.execute(text(f"UPDATE patients SET search_data = NULL WHERE id IN (SELECT patient_id FROM {name})"))
+    connection.execute(text(f"DROP TABLE {name}" if drop else f"ALTER TABLE {name} SET SCHEMA {schema}"))
+
+
+def archive_partitions(before: date, schema: str = ARCHIVE_SCHEMA, drop: bool = False) -> List[str]:
+    # one transaction per month, the months before `before`
+    check_archive_before(before)
+    engine = init_engines()
+    with engine.connect() as connection:
+        months = [month for month in monthly_partitions(connection) if month < before]
+    for month in months:
+        with engine.begin() as connection:
+            archive_partition(connection, month, schema, drop)
+        partition_log.warning("%s %s", partition_name(month), "dropped" if drop else f"moved to {schema}")
+    return [partition_name(month) for month in months]
+
+
+def freeze_partitions(before: date) -> List[str]:
+    # VACUUM cannot run in a transaction
+    with init_engines().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        names = [partition_name(month) for month in monthly_partitions(connection) if month < before]
+        for name in names:
+            connection.execute(text(f"VACUUM (FREEZE, ANALYZE) {name}"))
+    return names
+
+
+def parse_month(value: str) -> date:
+    # ValueError for anything but YYYY-MM, argparse and pydantic report it as such
+    if not re.fullmatch(r"\d{4}-\d{2}", value):
+        raise ValueError(f"{value!r} is not a YYYY-MM month")
+    return date.fromisoformat(f"{value}-01")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create, archive and freeze the monthly partitions of treatments')
+    parser.add_argument('--ahead', type=int, default=PARTITIONS_AHEAD, help='months to create past the current one')
+    parser.add_argument('--archive-before', type=parse_month, default=None, metavar='YYYY-MM',
+                        help='detach the partitions of the months before this one')
+    parser.add_argument('--schema', default=ARCHIVE_SCHEMA, help='where archived partitions go')
+    parser.add_argument('--drop', action='store_true', help='drop the archived partitions instead')
+    parser.add_argument('--freeze-before', type=parse_month, default=None, metavar='YYYY-MM',
+                        help='VACUUM (FREEZE) the partitions of the months before this one')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print('created:', ', '.join(ensure_partitions(ahead=args.ahead)) or 'none')
+    if args.archive_before is not None:
+        try:
+            check_archive_before(args.archive_before)
+        except ValueError as e:
+            parser.error(str(e))
+        archive_partitions(args.archive_before, args.schema, args.drop)
+    if args.freeze_before is not None:
+        print('frozen:', ', '.join(freeze_partitions(args.freeze_before)) or 'none')
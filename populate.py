@@ -1,14 +1,16 @@
+import argparse
+import io
+import math
 import requests
 import random
+from datetime import date
 from faker import Faker
-from database import Base, engine, SessionLocal
-from sqlalchemy.orm import sessionmaker
-from models import Patient
+from database import SessionLocal, init_engines
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from models import Patient, Treatment, Medic
 
 BASE_URL = 'http://localhost:8000/'
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session()
 fake = Faker()
 
 
@@ -19,19 +21,48 @@ dr_spec = ['Cardiologist', 'Neurologist', 'Orthopedic Surgeon', 'Pediatrician',
            'Pulmonologist', 'Rheumatologist', 'Neurologist', 'Hematologist', 'Infectious Disease Specialist']
 
 
-def generate_policy_number(db: Session) -> str:
-    while True:
-        policy_number = fake.random_int(min=100000, max=999999)
-        existing_patient = db.query(Patient).filter(Patient.policy_number == policy_number).first()
-        if not existing_patient:
-            return policy_number
+class PolicyNumbers:
+    # Unique policy numbers without a SELECT per candidate: existing numbers are
+    # loaded once, new ones walk a seeded permutation of the number space.
+    MIN = 100000
 
+    def __init__(self, db, needed, rng=random):
+        self.taken = set(db.scalars(select(Patient.policy_number)))
+        self.span = 900000 if needed + len(self.taken) <= 900000 else 900000000
+        self.step = rng.randrange(1, self.span)
+        while math.gcd(self.step, self.span) != 1:
+            self.step += 1
+        self.current = rng.randrange(self.span)
+        self.left = self.span
 
-def create_patient():
+    def __next__(self):
+        while self.left:
+            self.left -= 1
+            self.current = (self.current + self.step) % self.span
+            policy_number = self.MIN + self.current
+            if policy_number not in self.taken:
+                return policy_number
+        raise RuntimeError('Policy number space exhausted')
+
+    def __iter__(self):
+        return self
+
+
+policy_numbers = None
+
+
+def generate_policy_number(db: Session) -> int:
+    global policy_numbers
+    if policy_numbers is None:
+        policy_numbers = PolicyNumbers(db, needed=0)
+    return next(policy_numbers)
+
+
+def create_patient(db: Session):
     return {
         "full_name": fake.name(),
         "date_of_birth": fake.date_of_birth().strftime('%Y-%m-%d'),
-        "policy_number": generate_policy_number(SessionLocal()),
+        "policy_number": generate_policy_number(db),
         "social_status": random.choice(soc_stat)
     }
 
@@ -55,21 +86,148 @@ def create_medic():
     }
 
 
-def populate_database(num_patients):
-    for _ in range(num_patients):
-        patient_data = create_patient()
-        response = requests.post(BASE_URL + "patient/", json=patient_data)
-        patient_id = response.json().get("id")
+BATCH_SIZE = 1000
+
 
-        treatment_data = create_treatment(patient_id)
-        requests.post(BASE_URL + "treatment/", json=treatment_data)
+def populate_database(num_patients, batch_size=BATCH_SIZE):
+    # the session only reads the existing policy numbers, rows go through the API
+    db = SessionLocal()
+    try:
+        for start in range(0, num_patients, batch_size):
+            patients_data = [create_patient(db) for _ in range(min(batch_size, num_patients - start))]
+            response = requests.post(BASE_URL + "patient/bulk", json=patients_data)
+            patient_ids = [patient_id for patient_id in response.json().get("ids") if patient_id is not None]
+
+            treatments_data = [create_treatment(patient_id) for patient_id in patient_ids]
+            requests.post(BASE_URL + "treatment/bulk", json=treatments_data)
+    finally:
+        db.close()
+
+
+# COPY loader: streams generated rows straight into PostgreSQL, bypassing the API.
+# Ids are assigned here and the sequences are moved past them at the end,
+# so it expects to be the only writer while it runs.
+
+CHUNK_SIZE = 50000
+NAME_POOL_SIZE = 10000
+PATIENT_COLUMNS = ('id', 'full_name', 'date_of_birth', 'policy_number', 'social_status', 'medic_id')
+TREATMENT_COLUMNS = ('id', 'diagnosis', 'current_state', 'date_start', 'date_end', 'patient_id', 'medic_id')
+MEDIC_COLUMNS = ('id', 'full_name', 'speciality', 'exp_years')
+
+
+def next_id(db, model):
+    return db.scalar(select(func.coalesce(func.max(model.id), 0))) + 1
+
+
+def generate_medics(rng, names, first_id, count):
+    for medic_id in range(first_id, first_id + count):
+        yield medic_id, rng.choice(names), rng.choice(dr_spec), rng.randint(1, 20)
+
+
+def generate_patients(rng, names, words, policy_numbers_, medic_ids, first_patient_id, first_treatment_id,
+                      count, treatments_per_patient):
+    # yields (patient_row, [treatment_rows]); the patient's medic is the one of its last treatment,
+    # as create_treatment would leave it
+    today = date.today().toordinal()
+    dob_low, dob_high = today - 90 * 365, today - 365
+    treatment_id = first_treatment_id
+    for patient_id in range(first_patient_id, first_patient_id + count):
+        treatments = []
+        medic_id = None
+        for _ in range(treatments_per_patient):
+            medic_id = rng.choice(medic_ids)
+            treatments.append((treatment_id, rng.choice(words), rng.choice(current_stat),
+                               date.fromordinal(today - rng.randint(0, 30)),
+                               date.fromordinal(today + rng.randint(0, 30)), patient_id, medic_id))
+            treatment_id += 1
+        patient = (patient_id, rng.choice(names), date.fromordinal(rng.randint(dob_low, dob_high)),
+                   next(policy_numbers_), rng.choice(soc_stat), medic_id)
+        yield patient, treatments
+
+
+# COPY text format: backslash, tab, newline and carriage return inside a value are escaped, NULL is \N
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value) -> str:
+    return '\\N' if value is None else str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def reset_sequence(cursor, table):
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                   f"(SELECT COALESCE(MAX(id), 1) FROM {table}))")
+
+
+def copy_load(scale, seed=None, chunk_size=CHUNK_SIZE, num_medics=None, treatments_per_patient=1):
+    rng = random.Random(seed)
+    Faker.seed(seed)
+    names = [fake.name() for _ in range(NAME_POOL_SIZE)]
+    words = [fake.word() for _ in range(NAME_POOL_SIZE // 10)]
+    num_medics = num_medics or max(100, scale // 100)
+
+    engine = init_engines()
+    db = SessionLocal()
+    try:
+        first_medic_id = next_id(db, Medic)
+        first_patient_id = next_id(db, Patient)
+        first_treatment_id = next_id(db, Treatment)
+        policy_numbers_ = PolicyNumbers(db, scale, rng)
+    finally:
+        db.close()
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        copy_rows(cursor, 'medics', MEDIC_COLUMNS, generate_medics(rng, names, first_medic_id, num_medics))
+        connection.commit()
+        medic_ids = range(first_medic_id, first_medic_id + num_medics)
+
+        patients = generate_patients(rng, names, words, policy_numbers_, medic_ids, first_patient_id,
+                                     first_treatment_id, scale, treatments_per_patient)
+        loaded = 0
+        while loaded < scale:
+            chunk = [next(patients) for _ in range(min(chunk_size, scale - loaded))]
+            copy_rows(cursor, 'patients', PATIENT_COLUMNS, (patient for patient, _ in chunk))
+            copy_rows(cursor, 'treatments', TREATMENT_COLUMNS,
+                      (treatment for _, treatments in chunk for treatment in treatments))
+            connection.commit()
+            loaded += len(chunk)
+            print(f'{loaded}/{scale} patients loaded')
+
+        for table in ('medics', 'patients', 'treatments'):
+            reset_sequence(cursor, table)
+        cursor.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
 
 
 if __name__ == "__main__":
-    num_medics_to_create = 100
-    for i in range(num_medics_to_create):
-        medic_data = create_medic()
-        requests.post(BASE_URL + "medic/", json=medic_data)
-    num_patients_to_create = 1000
-    populate_database(num_patients_to_create)
+    parser = argparse.ArgumentParser(description='Populate the hospital database')
+    parser.add_argument('--copy', action='store_true', help='load with COPY FROM STDIN instead of the HTTP API')
+    parser.add_argument('--scale', type=int, default=1000, help='number of patients')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='patients per COPY transaction')
+    parser.add_argument('--medics', type=int, default=None, help='number of medics (COPY mode)')
+    parser.add_argument('--treatments-per-patient', type=int, default=1)
+    args = parser.parse_args()
+
+    init_engines()
+    if args.copy:
+        copy_load(args.scale, args.seed, args.chunk_size, args.medics, args.treatments_per_patient)
+    else:
+        num_medics_to_create = 100
+        medics_data = [create_medic() for _ in range(num_medics_to_create)]
+        requests.post(BASE_URL + "medic/bulk", json=medics_data)
+        num_patients_to_create = args.scale
+        populate_database(num_patients_to_create)
     print('/Population completed/')
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, exc, text
+from starlette.concurrency import run_in_threadpool
+
+from database import (SessionLocal, AsyncSessionLocal, ASYNC_DB, TimedQueuePool, TimedAsyncQueuePool,
+                      engine_settings, env_bool, instrument_pool)
+from metrics import Counter, Gauge
+
+# Read replicas for the read-only endpoints. DB_REPLICA_URLS is a comma-separated list of
+# SQLAlchemy URLs; without it every request goes to the primary as before.
+#
+# Handlers that only read take Depends(get_read_db) (or get_async_read_db) instead of get_db and get
+# a session on a random healthy replica. The primary serves them instead when
+#   - the client wrote within DB_REPLICA_STICKY_SECONDS: every successful non-GET response sets the
+#     db_primary_until cookie, so a client reads its own writes (read_your_writes below);
+#   - no replica is healthy: a replica is down after a failed check or a lost connection, and lagging
+#     when its replay is more than DB_REPLICA_MAX_LAG seconds behind. monitor_replicas checks them
+#     every DB_REPLICA_CHECK_INTERVAL seconds; a request already on a replica that goes away fails.
+# Each replica is its own server, its pools get the same per-worker share of the connection
+# budget as the primary (see pool_settings in database.py).
+
+REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+# a healthy replica is at most MAX_LAG behind at its last check, and CHECK_INTERVAL more since
+STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", str(MAX_LAG + CHECK_INTERVAL)))
+STICKY_COOKIE = "db_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# DB_REPLICA_LOG_CHECKS=1 logs every check, not only the changes
+LOG_CHECKS = env_bool("DB_REPLICA_LOG_CHECKS", "0")
+
+# 0 on a primary (a plain second instance serves as a replica in tests) and when everything received is
+# replayed: on an idle primary the last replayed transaction gets old without the replica falling behind.
+# After a restart the receive position starts at the segment boundary, behind the replay position.
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+DB_READS = Counter("db_reads_total", "Read-only requests by the database that served them", ("target",))
+REPLICA_HEALTHY = Gauge("db_replica_healthy", "1 if the replica takes reads", ("replica",))
+REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replay lag at the last check", ("replica",))
+
+replica_log = logging.getLogger("replicas")
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.engine = None
+        self.async_engine = None
+        self.up = False
+        self.lag = 0.0
+        REPLICA_HEALTHY.set_function(lambda: int(self.healthy), name)
+        REPLICA_LAG.set_function(lambda: self.lag, name)
+
+    @property
+    def healthy(self) -> bool:
+        return self.up and self.lag <= MAX_LAG
+
+    def set_state(self, up: bool, lag: float, reason: str = ""):
+        was_healthy = self.healthy
+        self.up = up
+        self.lag = lag
+        if self.healthy != was_healthy or LOG_CHECKS:
+            replica_log.warning("%s is %s (lag %.1fs)%s", self.name, "healthy" if self.healthy else "out of rotation",
+                                lag, f": {reason}" if reason else "")
+
+    def connect(self):
+        settings = engine_settings()
+        self.engine = create_engine(self.url, poolclass=TimedQueuePool, connect_args={
+            "connect_timeout": CONNECT_TIMEOUT}, **settings)
+        instrument_pool(self.engine, self.name)
+        watch_errors(self.engine, self)
+        if ASYNC_DB:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            self.async_engine = create_async_engine(self.url.replace("+psycopg2", "+asyncpg"),
+                                                    poolclass=TimedAsyncQueuePool,
+                                                    connect_args={"timeout": CONNECT_TIMEOUT}, **settings)
+            instrument_pool(self.async_engine.sync_engine, self.name + "_async")
+            watch_errors(self.async_engine.sync_engine, self)
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                lag = float(connection.execute(LAG_QUERY).scalar())
+        except exc.DBAPIError as e:
+            self.set_state(False, self.lag, str(e.orig).strip())
+        else:
+            self.set_state(True, lag)
+
+
+def watch_errors(engine_, replica: Replica):
+    # out of rotation at once, the next check brings it back
+    @event.listens_for(engine_, "handle_error")
+    def on_error(exception_context):
+        if exception_context.is_disconnect or exception_context.connection is None:
+            replica.set_state(False, replica.lag, str(exception_context.original_exception).strip())
+
+
+REPLICAS: List[Replica] = [Replica(f"replica{index}", url) for index, url in enumerate(REPLICA_URLS)]
+
+
+def init_replicas():
+    # after init_engines, in every worker; the first check runs before the first request
+    for replica in REPLICAS:
+        if replica.engine is None:
+            replica.connect()
+            replica.check()
+
+
+def check_replicas():
+    for replica in REPLICAS:
+        replica.check()
+
+
+async def monitor_replicas():
+    while True:
+        await asyncio.sleep(CHECK_INTERVAL)
+        try:
+            await run_in_threadpool(check_replicas)
+        except Exception:
+            replica_log.exception("replica check failed")
+
+
+async def dispose_replicas():
+    for replica in REPLICAS:
+        if replica.engine is not None:
+            replica.engine.dispose()
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
+
+
+def drop_inherited_pools():
+    for replica in REPLICAS:
+        if replica.engine is not None:
+            replica.engine.dispose(close=False)
+        if replica.async_engine is not None:
+            replica.async_engine.sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=drop_inherited_pools)
+
+
+def sticky(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_replica(request: Request) -> Optional[Replica]:
+    # None: read from the primary
+    if not REPLICAS or sticky(request):
+        replica = None
+    else:
+        healthy = [replica for replica in REPLICAS if replica.healthy]
+        replica = random.choice(healthy) if healthy else None
+    DB_READS.inc("primary" if replica is None else replica.name)
+    return replica
+
+
+def get_read_db(request: Request):
+    replica = read_replica(request)
+    db = SessionLocal() if replica is None else SessionLocal(bind=replica.engine)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    replica = read_replica(request)
+    async with (AsyncSessionLocal() if replica is None else AsyncSessionLocal(bind=replica.async_engine)) as db:
+        yield db
+
+
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if REPLICAS and STICKY_SECONDS > 0 and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(STICKY_COOKIE, f"{time.time() + STICKY_SECONDS:.3f}", max_age=math.ceil(STICKY_SECONDS),
+                            httponly=True, samesite="lax")
+    return response
@@ -0,0 +1,56 @@
+import time
+
+from fastapi import Request
+
+from database import QueryStats, current_queries, env_bool
+from metrics import Histogram, LATENCY_BUCKETS
+
+# Per-request SQL accounting: statement count, DB time and the slowest statement, aggregated
+# per route on /metrics. With DEBUG=1 they are also sent back as Server-Timing and X-DB-* headers.
+# A streamed body runs after the headers are sent, so for NDJSON only the statements before it count.
+
+DEBUG = env_bool("DEBUG", "0")
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request handling time", ("method", "route"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements per request", ("method", "route"),
+                            buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL statements per request",
+                               ("method", "route"), buckets=LATENCY_BUCKETS)
+REQUEST_SLOWEST_QUERY = Histogram("http_request_slowest_query_seconds", "Slowest SQL statement of a request",
+                                  ("method", "route"), buckets=LATENCY_BUCKETS)
+
+
+def route_template(request: Request) -> str:
+    # the path template, not the path, so /patient/1 and /patient/2 are one series
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def server_timing(stats: QueryStats, seconds: float) -> str:
+    return (f'db;desc="{stats.count} queries";dur={stats.seconds * 1000:.2f}, '
+            f'db-slowest;dur={stats.slowest * 1000:.2f}, app;dur={seconds * 1000:.2f}')
+
+
+async def track_queries(request: Request, call_next):
+    stats = QueryStats()
+    token = current_queries.set(stats)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_queries.reset(token)
+    seconds = time.perf_counter() - start
+
+    labels = (request.method, route_template(request))
+    REQUEST_SECONDS.observe(seconds, *labels)
+    REQUEST_QUERIES.observe(stats.count, *labels)
+    REQUEST_DB_SECONDS.observe(stats.seconds, *labels)
+    REQUEST_SLOWEST_QUERY.observe(stats.slowest, *labels)
+    if DEBUG:
+        response.headers["Server-Timing"] = server_timing(stats, seconds)
+        response.headers["X-DB-Queries"] = str(stats.count)
+        if stats.slowest_statement is not None:
+            response.headers["X-DB-Slowest-Query"] = " ".join(stats.slowest_statement.split())[:200]
+    return response
@@ -0,0 +1,219 @@
+from datetime import date, datetime
+from typing import Any, List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
+
+from partitions import ARCHIVE_KEEP_MONTHS, check_archive_before, parse_month
+
+
+class PatientCreate(BaseModel):
+    full_name: str
+    date_of_birth: date
+    policy_number: int
+    social_status: str
+
+
+class PatientResponse(BaseModel):
+    id: int
+    full_name: str
+    date_of_birth: date
+    policy_number: int
+    social_status: str
+
+
+class PatientDelete(BaseModel):
+    message: str
+
+
+def ends_after_start(value: Optional[date], info: ValidationInfo) -> Optional[date]:
+    # as ck_treatments_period; a reversed period also has no daterange for ix_treatments_period
+    start = info.data.get('date_start')
+    if value is not None and start is not None and value < start:
+        raise ValueError('date_end must not be before date_start')
+    return value
+
+
+# Pydantic model for Result
+class TreatmentCreate(BaseModel):
+    diagnosis: str
+    current_state: str
+    date_start: date
+    date_end: date
+    patient_id: int
+    medic_id: int
+
+    check_period = field_validator('date_end')(ends_after_start)
+
+
+class TreatmentResponse(BaseModel):
+    id: int
+    diagnosis: str
+    current_state: str
+    date_start: date
+    date_end: date
+    patient_id: int
+    medic_id: int
+
+
+class TreatmentDelete(BaseModel):
+    message: str
+
+
+# partial update, only the fields that are sent are written
+class TreatmentPatch(BaseModel):
+    diagnosis: Optional[str] = None
+    current_state: Optional[str] = None
+    date_start: Optional[date] = None
+    date_end: Optional[date] = None
+    patient_id: Optional[int] = None
+    medic_id: Optional[int] = None
+
+    # only when both dates are sent, ck_treatments_period checks the rows against the other one
+    check_period = field_validator('date_end')(ends_after_start)
+
+    @field_validator('*')
+    @classmethod
+    def not_null(cls, value):
+        # runs for the fields that are sent only: every column is NOT NULL, so null cannot be written
+        if value is None:
+            raise ValueError('must not be null, leave the field out to keep it')
+        return value
+
+
+class TreatmentBulkUpdate(BaseModel):
+    matched: int
+    updated: int
+    chunks: int
+
+
+# Pydantic model for Athlete
+class MedicCreate(BaseModel):
+    full_name: str
+    speciality: str
+    exp_years: int
+
+
+class MedicResponse(BaseModel):
+    id: int
+    full_name: str
+    speciality: str
+    exp_years: int
+
+
+class MedicDelete(BaseModel):
+    message: str
+
+
+# Pydantic models for bulk ingestion
+class BulkRowError(BaseModel):
+    index: int
+    errors: List[str]
+
+
+class BulkResponse(BaseModel):
+    # ids are in input order, None for rejected rows
+    ids: List[Optional[int]]
+    errors: List[BulkRowError]
+
+
+class PatientSearchHit(PatientResponse):
+    rank: float
+
+
+class PatientCount(BaseModel):
+    count: int
+
+
+# Analytics
+class MedicCaseload(BaseModel):
+    id: int
+    full_name: str
+    speciality: str
+    active: int
+    rank: int
+    speciality_rank: int
+    # of all active treatments
+    share: float
+
+
+class DurationStat(BaseModel):
+    key: str
+    count: int
+    average_days: float
+
+
+class MedicOverlap(BaseModel):
+    id: int
+    full_name: str
+    speciality: str
+    # treatments overlapping the window
+    treatments: int
+    # most of them running on one day, and the first day it happened
+    peak: int
+    peak_day: date
+
+
+# Patient timeline
+class TimelineTreatment(TreatmentResponse):
+    medic: MedicResponse
+    medics: List[MedicResponse]
+
+
+class PatientTimeline(PatientResponse):
+    treatments: List[TimelineTreatment]
+    # treatments beyond per_page / per_patient
+    has_more: bool
+
+
+# Background jobs, params of each kind (see jobs.JOB_KINDS)
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = {}
+    max_attempts: int = Field(3, ge=1, le=10)
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    params: dict
+    status: str
+    attempts: int
+    max_attempts: int
+    run_at: datetime
+    cancel_requested: bool
+    progress_done: int
+    progress_total: Optional[int]
+    result: Optional[Any]
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+
+class RebuildStatsParams(BaseModel):
+    pass
+
+
+class ImportParams(BaseModel):
+    entity: Literal['patient', 'treatment', 'medic']
+    rows: List[dict] = Field(min_length=1, max_length=1000000)
+
+
+class ExportParams(BaseModel):
+    entity: Literal['patients', 'treatments']
+    # treatments started in the window, read from the partitions of its months
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+class ArchiveParams(BaseModel):
+    # no drop: archive jobs only move partitions to the archive schema, partitions.py --drop drops them
+    model_config = ConfigDict(extra='forbid')
+
+    before: str
+
+    @field_validator('before')
+    @classmethod
+    def keep_recent_months(cls, value: str) -> str:
+        check_archive_before(parse_month(value), ARCHIVE_KEEP_MONTHS)
+        return value
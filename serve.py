@@ -0,0 +1,77 @@
+import argparse
+import importlib.util
+import os
+
+import uvicorn
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from database import SQLALCHEMY_DATABASE_URL, ASYNC_DB, pool_settings
+
+# Production entry point: N uvicorn worker processes behind one socket, e.g.
+#
+#   python serve.py --workers 8
+#
+# Nothing database-related is created at import; every worker builds its own engines in the lifespan
+# of main.py, after it has been spawned, so pools are never shared between processes. The workers
+# together may open at most max_connections - superuser_reserved_connections - --reserve
+# connections, split evenly (see pool_settings in database.py); --reserve is left for migrations,
+# psql, populate.py and anything else that connects. With more than one worker the cache (cache.py)
+# defaults to CACHE_BACKEND=redis, shared by the workers, so a write invalidates it for all of them.
+
+RESERVED_CONNECTIONS = 10
+
+
+def connection_budget(reserve: int) -> int:
+    # one connection, closed before the workers start
+    probe = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    try:
+        with probe.connect() as connection:
+            max_connections = int(connection.execute(text("SHOW max_connections")).scalar())
+            superuser = int(connection.execute(text("SHOW superuser_reserved_connections")).scalar())
+    finally:
+        probe.dispose()
+    return max_connections - superuser - reserve
+
+
+def pool_plan(workers: int, engines: int, budget: int) -> str:
+    settings = pool_settings(engines, workers, budget)
+    per_worker = engines * (settings["pool_size"] + settings["max_overflow"])
+    return (f"{workers} workers x {engines} engine(s) x (pool_size {settings['pool_size']} + max_overflow "
+            f"{settings['max_overflow']}) = {workers * per_worker} of {budget} connections")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve main:app with several worker processes')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--budget', type=int, default=None,
+                        help='connections for all workers together, default derived from max_connections')
+    parser.add_argument('--reserve', type=int, default=RESERVED_CONNECTIONS,
+                        help='connections left free for other clients')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    budget = args.budget if args.budget is not None else connection_budget(args.reserve)
+    engines = 2 if ASYNC_DB else 1
+    if budget < args.workers * engines:
+        raise SystemExit(f'A budget of {budget} connections cannot give {args.workers} workers one each')
+    print(pool_plan(args.workers, engines, budget))
+
+    # a local cache is per worker: a write would only invalidate the entries of the worker that made it
+    if args.workers > 1:
+        backend = os.environ.setdefault("CACHE_BACKEND", "redis")
+        if backend == "redis" and importlib.util.find_spec("redis") is None:
+            raise SystemExit(f'{args.workers} workers share the cache through redis: install the redis package, '
+                             'or set CACHE_BACKEND=local to accept stale reads')
+        if backend == "local":
+            print(f'warning: CACHE_BACKEND=local with {args.workers} workers, the other workers serve stale '
+                  'entities, ETags and medic lists for up to CACHE_TTL after a write')
+        else:
+            print(f'cache: {backend}')
+
+    # read by database.py in every worker
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    os.environ["DB_CONNECTION_BUDGET"] = str(budget)
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
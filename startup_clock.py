@@ -0,0 +1,5 @@
+import time
+
+# Imported first by main.py, so app_startup_seconds{phase="import"} spans the imports of main and everything
+# they pull in. A module of its own keeps main's imports at the top of the file.
+started_at = time.perf_counter()
@@ -0,0 +1,57 @@
+from sqlalchemy import delete, func, insert, literal, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from models import Treatment, Medic, TreatmentStat
+
+# Breakdowns kept in treatment_stats, each one is a (dimension, key) -> count, total_days row set.
+# The triggers from alembic revisions 7d2f5b9c1e04 and e8c41f0a7b36 apply every change to treatments incrementally,
+# rebuild_treatment_stats recomputes everything from scratch.
+STATS_DIMENSIONS = {
+    'diagnosis': Treatment.diagnosis,
+    'current_state': Treatment.current_state,
+    'speciality': Medic.speciality,
+    'month': func.to_char(func.date_trunc('month', Treatment.date_start), 'YYYY-MM'),
+}
+
+
+def treatment_stats_query(dimension: str):
+    return (select(TreatmentStat.key, TreatmentStat.count)
+            .where(TreatmentStat.dimension == dimension, TreatmentStat.count > 0)
+            .order_by(TreatmentStat.key))
+
+
+def treatment_stats_window_query(dimension: str, *conditions):
+    # counted live, for a date_start window that only reads the partitions of its months
+    key = STATS_DIMENSIONS[dimension]
+    statement = select(key.label('key'), func.count().label('count')).select_from(Treatment)
+    if dimension == 'speciality':
+        statement = statement.join(Medic, Medic.id == Treatment.medic_id)
+    return statement.where(*conditions).group_by(key).order_by(key)
+
+
+def stats_totals(*conditions, sign: int = 1):
+    count, days = func.count(), func.sum(Treatment.date_end - Treatment.date_start)
+    return union_all(*[
+        select(literal(dimension).label('dimension'), key.label('key'), (count if sign > 0 else -count).label('count'),
+               (days if sign > 0 else -days).label('total_days'))
+        .select_from(Treatment).join(Medic, Medic.id == Treatment.medic_id).where(*conditions).group_by(key)
+        for dimension, key in STATS_DIMENSIONS.items()
+    ])
+
+
+def subtract_treatment_stats(*conditions):
+    # for rows about to leave treatments without a DELETE, a detached partition (see partitions.py)
+    statement = pg_insert(TreatmentStat).from_select(['dimension', 'key', 'count', 'total_days'],
+                                                     stats_totals(*conditions, sign=-1))
+    return statement.on_conflict_do_update(index_elements=[TreatmentStat.dimension, TreatmentStat.key], set_={
+        'count': TreatmentStat.count + statement.excluded.count,
+        'total_days': TreatmentStat.total_days + statement.excluded.total_days})
+
+
+def rebuild_treatment_stats(db: Session):
+    # writers wait until the counters are rebuilt, so no change is counted twice or lost
+    db.execute(text('LOCK TABLE treatments IN SHARE MODE'))
+    db.execute(delete(TreatmentStat))
+    db.execute(insert(TreatmentStat).from_select(['dimension', 'key', 'count', 'total_days'], stats_totals()))
+    db.commit()
@@ -0,0 +1,29 @@
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+from serialization import dumps
+
+NDJSON = 'application/x-ndjson'
+YIELD_PER = 1000
+
+
+def wants_ndjson(request: Request, stream: bool) -> bool:
+    return stream or NDJSON in request.headers.get('accept', '')
+
+
+def ndjson_lines(statement, to_dict, bind=None):
+    # Own session: a Depends(get_db) session is closed before the body is streamed; bind is the engine
+    # of the handler's session, so a read routed to a replica streams from it too.
+    # stream_results keeps a server-side cursor open and fetches YIELD_PER rows at a time.
+    db = SessionLocal() if bind is None else SessionLocal(bind=bind)
+    try:
+        result = db.execute(statement.execution_options(stream_results=True, yield_per=YIELD_PER))
+        for partition in result.partitions():
+            yield b''.join(dumps(to_dict(row)) + b'\n' for row in partition)
+    finally:
+        db.close()
+
+
+def ndjson_response(statement, to_dict=lambda row: dict(row._mapping), bind=None) -> StreamingResponse:
+    return StreamingResponse(ndjson_lines(statement, to_dict, bind), media_type=NDJSON)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+from fastapi import Request
+
+# the modules are flat at the repository root; none of these tests opens a database connection
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_request():
+    def make(query: str = '', headers: dict = None) -> Request:
+        raw_headers = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+        return Request({'type': 'http', 'method': 'GET', 'path': '/', 'query_string': query.encode(),
+                        'headers': raw_headers})
+    return make
@@ -0,0 +1,37 @@
+from datetime import date
+
+import pytest
+from pydantic import ValidationError
+
+from partitions import ARCHIVE_KEEP_MONTHS, add_months, check_archive_before, parse_month
+from schemas import ArchiveParams
+
+CURRENT = date.today().replace(day=1)
+
+
+@pytest.mark.parametrize('value', ['2024-13', '2024-1', '2024-01-01', 'january', ''])
+def test_parse_month_rejects(value):
+    with pytest.raises(ValueError):
+        parse_month(value)
+
+
+def test_parse_month():
+    assert parse_month('2024-01') == date(2024, 1, 1)
+
+
+def test_recent_months_are_kept():
+    latest = add_months(CURRENT, -1)
+    assert check_archive_before(latest) == latest
+    with pytest.raises(ValueError, match='at the latest'):
+        check_archive_before(CURRENT)
+    with pytest.raises(ValueError):
+        check_archive_before(add_months(latest, 1), keep=1)
+
+
+def test_archive_params():
+    latest_allowed = add_months(CURRENT, -ARCHIVE_KEEP_MONTHS)
+    assert ArchiveParams.model_validate({'before': f'{latest_allowed:%Y-%m}'}).before == f'{latest_allowed:%Y-%m}'
+    for params in ({'before': f'{add_months(latest_allowed, 1):%Y-%m}'}, {'before': '2024-13'},
+                   {'before': '2000-01', 'drop': True}):
+        with pytest.raises(ValidationError):
+            ArchiveParams.model_validate(params)
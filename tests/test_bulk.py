@@ -0,0 +1,33 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+import bulk
+from bulk import validate_bulk_rows
+from schemas import PatientCreate
+
+PATIENT = {"full_name": "Ann Lee", "date_of_birth": "1990-01-02", "policy_number": 123456,
+           "social_status": "student"}
+
+
+def test_valid_rows_are_kept_by_index():
+    rows = [PATIENT, {**PATIENT, "policy_number": "not a number"}, {**PATIENT, "full_name": "Bob Ray"}]
+    valid, errors = validate_bulk_rows(rows, PatientCreate)
+    assert list(valid) == [0, 2]
+    assert valid[0] == {**PATIENT, "date_of_birth": date(1990, 1, 2)}
+    assert [error.index for error in errors] == [1]
+    assert errors[0].errors[0].startswith('policy_number: ')
+
+
+def test_every_error_of_a_row_is_reported():
+    [error] = validate_bulk_rows([{"full_name": "Ann Lee"}], PatientCreate)[1]
+    assert sorted(message.split(':')[0] for message in error.errors) == [
+        'date_of_birth', 'policy_number', 'social_status']
+
+
+def test_too_many_rows(monkeypatch):
+    monkeypatch.setattr(bulk, 'BULK_MAX_ROWS', 2)
+    with pytest.raises(HTTPException) as e:
+        validate_bulk_rows([PATIENT] * 3, PatientCreate)
+    assert e.value.status_code == 413
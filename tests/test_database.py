@@ -0,0 +1,32 @@
+import pytest
+
+import database
+from database import pool_settings
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setitem(database.POOL_SETTINGS, 'pool_size', 5)
+    monkeypatch.setitem(database.POOL_SETTINGS, 'max_overflow', 10)
+
+
+def test_no_budget():
+    settings = pool_settings(engines=2, workers=8, budget=0)
+    assert (settings['pool_size'], settings['max_overflow']) == (5, 10)
+    assert settings['pool_timeout'] == database.POOL_SETTINGS['pool_timeout']
+
+
+@pytest.mark.parametrize('engines, workers, budget, expected', [
+    (1, 4, 100, (5, 10)),   # a share of 25, more than pool_size + max_overflow
+    (1, 4, 32, (5, 3)),     # overflow gives way first
+    (2, 4, 24, (3, 0)),     # then pool_size
+    (2, 8, 10, (1, 0)),     # never less than one connection
+])
+def test_budget_is_shared(engines, workers, budget, expected):
+    settings = pool_settings(engines, workers, budget)
+    assert (settings['pool_size'], settings['max_overflow']) == expected
+
+
+def test_settings_are_copied():
+    pool_settings(1, 4, 8)['pool_size'] = 0
+    assert database.POOL_SETTINGS['pool_size'] == 5
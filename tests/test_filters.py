@@ -0,0 +1,74 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from filters import filters_key, parse_fields, parse_filters, parse_value, projection
+from models import Patient, Treatment, Medic
+from schemas import PatientResponse
+
+
+def sql(condition) -> str:
+    return str(condition.compile(compile_kwargs={'literal_binds': True}))
+
+
+def test_parse_value_converts_to_the_column_type():
+    assert parse_value(Patient.date_of_birth, '1990-01-02') == date(1990, 1, 2)
+    assert parse_value(Medic.exp_years, '7') == 7
+    assert parse_value(Patient.social_status, 'student') == 'student'
+
+
+@pytest.mark.parametrize('column, raw', [(Patient.date_of_birth, '1990-13-01'), (Medic.exp_years, 'seven')])
+def test_parse_value_rejects_bad_values(column, raw):
+    with pytest.raises(HTTPException) as e:
+        parse_value(column, raw)
+    assert e.value.status_code == 400
+
+
+def test_parse_filters_operators(make_request):
+    conditions = parse_filters(make_request('date_of_birth__gte=1990-01-01&date_of_birth__lt=2000-01-01'
+                                            '&social_status=student&page=2&per_page=5&sort_by=id'), Patient)
+    assert [sql(condition) for condition in conditions] == [
+        "patients.date_of_birth >= '1990-01-01'",
+        "patients.date_of_birth < '2000-01-01'",
+        "patients.social_status = 'student'",
+    ]
+
+
+def test_parse_filters_in(make_request):
+    [condition] = parse_filters(make_request('patient_id__in=1,2,,3'), Treatment)
+    assert sql(condition) == 'treatments.patient_id IN (1, 2, 3)'
+
+
+@pytest.mark.parametrize('query', [
+    'unknown=1',                  # not a filter
+    'social_status__gte=a',       # operator not allowed on the column
+    'date_of_birth__in=2000-01-01',
+    'exp_years__like=1',
+    'patient_id__in=,',           # no values
+    'patient_id__in=' + ','.join(['1'] * 1001),
+])
+def test_parse_filters_rejects(make_request, query):
+    model = Medic if query.startswith('exp_years') else Treatment if query.startswith('patient_id') else Patient
+    with pytest.raises(HTTPException) as e:
+        parse_filters(make_request(query), model)
+    assert e.value.status_code == 400
+
+
+def test_filters_key_is_normalized(make_request):
+    first = filters_key(make_request('social_status=a&medic_id=3&page=2&cursor=x&fields=id'))
+    second = filters_key(make_request('fields=id&medic_id=3&social_status=a&per_page=50'))
+    assert first == second == 'fields=id&medic_id=3&social_status=a'
+
+
+def test_parse_fields():
+    assert parse_fields(None, PatientResponse) is None
+    assert parse_fields(' full_name, id,full_name ', PatientResponse) == ['full_name', 'id']
+    for fields in ('', ',', 'id,password'):
+        with pytest.raises(HTTPException):
+            parse_fields(fields, PatientResponse)
+
+
+def test_projection_appends_extra_columns_once():
+    columns = projection(Patient, ['full_name', 'id'], 'id', 'version')
+    assert [column.key for column in columns] == ['full_name', 'id', 'version']
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from fastapi import Response
+
+from http_cache import conditional, entity_etag, etag_matches, not_modified_since, page_etag, stats_etag
+
+MODIFIED = datetime(2026, 10, 18, 12, 30, 15, 500000, tzinfo=timezone.utc)
+
+
+def rows(*pairs):
+    return [SimpleNamespace(id=id_, version=version) for id_, version in pairs]
+
+
+def test_etags():
+    assert entity_etag('patient', 3, 2) == '"patient-3-2"'
+    stats = stats_etag('month', [('2026-09', 3), ('2026-10', 5)])
+    assert stats.startswith('"stats-month-') and stats != stats_etag('month', [('2026-09', 3), ('2026-10', 6)])
+    page = page_etag('patients', rows((1, 1), (2, 1)))
+    assert page.startswith('"patients-') and page == page_etag('patients', rows((1, 1), (2, 1)))
+    assert page != page_etag('patients', rows((1, 1), (2, 2)))
+    assert page != page_etag('patients', rows((1, 1), (2, 1)), 'id,full_name')
+
+
+def test_etag_matches(make_request):
+    etag = '"patient-3-2"'
+    assert not etag_matches(make_request(), etag)
+    assert etag_matches(make_request(headers={'If-None-Match': etag}), etag)
+    assert etag_matches(make_request(headers={'If-None-Match': f'"other", W/{etag}'}), etag)
+    assert etag_matches(make_request(headers={'If-None-Match': '*'}), etag)
+    assert not etag_matches(make_request(headers={'If-None-Match': '"patient-3-1"'}), etag)
+
+
+def test_not_modified_since(make_request):
+    same_second = 'Sun, 18 Oct 2026 12:30:15 GMT'
+    assert not_modified_since(make_request(headers={'If-Modified-Since': same_second}), MODIFIED)
+    assert not not_modified_since(make_request(headers={'If-Modified-Since': 'Sun, 18 Oct 2026 12:30:14 GMT'}),
+                                  MODIFIED)
+    assert not not_modified_since(make_request(headers={'If-Modified-Since': 'yesterday'}), MODIFIED)
+    # If-None-Match takes precedence
+    assert not not_modified_since(make_request(headers={'If-Modified-Since': same_second, 'If-None-Match': '"x"'}),
+                                  MODIFIED)
+
+
+def test_conditional(make_request):
+    response = Response()
+    assert conditional(make_request(), response, '"a"', MODIFIED) is None
+    assert response.headers['etag'] == '"a"'
+    assert response.headers['last-modified'] == 'Sun, 18 Oct 2026 12:30:15 GMT'
+
+    not_modified = conditional(make_request(headers={'If-None-Match': '"a"'}), Response(), '"a"')
+    assert not_modified.status_code == 304 and not_modified.headers['etag'] == '"a"'
+
+    later = (MODIFIED + timedelta(days=1)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    assert conditional(make_request(headers={'If-Modified-Since': later}), Response(), '"a"',
+                       MODIFIED).status_code == 304
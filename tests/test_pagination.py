@@ -0,0 +1,105 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from models import Patient, Treatment
+from pagination import (check_order, decode_cursor, encode_cursor, keyset_query, page_rows, sort_column,
+                        sort_order, sortable_columns)
+
+
+def sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def test_sortable_columns():
+    assert 'medic_id' in sortable_columns(Patient)
+    for column in ('version', 'search_data', 'search_vector'):
+        assert column not in sortable_columns(Patient)
+    with pytest.raises(HTTPException):
+        sort_column(Patient, 'search_vector')
+
+
+def test_check_order():
+    assert check_order('DESC') == 'desc'
+    with pytest.raises(HTTPException):
+        check_order('sideways')
+
+
+@pytest.mark.parametrize('sort_by, value', [('id', 5), ('date_start', date(2026, 10, 1)), ('diagnosis', 'flu')])
+def test_cursor_round_trip(sort_by, value):
+    row = SimpleNamespace(id=5, date_start=date(2026, 10, 1), diagnosis='flu')
+    cursor = encode_cursor(sort_by, 'asc', row)
+    assert '=' not in cursor
+    assert decode_cursor(cursor, Treatment, sort_by, 'asc') == (value, 5)
+
+
+def test_cursor_with_null_value():
+    cursor = encode_cursor('medic_id', 'desc', SimpleNamespace(id=9, medic_id=None))
+    assert decode_cursor(cursor, Patient, 'medic_id', 'desc') == (None, 9)
+
+
+TRUNCATED = encode_cursor('id', 'asc', SimpleNamespace(id=1))[:-2]
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'bm90IGpzb24', TRUNCATED])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor, Treatment, 'id', 'asc')
+    assert e.value.status_code == 400
+
+
+def test_cursor_must_match_sort():
+    cursor = encode_cursor('id', 'asc', SimpleNamespace(id=1))
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor, Treatment, 'id', 'desc')
+    assert e.value.detail == 'Cursor does not match sort_by/order.'
+
+
+def test_page_rows():
+    rows = [SimpleNamespace(id=n) for n in range(1, 5)]
+    page, cursor = page_rows(rows, 'id', 'asc', 3)
+    assert [row.id for row in page] == [1, 2, 3]
+    assert decode_cursor(cursor, Treatment, 'id', 'asc') == (3, 3)
+    assert page_rows(rows[:3], 'id', 'asc', 3) == (rows[:3], None)
+
+
+def test_keyset_query_first_page():
+    statement = sql(keyset_query(select(Treatment.id), Treatment, 'diagnosis', 'desc', 10, offset=20))
+    assert 'ORDER BY treatments.diagnosis DESC, treatments.id DESC' in statement
+    assert 'LIMIT 11 OFFSET 20' in statement
+
+
+def test_keyset_query_next_page_bounds_the_sort_column():
+    cursor = encode_cursor('date_start', 'asc', SimpleNamespace(id=7, date_start=date(2026, 10, 1)))
+    statement = sql(keyset_query(select(Treatment.id), Treatment, 'date_start', 'asc', 10, cursor, offset=20))
+    assert "(treatments.date_start, treatments.id) > ('2026-10-01', 7)" in statement
+    # the plain bound that prunes partitions; a cursor replaces the offset
+    assert "treatments.date_start >= '2026-10-01'" in statement
+    assert 'OFFSET 0' in statement
+
+
+def test_keyset_query_nullable_column():
+    cursor = encode_cursor('medic_id', 'asc', SimpleNamespace(id=7, medic_id=3))
+    statement = sql(keyset_query(select(Patient.id), Patient, 'medic_id', 'asc', 10, cursor))
+    assert 'patients.medic_id > 3 OR patients.medic_id IS NULL' in statement
+    assert 'ORDER BY patients.medic_id ASC NULLS LAST, patients.id ASC' in statement
+    cursor = encode_cursor('medic_id', 'desc', SimpleNamespace(id=7, medic_id=None))
+    statement = sql(keyset_query(select(Patient.id), Patient, 'medic_id', 'desc', 10, cursor))
+    assert 'patients.medic_id IS NOT NULL OR patients.id < 7' in statement
+    assert 'ORDER BY patients.medic_id DESC NULLS FIRST, patients.id DESC' in statement
+
+
+def test_sort_order():
+    def order_by(sort_by, order):
+        return sql(select(Patient.id).order_by(*sort_order(Patient, sort_by, order))).split('ORDER BY ')[1]
+
+    assert order_by('id', 'DESC') == 'patients.id DESC'
+    assert order_by('full_name', 'asc') == 'patients.full_name ASC, patients.id ASC'
+    assert order_by('medic_id', 'desc') == 'patients.medic_id DESC NULLS FIRST, patients.id DESC'
+    for sort_by, order in (('medic', 'asc'), ('search_vector', 'asc'), ('id', 'sideways')):
+        with pytest.raises(HTTPException):
+            sort_order(Patient, sort_by, order)
@@ -0,0 +1,28 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from partitions import add_months, partition_name, started_between
+
+
+@pytest.mark.parametrize('month, months, expected', [
+    (date(2026, 10, 1), 0, date(2026, 10, 1)),
+    (date(2026, 10, 1), 3, date(2027, 1, 1)),
+    (date(2026, 1, 1), -1, date(2025, 12, 1)),
+    (date(2026, 1, 1), -25, date(2023, 12, 1)),
+])
+def test_add_months(month, months, expected):
+    assert add_months(month, months) == expected
+
+
+def test_partition_name():
+    assert partition_name(date(2026, 3, 1)) == 'treatments_y2026m03'
+
+
+def test_started_between():
+    assert started_between(None, None) == []
+    conditions = started_between(date(2026, 1, 1), date(2026, 3, 31))
+    assert [str(condition.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+            for condition in conditions] == ["treatments.date_start >= '2026-01-01'",
+                                             "treatments.date_start <= '2026-03-31'"]
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from populate import PolicyNumbers, copy_value
+
+
+class TakenNumbers:
+    # stands in for the session PolicyNumbers reads the existing numbers with
+    def __init__(self, numbers):
+        self.numbers = numbers
+
+    def scalars(self, statement):
+        return self.numbers
+
+
+def test_copy_value():
+    assert copy_value(None) == '\\N'
+    assert copy_value(42) == '42'
+    assert copy_value('a\tb\nc\rd\\e') == 'a\\tb\\nc\\rd\\\\e'
+    # an escaped value is still one field of one line
+    assert '\t' not in copy_value('a\tb') and '\n' not in copy_value('a\nb')
+
+
+def test_policy_numbers_are_unique_and_skip_taken():
+    taken = set(range(100000, 100500))
+    numbers = PolicyNumbers(TakenNumbers(taken), needed=5000, rng=random.Random(1))
+    generated = [next(numbers) for _ in range(5000)]
+    assert len(set(generated)) == 5000
+    assert not taken & set(generated)
+    assert all(100000 <= number < 1000000 for number in generated)
+
+
+def test_policy_numbers_are_seeded():
+    first = PolicyNumbers(TakenNumbers([]), needed=10, rng=random.Random(7))
+    second = PolicyNumbers(TakenNumbers([]), needed=10, rng=random.Random(7))
+    assert [next(first) for _ in range(10)] == [next(second) for _ in range(10)]
+
+
+def test_policy_numbers_widen_the_space_when_needed():
+    numbers = PolicyNumbers(TakenNumbers([]), needed=900001, rng=random.Random(1))
+    assert numbers.span == 900000000
+
+
+def test_policy_number_space_exhausted():
+    # a space of ten numbers, all taken
+    numbers = PolicyNumbers(TakenNumbers(range(100000, 100010)), needed=0, rng=random.Random(1))
+    numbers.span = numbers.left = 10
+    numbers.current, numbers.step = 0, 1
+    with pytest.raises(RuntimeError, match='exhausted'):
+        next(numbers)
@@ -0,0 +1,27 @@
+from datetime import date
+
+import pytest
+from pydantic import ValidationError
+
+from schemas import TreatmentCreate, TreatmentPatch
+
+TREATMENT = {"diagnosis": "flu", "current_state": "ok", "date_start": "2026-10-01", "date_end": "2026-10-01",
+             "patient_id": 1, "medic_id": 1}
+
+
+def test_period_of_one_day():
+    assert TreatmentCreate.model_validate(TREATMENT).date_end == date(2026, 10, 1)
+
+
+@pytest.mark.parametrize('schema, body', [
+    (TreatmentCreate, {**TREATMENT, "date_end": "2026-09-30"}),
+    (TreatmentPatch, {"date_start": "2026-10-01", "date_end": "2026-09-30"}),
+])
+def test_reversed_period(schema, body):
+    with pytest.raises(ValidationError, match='date_end must not be before date_start'):
+        schema.model_validate(body)
+
+
+def test_patch_of_one_date_is_left_to_the_constraint():
+    # the other date is in the rows, ck_treatments_period compares them
+    assert TreatmentPatch.model_validate({"date_end": "2000-01-01"}).date_end == date(2000, 1, 1)
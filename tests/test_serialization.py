@@ -0,0 +1,52 @@
+import json
+from datetime import date
+
+import pytest
+from fastapi import Response
+
+import serialization
+from serialization import encode_rows, rows_response, wants_columnar
+
+FIELDS = ['id', 'full_name', 'date_of_birth']
+ROWS = [(1, 'Ann', date(1990, 1, 2)), (2, 'Bob', date(1985, 5, 6))]
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    # both paths give the same JSON
+    if request.param == 'json':
+        monkeypatch.setattr(serialization, 'orjson', None)
+    elif serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+
+
+def test_rows(encoder):
+    assert json.loads(encode_rows(ROWS, FIELDS)) == [
+        {'id': 1, 'full_name': 'Ann', 'date_of_birth': '1990-01-02'},
+        {'id': 2, 'full_name': 'Bob', 'date_of_birth': '1985-05-06'},
+    ]
+
+
+def test_columnar(encoder):
+    assert json.loads(encode_rows(ROWS, FIELDS, columnar=True)) == {
+        'id': [1, 2], 'full_name': ['Ann', 'Bob'], 'date_of_birth': ['1990-01-02', '1985-05-06']}
+
+
+def test_cached_dicts_are_read_by_name(encoder):
+    cached = [{'date_of_birth': '1990-01-02', 'full_name': 'Ann', 'id': 1, 'version': 3}]
+    assert json.loads(encode_rows(cached, ['id', 'full_name'])) == [{'id': 1, 'full_name': 'Ann'}]
+    assert json.loads(encode_rows([], FIELDS, columnar=True)) == {'id': [], 'full_name': [], 'date_of_birth': []}
+
+
+def test_unknown_types_are_refused(encoder):
+    with pytest.raises(TypeError):
+        serialization.dumps({'value': object()})
+
+
+def test_rows_response_keeps_headers(make_request):
+    response = Response(headers={'X-Next-Cursor': 'abc', 'ETag': '"p"'})
+    sent = rows_response(ROWS, FIELDS, response)
+    assert sent.media_type == 'application/json'
+    assert sent.headers['x-next-cursor'] == 'abc' and sent.headers['etag'] == '"p"'
+    assert wants_columnar(make_request('format=columnar'))
+    assert not wants_columnar(make_request('format=rows'))
@@ -0,0 +1,38 @@
+from datetime import date
+
+from sqlalchemy.dialects import postgresql
+
+from models import Treatment
+from stats import STATS_DIMENSIONS, subtract_treatment_stats, treatment_stats_query, treatment_stats_window_query
+
+
+def sql(statement) -> str:
+    return ' '.join(str(statement.compile(dialect=postgresql.dialect(),
+                                          compile_kwargs={'literal_binds': True})).split())
+
+
+def test_stats_dimensions():
+    assert set(STATS_DIMENSIONS) == {'diagnosis', 'current_state', 'speciality', 'month'}
+
+
+def test_treatment_stats_query_reads_the_counters():
+    assert sql(treatment_stats_query('diagnosis')) == (
+        "SELECT treatment_stats.key, treatment_stats.count FROM treatment_stats "
+        "WHERE treatment_stats.dimension = 'diagnosis' AND treatment_stats.count > 0 ORDER BY treatment_stats.key")
+
+
+def test_window_query_counts_live():
+    assert sql(treatment_stats_window_query('speciality', Treatment.date_start >= date(2026, 1, 1))) == (
+        "SELECT medics.speciality AS key, count(*) AS count FROM treatments JOIN medics ON medics.id = "
+        "treatments.medic_id WHERE treatments.date_start >= '2026-01-01' GROUP BY medics.speciality "
+        "ORDER BY medics.speciality")
+    assert 'JOIN' not in sql(treatment_stats_window_query('diagnosis'))
+
+
+def test_subtract_treatment_stats():
+    statement = sql(subtract_treatment_stats(Treatment.date_start < date(2026, 1, 1)))
+    # every dimension, negated, added onto the counters
+    assert statement.count('-count(*) AS count, -sum(treatments.date_end - treatments.date_start)') == 4
+    assert statement.count("WHERE treatments.date_start < '2026-01-01'") == 4
+    assert statement.endswith('ON CONFLICT (dimension, key) DO UPDATE SET count = (treatment_stats.count + '
+                              'excluded.count), total_days = (treatment_stats.total_days + excluded.total_days)')
@@ -0,0 +1,16 @@
+import pytest
+from fastapi import HTTPException
+
+from main import prefix_tsquery
+
+
+def test_prefix_tsquery():
+    assert prefix_tsquery("Joh o'Brien") == 'Joh:* & o & Brien:*'
+    assert prefix_tsquery('Li Wei') == 'Li & Wei:*'
+
+
+@pytest.mark.parametrize('q', ['', ' -!', 'a', 'a b Jo'])
+def test_prefix_tsquery_rejects(q):
+    with pytest.raises(HTTPException) as e:
+        prefix_tsquery(q)
+    assert e.value.status_code == 400
@@ -0,0 +1,42 @@
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+
+from models import Treatment
+from schemas import TreatmentPatch
+from writes import treatments_matching, update_treatments_by_ids
+
+
+def sql(statement) -> str:
+    return ' '.join(str(statement.compile(dialect=postgresql.dialect(),
+                                          compile_kwargs={'literal_binds': True})).split())
+
+
+def test_patch_keeps_the_fields_that_are_sent():
+    assert TreatmentPatch.model_validate({'current_state': 'recovered'}).model_dump(exclude_unset=True) == {
+        'current_state': 'recovered'}
+    assert TreatmentPatch.model_validate({}).model_dump(exclude_unset=True) == {}
+
+
+@pytest.mark.parametrize('field', list(TreatmentPatch.model_fields))
+def test_patch_rejects_null(field):
+    with pytest.raises(ValidationError) as e:
+        TreatmentPatch.model_validate({field: None})
+    [error] = e.value.errors()
+    assert error['loc'] == (field,) and 'must not be null' in error['msg']
+
+
+def test_treatments_matching():
+    assert sql(treatments_matching('flu', 'ok', after_id=7, limit=10)) == (
+        "SELECT treatments.id FROM treatments WHERE treatments.diagnosis = 'flu' AND treatments.current_state = 'ok' "
+        "AND treatments.id > 7 ORDER BY treatments.id LIMIT 10")
+    assert 'LIMIT' not in sql(treatments_matching('flu', 'ok'))
+
+
+def test_update_treatments_by_ids_locks_in_id_order():
+    statement = sql(update_treatments_by_ids(treatments_matching('flu', 'ok', limit=10), {'current_state': 'x'},
+                                             Treatment.id, Treatment.version))
+    assert statement == (
+        "UPDATE treatments SET current_state='x' WHERE treatments.id IN (SELECT treatments.id FROM treatments "
+        "WHERE treatments.diagnosis = 'flu' AND treatments.current_state = 'ok' AND treatments.id > 0 "
+        "ORDER BY treatments.id LIMIT 10 FOR UPDATE) RETURNING treatments.id, treatments.version")
@@ -0,0 +1,48 @@
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased, selectinload
+
+from models import Treatment
+from pagination import keyset_query
+
+# Patient charts: a patient with its treatments in date_start order, each with its attending medic
+# (treatments.medic_id) and the medics linked through treatment_medic. Whatever the number of
+# treatments it takes a fixed number of statements: the patients, their treatments, then one
+# SELECT ... WHERE id IN (...) per relationship from selectinload. Both timelines walk
+# ix_treatments_patient_id_date_start_id.
+
+TIMELINE_MAX_IDS = 100
+
+
+def treatment_window(date_from: Optional[date], date_to: Optional[date]) -> list:
+    # treatments overlapping [date_from, date_to]
+    conditions = []
+    if date_from is not None:
+        conditions.append(Treatment.date_end >= date_from)
+    if date_to is not None:
+        conditions.append(Treatment.date_start <= date_to)
+    return conditions
+
+
+def with_medics(statement, treatment=Treatment):
+    return statement.options(selectinload(treatment.medic), selectinload(treatment.medics))
+
+
+def timeline_query(patient_id: int, window: list, per_page: int, cursor: Optional[str] = None):
+    # keyset on (date_start, id) within the patient, one look-ahead row like the list endpoints
+    statement = select(Treatment).where(Treatment.patient_id == patient_id, *window)
+    return with_medics(keyset_query(statement, Treatment, "date_start", "asc", per_page, cursor))
+
+
+def batch_timeline_query(patient_ids: list, window: list, per_patient: int):
+    # the first per_patient treatments of every patient, plus one to tell if there are more
+    position = func.row_number().over(partition_by=Treatment.patient_id,
+                                      order_by=(Treatment.date_start, Treatment.id)).label("position")
+    ranked = select(Treatment, position).where(Treatment.patient_id.in_(patient_ids), *window).subquery()
+    treatment = aliased(Treatment, ranked)
+    statement = (select(treatment)
+                 .where(ranked.c.position <= per_patient + 1)
+                 .order_by(treatment.patient_id, treatment.date_start, treatment.id))
+    return with_medics(statement, treatment)
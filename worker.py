@@ -0,0 +1,160 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+import psycopg2
+from pydantic import ValidationError
+from sqlalchemy import func
+
+from database import SessionLocal, init_engines
+from models import Job
+from jobs import (JOB_KINDS, JOB_LEASE_SECONDS, JobCancelled, JobLost, Progress, claim, extend_lease, fail, finish,
+                  purge_finished, requeue_expired)
+from partitions import PARTITION_CHECK_INTERVAL, ensure_partitions
+
+# Runs the background jobs of jobs.py, e.g. next to serve.py:
+#
+#   python worker.py --processes 4
+#   python worker.py --kinds export,import
+#   python worker.py --once              # what is queued now, then exit
+#
+# Each process takes one job at a time and builds its own engine after it has started, like the API
+# workers. Idle, it waits on LISTEN jobs (NOTIFY from the insert trigger) and polls every
+# JOB_POLL_INTERVAL for retries coming due. SIGTERM or Ctrl-C lets the running jobs finish.
+# The workers also create the upcoming monthly partitions of treatments (see partitions.py), so that DDL
+# runs here and not in the API processes.
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# lost workers' jobs are requeued and old jobs purged at most this often, by whichever process is idle
+HOUSEKEEPING_INTERVAL = 30.0
+
+worker_log = logging.getLogger("worker")
+
+
+def keep_lease(job_id: int, worker: str, done: threading.Event):
+    # renews the lease while the handler runs, also for those that never report progress;
+    # those run to the end even when cancelled
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        with SessionLocal() as db:
+            renewed = db.scalar(extend_lease(job_id, worker))
+            db.commit()
+        if renewed is None:
+            return
+
+
+def run_job(job: Job, worker: str):
+    kind = JOB_KINDS[job.kind]
+    done = threading.Event()
+    threading.Thread(target=keep_lease, args=(job.id, worker, done), daemon=True).start()
+    status, values, retry = 'succeeded', {}, kind.retry
+    try:
+        params = kind.params.model_validate(job.params)
+        values = {'result': kind.handler(job, params, Progress(job.id, worker)),
+                  'progress_done': func.greatest(Job.progress_done, Job.progress_total)}
+    except JobCancelled:
+        status = 'cancelled'
+    except JobLost:
+        worker_log.warning("job %s: lease lost, left to the worker that has it now", job.id)
+        return
+    except Exception as e:
+        worker_log.exception("job %s (%s) failed, attempt %s of %s", job.id, job.kind, job.attempts,
+                             job.max_attempts)
+        status, values = 'failed', {'error': f'{type(e).__name__}: {e}'}
+        # params valid when submitted but not for this version of the handler: another attempt fails the same
+        retry = retry and not isinstance(e, ValidationError)
+    finally:
+        done.set()
+    with SessionLocal() as db:
+        if status == 'failed':
+            fail(db, job, worker, values['error'], retry)
+        else:
+            finish(db, job.id, worker, status, **values)
+        db.commit()
+    worker_log.info("job %s (%s): %s", job.id, job.kind, status)
+
+
+def housekeeping():
+    with SessionLocal() as db:
+        requeued, purged = requeue_expired(db), purge_finished(db)
+        db.commit()
+    if requeued or purged:
+        worker_log.warning("%s jobs with an expired lease requeued, %s finished jobs purged", requeued, purged)
+
+
+def check_partitions():
+    # a failure, e.g. the lock timeout, is tried again at the next interval
+    try:
+        ensure_partitions()
+    except Exception:
+        worker_log.exception("partition maintenance failed")
+
+
+def listen(engine):
+    connection = psycopg2.connect(**engine.url.translate_connect_args(username='user', database='dbname'))
+    connection.autocommit = True
+    connection.cursor().execute("LISTEN jobs")
+    return connection
+
+
+def run_worker(kinds: list, once: bool):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    listener = listen(init_engines())
+    housekept_at = partitions_checked_at = 0.0
+    try:
+        while not stopping.is_set():
+            if time.monotonic() - housekept_at > HOUSEKEEPING_INTERVAL:
+                housekeeping()
+                housekept_at = time.monotonic()
+            if time.monotonic() - partitions_checked_at > PARTITION_CHECK_INTERVAL:
+                check_partitions()
+                partitions_checked_at = time.monotonic()
+            # expire_on_commit=False: the claimed row stays readable once the claim is committed
+            with SessionLocal(expire_on_commit=False) as db:
+                job = claim(db, worker, kinds)
+                db.commit()
+            if job is not None:
+                run_job(job, worker)
+                continue
+            if once:
+                break
+            if select.select([listener], [], [], JOB_POLL_INTERVAL)[0]:
+                listener.poll()
+                listener.notifies.clear()
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the background jobs queued in the jobs table')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes, one job at a time each')
+    parser.add_argument('--kinds', default=','.join(JOB_KINDS), help='comma separated kinds of job to take')
+    parser.add_argument('--once', action='store_true', help='exit once no job is ready')
+    args = parser.parse_args()
+
+    kinds = args.kinds.split(',')
+    unknown = set(kinds) - set(JOB_KINDS)
+    if unknown:
+        raise SystemExit(f'Unknown job kinds: {", ".join(sorted(unknown))}')
+    if args.processes == 1:
+        run_worker(kinds, args.once)
+    else:
+        # spawn, not fork: nothing of this process, engines included, reaches the workers
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=run_worker, args=(kinds, args.once)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        # Ctrl-C reaches the workers through the process group, SIGTERM is passed on
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+        for process in processes:
+            process.join()
@@ -0,0 +1,65 @@
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, update
+
+from models import Patient, Treatment
+
+# Single-statement write path shared by the sync and async handlers:
+# every statement RETURNs the response columns, so no SELECT before or refresh after.
+
+
+def response_columns(model, schema):
+    return [getattr(model, field) for field in schema.model_fields]
+
+
+def insert_returning(model, schema, values: dict):
+    return insert(model).values(**values).returning(*response_columns(model, schema))
+
+
+def create_treatment_statement(values: dict, schema):
+    # INSERT the treatment and point the patient at its medic (for patient_with_medic)
+    # in one round trip: WITH new_treatment AS (INSERT ... RETURNING) UPDATE patients ... RETURNING
+    new_treatment = insert(Treatment).values(**values).returning(*response_columns(Treatment, schema)) \
+        .cte('new_treatment')
+    # on the Table, not the mapped class: an ORM-enabled UPDATE drops RETURNING of CTE columns
+    patients = Patient.__table__
+    return (update(patients)
+            .where(patients.c.id == new_treatment.c.patient_id)
+            .values(medic_id=new_treatment.c.medic_id)
+            .returning(*[new_treatment.c[field] for field in schema.model_fields]))
+
+
+def update_returning(model, schema, id_: int, values: dict):
+    return update(model).where(model.id == id_).values(**values).returning(*response_columns(model, schema))
+
+
+def delete_returning_treatments(model, id_: int, treatment_fk):
+    # DELETE the row and list the treatments its FK cascade removes, for cache invalidation.
+    # The SELECT runs on the snapshot before the delete, so the treatments are still visible.
+    deleted = delete(model).where(model.id == id_).returning(model.id).cte('deleted')
+    return (select(deleted.c.id, Treatment.id.label('treatment_id'))
+            .select_from(deleted)
+            .outerjoin(Treatment, treatment_fk == deleted.c.id))
+
+
+def detach_patients(medic_id: int):
+    # patients.medic_id has no ON DELETE action
+    return update(Patient).where(Patient.medic_id == medic_id).values(medic_id=None)
+
+
+def treatments_matching(diagnosis: str, current_state: str, after_id: int = 0, limit: Optional[int] = None):
+    # ids in primary key order: the keyset lets a chunked update resume after the last id
+    # even when it does not change diagnosis/current_state
+    query = (select(Treatment.id)
+             .where(Treatment.diagnosis == diagnosis, Treatment.current_state == current_state, Treatment.id > after_id)
+             .order_by(Treatment.id))
+    return query if limit is None else query.limit(limit)
+
+
+def update_treatments_by_ids(ids_query, values: dict, *returning):
+    # rows are locked in id order by the FOR UPDATE, so two bulk updates cannot deadlock
+    return (update(Treatment)
+            .where(Treatment.id.in_(ids_query.with_for_update().scalar_subquery()))
+            .values(**values)
+            .returning(*(returning or (Treatment.id,)))
+            .execution_options(synchronize_session=False))